@@ -0,0 +1,5 @@
+"""
+This conftest.py file puts the root of the repository on sys.path when
+pytest runs, so the tests import the tools package, which setup.py does
+not install, whatever directory pytest is run from.
+"""
@@ -3,7 +3,8 @@ This file manages Deterministic-optimizing libaries for the D3ploy cyclus module
 
 """
 import numpy as np
-import statsmodels.tsa.holtwinters as hw
+
+from d3ploy.accumulator import series_values
 
 
 def polyfit_regression(ts, back_steps=10, degree=1):
@@ -24,7 +25,7 @@ def polyfit_regression(ts, back_steps=10, degree=1):
     x : The predicted value from the fit polynomial.
     """
     time = range(1, len(ts) + 1)
-    timeseries = np.array(list(ts.values()))
+    timeseries = series_values(ts, back_steps)
     fit = np.polyfit(time[-back_steps:],
                      timeseries[-back_steps:], deg=degree)
     eq = np.poly1d(fit)
@@ -32,6 +33,43 @@ def polyfit_regression(ts, back_steps=10, degree=1):
     return x
 
 
+def fit_smoothing(model, ts, back_steps=10):
+    """
+    Fits statsmodels exponential smoothing [model] to the last
+    [back_steps] entries of timeseries [ts].
+    Returns:
+    --------
+    model_fit : The fit model.
+    n : The number of values the model was fit to.
+    """
+    timeseries = series_values(ts, back_steps)
+    # exponential smoothing errors when there is only one datapoint
+    if len(timeseries) == 1:
+        timeseries = np.append(timeseries, timeseries[-1])
+    # exponential smoothing errors when there are five datapoints
+    # average is appended to the beginning of the timeseries for minimal impact
+    # https://github.com/statsmodels/statsmodels/issues/4878
+    elif len(timeseries) == 5:
+        timeseries = np.append(np.mean(timeseries), timeseries)
+    return model(timeseries).fit(), len(timeseries)
+
+
+def smoothing_response(model_fit, length):
+    """
+    Returns the change of the forecasts 1 to [length] timesteps ahead of
+    exponential smoothing [model_fit] per unit error of the next value:
+    the level moves by alpha times the error, and the trend, if the
+    model has one, by beta times the move of the level.
+    """
+    params = model_fit.params
+    alpha = params['smoothing_level']
+    beta = params.get('smoothing_trend', params.get('smoothing_slope'))
+    response = np.full(length, alpha, dtype=float)
+    if beta is not None and not np.isnan(beta):
+        response += alpha * beta * np.arange(1, length + 1)
+    return response
+
+
 def exp_smoothing(ts, back_steps=10, degree=1):
     """
     Predicts next value using simple exponential smoothing.
@@ -45,22 +83,23 @@ def exp_smoothing(ts, back_steps=10, degree=1):
     x : The predicted value from the exponential smoothing method.
 
     """
-    timeseries = np.array(list(ts.values()))
-    timeseries = timeseries[-back_steps:]
-    if len(timeseries) == 1:
-        timeseries = np.append(timeseries, timeseries[-1])
-    # exponential smoothing errors when there are five datapoints
-    # average is appended to the beginning of the timeseries for minimal impact
-    # https://github.com/statsmodels/statsmodels/issues/4878
-    elif len(timeseries) == 5:
-        timeseries = np.append(np.mean(timeseries), timeseries)
-
-    model = hw.SimpleExpSmoothing(timeseries)
-    model_fit = model.fit()
-    x = model_fit.predict(len(timeseries), len(timeseries))
+    import statsmodels.tsa.holtwinters as hw
+    model_fit, n = fit_smoothing(hw.SimpleExpSmoothing, ts, back_steps)
+    x = model_fit.predict(n, n)
     return x[0]
 
 
+def exp_smoothing_path(ts, length, back_steps=10, degree=1):
+    """
+    Returns the forecast path of exp_smoothing, 1 to [length] timesteps
+    ahead, zero standard errors and its response.
+    """
+    import statsmodels.tsa.holtwinters as hw
+    model_fit, n = fit_smoothing(hw.SimpleExpSmoothing, ts, back_steps)
+    return np.asarray(model_fit.predict(n, n + length - 1)), \
+        np.zeros(length), smoothing_response(model_fit, length)
+
+
 def holt_winters(ts, back_steps=10, degree=1):
     """
     Predicts next value using triple exponential smoothing
@@ -73,25 +112,34 @@ def holt_winters(ts, back_steps=10, degree=1):
     --------
     x : The predicted value from the holt-winters method.
     """
-    timeseries = np.array(list(ts.values()))
-    timeseries = timeseries[-back_steps:]
-    # exponential smoothing errors when there is only one datapoint
-    if len(timeseries) == 1:
-        timeseries = np.append(timeseries, timeseries[-1])
-    # exponential smoothing errors when there are five datapoints
-    # average is appended to the beginning of the timeseries for minimal impact
-    # https://github.com/statsmodels/statsmodels/issues/4878
-    elif len(timeseries) == 5:
-        timeseries = np.append(np.mean(timeseries), timeseries)
-    model = hw.ExponentialSmoothing(timeseries)
-    model_fit = model.fit()
-    x = model_fit.predict(len(timeseries), len(timeseries))
+    import statsmodels.tsa.holtwinters as hw
+    model_fit, n = fit_smoothing(hw.ExponentialSmoothing, ts, back_steps)
+    x = model_fit.predict(n, n)
     return x[0]
 
 
+def holt_winters_path(ts, length, back_steps=10, degree=1):
+    """
+    Returns the forecast path of holt_winters, 1 to [length] timesteps
+    ahead, zero standard errors and its response.
+    """
+    import statsmodels.tsa.holtwinters as hw
+    model_fit, n = fit_smoothing(hw.ExponentialSmoothing, ts, back_steps)
+    return np.asarray(model_fit.predict(n, n + length - 1)), \
+        np.zeros(length), smoothing_response(model_fit, length)
+
+
 def fft(ts, back_steps=1e6, degree=1):
-    timeseries = np.array(list(ts.values()))
-    timeseries = timeseries[-back_steps:]
+    return fft_path(ts, 1, back_steps=back_steps, degree=degree)[0][0]
+
+
+def fft_path(ts, length, back_steps=1e6, degree=1):
+    """
+    Returns the forecast path of fft, the harmonics and trend fit to
+    timeseries [ts] evaluated 1 to [length] timesteps ahead, zero
+    standard errors and a zero response, as the fit is deterministic.
+    """
+    timeseries = series_values(ts, int(back_steps))
     n = timeseries.size
     n_harm = 100                    # number of harmonics in model
     t = np.arange(0, n)
@@ -103,7 +151,7 @@ def fft(ts, back_steps=1e6, degree=1):
     # sort indexes by frequency, lower -> higher
     indexes.sort(key=lambda i: np.absolute(f[i]))
 
-    t = np.arange(0, n + 1)
+    t = np.arange(n, n + length)
     restored_sig = np.zeros(t.size)
     for i in indexes[:1 + n_harm * 2]:
         ampli = np.absolute(x_freqdom[i]) / n   # amplitude
@@ -111,4 +159,4 @@ def fft(ts, back_steps=1e6, degree=1):
         restored_sig += ampli * np.cos(2 * np.pi * f[i] * t + phase)
     fft_fit = restored_sig + p[0] * t
 
-    return fft_fit[-1]
+    return fft_fit, np.zeros(length), np.zeros(length)
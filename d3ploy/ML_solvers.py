@@ -1,10 +1,13 @@
 import numpy
-from pmdarima.arima import auto_arima
 import d3ploy.NO_solvers as no
+from d3ploy.accumulator import series_values
 
 
-def stepwise_seasonal(ts, period=5):
-    data = list(ts.values())
+def stepwise_seasonal(ts, period=5, memo=None):
+    if memo is not None and memo.skip():
+        return no.predict_ma(ts)
+    from pmdarima.arima import auto_arima
+    data = series_values(ts)
     if len(data) == 1:
         return no.predict_ma(ts)
     try:
@@ -17,6 +20,114 @@ def stepwise_seasonal(ts, period=5):
                                     stepwise=True)
         stepwise_model.fit(data)
         future_forecast = stepwise_model.predict(n_periods=1)[-1]
-    except:
+    except Exception as e:
+        if memo is not None:
+            memo.failure(e)
         return no.predict_ma(ts)
+    if memo is not None:
+        memo.success()
     return future_forecast
+
+
+def stepwise_seasonal_path(ts, length, period=5, memo=None):
+    """
+    Returns the forecast path of stepwise_seasonal, 1 to [length]
+    timesteps ahead, zero standard errors and the impulse responses of
+    the fit model, including its differencing. If the fit fails, the
+    moving average path is returned.
+    """
+    if memo is not None and memo.skip():
+        return no.predict_ma_path(ts, length)
+    from pmdarima.arima import auto_arima
+    data = series_values(ts)
+    if len(data) == 1:
+        return no.predict_ma_path(ts, length)
+    try:
+        stepwise_model = auto_arima(data, start_p=1, start_q=1,
+                                    max_p=5, max_q=5, m=period,
+                                    start_P=0, seasonal=True,
+                                    d=1, D=1, trace=True,
+                                    error_action='ignore',
+                                    suppress_warnings=True,
+                                    stepwise=True)
+        stepwise_model.fit(data)
+        future_forecast = stepwise_model.predict(n_periods=length)
+        response = stepwise_model.arima_res_.impulse_responses(length)
+    except Exception as e:
+        if memo is not None:
+            memo.failure(e)
+        return no.predict_ma_path(ts, length)
+    if memo is not None:
+        memo.success()
+    return numpy.asarray(future_forecast, dtype=float), numpy.zeros(length), \
+        numpy.ravel(response)[1:]
+
+
+class SeasonalState(no.StreamState):
+    """
+    Additive level, trend and per-phase seasonal components of a time
+    series of period [period], updated with each new observation by
+    exponential smoothing with gains [alpha], [beta] and [gamma], so
+    each update costs the same regardless of the length of the series.
+    The components are initialized from the first period.
+    """
+
+    def __init__(self, period, alpha=0.3, beta=0.05, gamma=0.2):
+        self.period = max(int(period), 1)
+        self.alpha = alpha
+        self.beta = beta
+        self.gamma = gamma
+        self.time = None
+        self.first = []
+        self.level = 0.0
+        self.trend = 0.0
+        self.seasonal = numpy.zeros(self.period)
+
+    def update(self, time, y):
+        """ Updates the components with observation [y] of [time]. """
+        phase = time % self.period
+        if self.first is not None:
+            self.first.append((phase, y))
+            if len(self.first) == self.period:
+                self.level = numpy.mean([v for p, v in self.first])
+                for p, v in self.first:
+                    self.seasonal[p] = v - self.level
+                self.first = None
+            return
+        s = self.seasonal[phase]
+        level = self.alpha * (y - s) + \
+            (1 - self.alpha) * (self.level + self.trend)
+        self.trend = self.beta * (level - self.level) + \
+            (1 - self.beta) * self.trend
+        self.level = level
+        self.seasonal[phase] = self.gamma * (y - level) + \
+            (1 - self.gamma) * s
+
+    def forecast(self):
+        """ Returns the prediction of the timestep after the last one. """
+        if self.first is not None:
+            return numpy.mean([v for p, v in self.first])
+        phase = (self.time + 1) % self.period
+        return self.level + self.trend + self.seasonal[phase]
+
+
+def fast_seasonal(ts, period=5, state=None):
+    """
+    Predicts the next value of timeseries [ts] from its level, trend and
+    the seasonal component of the next phase of period [period]. If the
+    ForecastState [state] of the time series is given, the components are
+    kept in it and only updated with the new entries of [ts], otherwise
+    they are computed over the whole time series.
+    """
+    model = None
+    if state is not None and isinstance(state.model, SeasonalState) and \
+            state.model.period == max(int(period), 1):
+        model = state.model
+    if model is None:
+        model = SeasonalState(period)
+        if state is not None:
+            state.model = model
+    model.ingest(ts)
+    if model.time is None:
+        return 0.0
+    return model.forecast()
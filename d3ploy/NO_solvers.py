@@ -5,9 +5,52 @@ Conditional Heteroskedasticisty.
 """
 import numpy as np
 import math
+from collections import deque
 
-import statsmodels.api as sm
-from arch import arch_model
+from d3ploy.accumulator import series_values
+
+
+class FitFailureMemo(object):
+    """
+    Remembers why the fit of a calc method failed on a time series, so
+    the fit can be skipped in favor of the moving average fallback. The
+    number of calls skipped after a failure doubles with every
+    consecutive failure, up to [max_backoff].
+    """
+
+    def __init__(self, max_backoff=64):
+        self.max_backoff = max_backoff
+        self.failures = 0
+        self.consecutive = 0
+        self.skipped = 0
+        self.backoff = 0
+        self.reason = None
+
+    def skip(self):
+        """ Returns True, and counts the call as skipped, if the fit
+            should not be attempted. """
+        if self.backoff > 0:
+            self.backoff -= 1
+            self.skipped += 1
+            return True
+        return False
+
+    def failure(self, reason):
+        """ Records a failed fit and the reason it failed. """
+        self.failures += 1
+        self.consecutive += 1
+        self.reason = repr(reason)
+        self.backoff = min(2 ** (self.consecutive - 1), self.max_backoff)
+
+    def success(self):
+        """ Records a successful fit, resetting the backoff. """
+        self.consecutive = 0
+
+    def diagnostics(self):
+        return {'failures': self.failures,
+                'skipped': self.skipped,
+                'consecutive': self.consecutive,
+                'reason': self.reason}
 
 
 def predict_ma(ts, steps=5, std_dev=0, back_steps=5):
@@ -25,57 +68,452 @@ def predict_ma(ts, steps=5, std_dev=0, back_steps=5):
     -------
     x : The moving average calculated by the function.
     """
-    supply = np.array(list(ts.values()))
-    if steps >= len(supply):
-        steps = len(supply) * -1
-    else:
-        steps *= -1
-    x = np.average(supply[steps:])
+    supply = series_values(ts, steps)
+    x = np.average(supply)
     return x
 
 
-def predict_arma(ts, steps=5, std_dev=0, back_steps=5):
+def predict_ma_path(ts, length, steps=5, std_dev=0, back_steps=5):
+    """
+    Returns the forecast path of the moving average: the moving average
+    of predict_ma repeated [length] times, zero standard errors and no
+    response, as the moving average is cheaper to compute again than to
+    keep. It is the fallback path of the other methods.
+    """
+    x = predict_ma(ts, steps=steps)
+    return np.full(length, x), np.zeros(length), None
+
+
+def ar1_fit(v):
+    """
+    Fits an AR(1) model x[t] = c + phi * x[t-1] + e[t] to the values [v]
+    by conditional least squares, in closed form, with phi bounded to
+    [-1, 1] so the forecasts of a trending window do not explode. If [v]
+    is a 2D array, each row is fit separately.
+    Parameters:
+    -----------
+    v : Array of doubles
+        Values of the time series, at least two per row.
+    Returns:
+    --------
+    c : Intercept of the model.
+    phi : Autoregressive coefficient of the model.
+    residuals : Array of the len(v) - 1 one step residuals e.
+    """
+    v = np.asarray(v, dtype=float)
+    x = v[..., :-1]
+    y = v[..., 1:]
+    dx = x - x.mean(axis=-1, keepdims=True)
+    var = np.sum(dx * dx, axis=-1)
+    cov = np.sum(dx * (y - y.mean(axis=-1, keepdims=True)), axis=-1)
+    phi = np.divide(cov, var, out=np.zeros_like(cov), where=var > 0)
+    phi = np.clip(phi, -1.0, 1.0)
+    c = y.mean(axis=-1) - phi * x.mean(axis=-1)
+    residuals = y - c[..., None] - phi[..., None] * x
+    return c, phi, residuals
+
+
+def ar1_forecast(windows, steps=1, std_dev=0):
+    """
+    Forecasts every row of [windows] [steps] timesteps ahead with its
+    closed-form AR(1) fit, adding [std_dev] standard errors of the
+    forecast, all rows in the same array operations.
+    Parameters:
+    -----------
+    windows : 2D array of doubles
+        One time series window per row, of at least three values.
+    Returns:
+    --------
+    x : Array of the forecast of each row.
+    """
+    windows = np.asarray(windows, dtype=float)
+    c, phi, residuals = ar1_fit(windows)
+    sigma2 = np.mean(residuals ** 2, axis=-1)
+    x = windows[:, -1]
+    for i in range(steps):
+        x = c + phi * x
+    powers = phi[:, None] ** (2 * np.arange(steps))
+    return x + std_dev * np.sqrt(sigma2 * np.sum(powers, axis=-1))
+
+
+def ar1_path(v, length):
+    """
+    Forecasts the values [v] 1 to [length] timesteps ahead with their
+    closed-form AR(1) fit.
+    Returns:
+    --------
+    mean : Array of the forecasts.
+    se : Array of the standard errors of the forecasts.
+    response : Array of the change of the forecasts per unit error of
+        the next value, phi^h at h timesteps ahead.
+    """
+    v = np.asarray(v, dtype=float)
+    c, phi, residuals = ar1_fit(v)
+    sigma2 = np.mean(residuals ** 2)
+    mean = np.empty(length)
+    x = v[-1]
+    for i in range(length):
+        x = c + phi * x
+        mean[i] = x
+    se = np.sqrt(sigma2 * np.cumsum(phi ** (2 * np.arange(length))))
+    return mean, se, phi ** np.arange(1, length + 1)
+
+
+def mc_deviations(ts, steps=1, back_steps=10, n_paths=1000, rng=None):
+    """
+    Draws [n_paths] Monte Carlo deviations of timeseries [ts] from its
+    expected value [steps] timesteps ahead, by bootstrapping the residuals
+    of an AR(1) fit of the last [back_steps] entries. The deviation of a
+    path at step h is the sum of phi^(h-k) e[k] over its residual draws
+    e[1] ... e[h], so all paths are computed in one matrix product.
+    Parameters:
+    -----------
+    ts : dictionary
+        key: time
+        value: value of the time series at time
+    rng : numpy RandomState
+        Random number generator of the draws.
+    Returns:
+    --------
+    x : Array of [n_paths] deviations, zeros if ts has less than three
+        entries.
+    """
+    if rng is None:
+        rng = np.random
+    v = series_values(ts, back_steps)
+    if len(v) < 3:
+        return np.zeros(n_paths)
+    c, phi, residuals = ar1_fit(v)
+    residuals = residuals - residuals.mean()
+    draws = rng.choice(residuals, size=(n_paths, steps))
+    return np.dot(draws, phi ** np.arange(steps - 1, -1, -1))
+
+
+def predict_arma(ts, steps=5, std_dev=0, back_steps=5, memo=None):
     """
     Predict the value of supply or demand at a given time step using the
-    currently available time series data. This method impliments an ARMA
-    calculation to perform the prediciton.
+    currently available time series data. This method impliments an
+    ARMA(1, 0) calculation to perform the prediciton, fit by conditional
+    least squares in closed form. It falls back to the moving average if
+    the time series has less than three values.
     Parameters:
     -----------
     ts : Array of doubles
         An array of time series data to be used for the arma prediction
     time: int
         The number of timesteps to predict forward.
+    memo: FitFailureMemo
+        Unused, the closed-form fit does not fail.
     Returns:
     --------
     x : Predicted value for the time series at chosen timestep (time).
     """
-    v = list(ts.values())
-    v = v[-1*back_steps:]
+    return predict_arma_batch([ts], steps=steps, std_dev=std_dev,
+                              back_steps=back_steps)[0]
+
+
+def predict_arma_batch(series, steps=5, std_dev=0, back_steps=5):
+    """
+    Predicts every time series of the list [series] like predict_arma,
+    fitting the windows of the same length in one vectorized call.
+    Returns:
+    --------
+    x : List of the predicted value of each time series.
+    """
+    windows = []
+    for ts in series:
+        windows.append(series_values(ts, back_steps))
+    x = [None] * len(series)
+    lengths = {}
+    for i, v in enumerate(windows):
+        if len(v) < 3:
+            x[i] = predict_ma(series[i])
+        else:
+            lengths.setdefault(len(v), []).append(i)
+    for indices in lengths.values():
+        forecasts = ar1_forecast([windows[i] for i in indices], steps=steps,
+                                 std_dev=std_dev)
+        for i, value in zip(indices, forecasts.tolist()):
+            x[i] = value
+    return x
+
+
+def predict_arma_path(ts, length, steps=5, std_dev=0, back_steps=5):
+    """
+    Returns the forecast path of predict_arma, 1 to [length] timesteps
+    ahead, its standard errors and its response, as ar1_path.
+    """
+    v = series_values(ts, back_steps)
+    if len(v) < 3:
+        return predict_ma_path(ts, length)
+    return ar1_path(v, length)
+
+
+def predict_arma_mle(ts, steps=5, std_dev=0, back_steps=5, memo=None):
+    """
+    Predict the value of supply or demand at a given time step using the
+    currently available time series data. This method fits ARMA(1, 0) by
+    maximum likelihood with statsmodels, to validate the closed-form fit
+    of predict_arma.
+    Parameters:
+    -----------
+    ts : Array of doubles
+        An array of time series data to be used for the arma prediction
+    time: int
+        The number of timesteps to predict forward.
+    memo: FitFailureMemo
+        If given, failed fits are recorded and skipped for a while.
+    Returns:
+    --------
+    x : Predicted value for the time series at chosen timestep (time).
+    """
+    if memo is not None and memo.skip():
+        return predict_ma(ts)
+    import statsmodels.api as sm
+    v = series_values(ts, back_steps)
     try:
-        fit = sm.tsa.ARMA(v, (1, 0)).fit(disp=-1)
-        forecast = fit.forecast(steps)
-        x = forecast[0][steps-1] + forecast[1][steps-1]*std_dev
-    except (ValueError, np.linalg.linalg.LinAlgError):
-        x = predict_ma(ts)
+        if hasattr(sm.tsa, 'ARMA'):
+            fit = sm.tsa.ARMA(v, (1, 0)).fit(disp=-1)
+            forecast = fit.forecast(steps)
+            x = forecast[0][steps-1] + forecast[1][steps-1]*std_dev
+        else:
+            # statsmodels >= 0.13 only has the ARIMA class
+            fit = sm.tsa.arima.ARIMA(v, order=(1, 0, 0)).fit()
+            forecast = fit.get_forecast(steps)
+            x = forecast.predicted_mean[steps-1] + \
+                forecast.se_mean[steps-1]*std_dev
+    except (ValueError, np.linalg.LinAlgError) as e:
+        if memo is not None:
+            memo.failure(e)
+        return predict_ma(ts)
+    if memo is not None:
+        memo.success()
     return x
 
 
-def predict_arch(ts, steps=1, std_dev=0, back_steps=2):
+def predict_arma_mle_path(ts, length, steps=5, std_dev=0, back_steps=5,
+                          memo=None):
+    """
+    Returns the forecast path of predict_arma_mle, 1 to [length]
+    timesteps ahead, its standard errors and its response, as ar1_path.
+    If the fit fails, the moving average path is returned.
+    """
+    if memo is not None and memo.skip():
+        return predict_ma_path(ts, length)
+    import statsmodels.api as sm
+    v = series_values(ts, back_steps)
+    try:
+        if hasattr(sm.tsa, 'ARMA'):
+            fit = sm.tsa.ARMA(v, (1, 0)).fit(disp=-1)
+            forecast = fit.forecast(length)
+            mean, se = forecast[0], forecast[1]
+        else:
+            fit = sm.tsa.arima.ARIMA(v, order=(1, 0, 0)).fit()
+            forecast = fit.get_forecast(length)
+            mean, se = forecast.predicted_mean, forecast.se_mean
+        phi = float(fit.arparams[0])
+    except (ValueError, np.linalg.LinAlgError) as e:
+        if memo is not None:
+            memo.failure(e)
+        return predict_ma_path(ts, length)
+    if memo is not None:
+        memo.success()
+    return np.asarray(mean, dtype=float), np.asarray(se, dtype=float), \
+        phi ** np.arange(1, length + 1)
+
+
+def predict_arch(ts, steps=1, std_dev=0, back_steps=2, memo=None):
     """
     Predict the value of supply or demand at a given time step using the
     currently available time series data. This method impliments an ARCH
-    calculation to perform the prediciton.
+    calculation to perform the prediciton. If a FitFailureMemo [memo] is
+    given, failed fits are recorded and skipped for a while.
     """
-    v = list(ts.values())
-    v = v[-1*2:]
+    if memo is not None and memo.skip():
+        return predict_ma(ts, steps=1)
+    from arch import arch_model
+    v = series_values(ts, 2)
     try:
         model = arch_model(v)
         fit = model.fit(disp="off", show_warning=False)
         forecast = fit.forecast(horizon=steps)
         step = 'h.' + str(steps)
         x = forecast.mean.get(step)[len(v)-steps]
-    except:
-        x = predict_ma(ts, steps=1)
-    if math.isnan(x):
-        x = predict_ma(ts, steps=1)
+        if math.isnan(x):
+            raise ValueError('ARCH forecast is nan')
+    except Exception as e:
+        if memo is not None:
+            memo.failure(e)
+        return predict_ma(ts, steps=1)
+    if memo is not None:
+        memo.success()
     return x
+
+
+def predict_arch_path(ts, length, steps=1, std_dev=0, back_steps=2,
+                      memo=None):
+    """
+    Returns the forecast path of predict_arch, 1 to [length] timesteps
+    ahead, with zero standard errors like predict_arch, and a zero
+    response, as the mean of the model is constant. If the fit fails,
+    the moving average path is returned.
+    """
+    if memo is not None and memo.skip():
+        return predict_ma_path(ts, length, steps=1)
+    from arch import arch_model
+    v = series_values(ts, 2)
+    try:
+        model = arch_model(v)
+        fit = model.fit(disp="off", show_warning=False)
+        mean = np.asarray(fit.forecast(horizon=length).mean.iloc[-1],
+                          dtype=float)
+        if np.any(np.isnan(mean)):
+            raise ValueError('ARCH forecast is nan')
+    except Exception as e:
+        if memo is not None:
+            memo.failure(e)
+        return predict_ma_path(ts, length, steps=1)
+    if memo is not None:
+        memo.success()
+    return mean, np.zeros(length), np.zeros(length)
+
+
+class StreamState(object):
+    """
+    Base of the models that are updated with each new observation of a
+    time series, such as KalmanState. A subclass keeps the last timestep
+    it has seen in [time], None before the first one, and implements
+    update(time, y).
+    """
+
+    def ingest(self, ts):
+        """ Updates the model with the entries of timeseries [ts] after
+            the last timestep it has seen. The timesteps missing from
+            [ts] are skipped. """
+        if len(ts) == 0:
+            return
+        last = next(reversed(ts))
+        if self.time is None:
+            times = ts.keys()
+        else:
+            # walk back from the end, so only the new entries are visited
+            times = []
+            for t in reversed(ts):
+                if t <= self.time:
+                    break
+                times.append(t)
+            times.reverse()
+        for t in times:
+            self.update(t, ts[t])
+        self.time = max(last, self.time if self.time is not None else last)
+
+
+class KalmanState(StreamState):
+    """
+    Local linear trend filter of a time series: the level follows the
+    slope, and both take random steps. The filter is updated with each
+    new observation in constant time, and the noise variances are
+    re-estimated from the differences of the last [window] observations
+    every [refit] observations.
+    """
+
+    def __init__(self, refit=20, window=100):
+        self.refit = refit
+        self.recent = deque(maxlen=window)
+        self.time = None
+        self.count = 0
+        self.level = 0.0
+        self.slope = 0.0
+        # covariance of (level, slope)
+        self.p_ll = 0.0
+        self.p_ls = 0.0
+        self.p_ss = 0.0
+        self.q_level = 1.0
+        self.q_slope = 0.01
+        self.r = 1.0
+
+    def estimate(self):
+        """ Re-estimates the noise variances from the autocovariance of
+            the differences of the recent observations: for a local
+            level, the lag one autocovariance is -r and the variance
+            is q_level + 2r. """
+        d = np.diff(np.array(self.recent, dtype=float))
+        if len(d) < 2:
+            return
+        d = d - d.mean()
+        g0 = np.dot(d, d) / len(d)
+        g1 = np.dot(d[1:], d[:-1]) / len(d)
+        floor = 1e-9 * (np.mean(np.abs(self.recent)) ** 2 + 1.0)
+        self.r = max(-g1, floor)
+        self.q_level = max(g0 - 2 * self.r, floor)
+        self.q_slope = 0.01 * self.q_level
+
+    def update(self, time, y):
+        """ Predicts the next state and corrects it with observation
+            [y] of [time]. """
+        self.recent.append(y)
+        self.count += 1
+        if self.count == 1:
+            diffuse = 1e6 * (abs(y) + 1.0) ** 2
+            self.level = y
+            self.p_ll = diffuse
+            self.p_ss = diffuse
+            return
+        if self.count == 3 or self.count % self.refit == 0:
+            self.estimate()
+        level = self.level + self.slope
+        p_ll = self.p_ll + 2 * self.p_ls + self.p_ss + self.q_level
+        p_ls = self.p_ls + self.p_ss
+        p_ss = self.p_ss + self.q_slope
+        s = p_ll + self.r
+        k_l = p_ll / s
+        k_s = p_ls / s
+        innovation = y - level
+        self.level = level + k_l * innovation
+        self.slope = self.slope + k_s * innovation
+        self.p_ll = p_ll - k_l * p_ll
+        self.p_ls = p_ls - k_l * p_ls
+        self.p_ss = p_ss - k_s * p_ls
+
+    def forecast(self, steps=1):
+        """ Returns the mean and variance of the observation [steps]
+            timesteps after the last one. """
+        p_ll, p_ls, p_ss = self.p_ll, self.p_ls, self.p_ss
+        for i in range(steps):
+            p_ll = p_ll + 2 * p_ls + p_ss + self.q_level
+            p_ls = p_ls + p_ss
+            p_ss = p_ss + self.q_slope
+        return self.level + steps * self.slope, p_ll + self.r
+
+
+def predict_kalman(ts, steps=1, std_dev=0, back_steps=10, state=None):
+    """
+    Predict the value of supply or demand at a given time step using a
+    local linear trend Kalman filter. If the ForecastState [state] of the
+    time series is given, the filter is kept in it and only updated with
+    the new entries of [ts], otherwise it is run over the whole time
+    series.
+    Parameters:
+    -----------
+    ts : dictionary
+        key: time
+        value: value of the time series at time, in order of time
+    steps : int
+        The number of timesteps to predict forward.
+    std_dev : float
+        Number of predictive standard deviations added to the forecast.
+    Returns:
+    --------
+    x : Predicted value for the time series at chosen timestep (time).
+    """
+    if state is not None and isinstance(state.model, KalmanState):
+        model = state.model
+    else:
+        model = KalmanState()
+        if state is not None:
+            state.model = model
+    model.ingest(ts)
+    if model.count == 0:
+        return 0.0
+    mean, var = model.forecast(steps)
+    return mean + std_dev * math.sqrt(var)
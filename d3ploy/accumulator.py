@@ -0,0 +1,162 @@
+"""
+This accumulator.py file contains the array-backed time series used by
+`timeseries_inst.py' and `supply_driven_deployment_inst.py' to gather
+supply, demand and capacity records from the cyclus time series listeners.
+"""
+
+import itertools
+
+import numpy as np
+
+
+class TimeSeriesAccumulator(object):
+    """
+    Array-backed replacement for the `defaultdict(float)` keyed by time
+    that the institutions used to store each commodity's time series.
+
+    The values live in a preallocated array indexed by timestep, so a
+    listener call is a single slot update instead of a string slice and
+    two hashed lookups. The dictionary interface used by the forecasters
+    (`keys`, `values`, `len`, `in`, item access) is preserved: only the
+    timesteps recorded, set or read are part of the series, as with the
+    defaultdict, and they are always iterated in time order. A timestep
+    before the first one grows the storage backwards. `values` returns a
+    read-only view of the storage, so reading the series costs nothing
+    whatever its length.
+    """
+
+    def __init__(self, size=128):
+        size = max(int(size), 1)
+        self.data = np.zeros(size)
+        self.present = np.zeros(size, dtype=bool)
+        # timestep of data[0], set by the first timestep touched
+        self.origin = None
+        self.start = None
+        self.stop = 0
+        self.count = 0
+
+    def _slot(self, time):
+        """ Returns the index of [time] in the storage, growing it if
+            needed, and makes [time] part of the series. """
+        if self.origin is None:
+            self.origin = time
+            self.start = time
+            self.stop = time
+        i = time - self.origin
+        if i < 0:
+            pad = max(-i, len(self.data))
+            self.data = np.concatenate((np.zeros(pad), self.data))
+            self.present = np.concatenate((np.zeros(pad, dtype=bool),
+                                           self.present))
+            self.origin -= pad
+            i += pad
+        elif i >= len(self.data):
+            size = len(self.data)
+            while i >= size:
+                size *= 2
+            grow = size - len(self.data)
+            self.data = np.concatenate((self.data, np.zeros(grow)))
+            self.present = np.concatenate((self.present,
+                                           np.zeros(grow, dtype=bool)))
+        if not self.present[i]:
+            self.present[i] = True
+            self.count += 1
+            if time < self.start:
+                self.start = time
+            if time >= self.stop:
+                self.stop = time + 1
+        return i
+
+    def listener(self, agent, time, value, commod):
+        """
+        Time series listener that accumulates a record into the slot of
+        [time]. It is pre-bound to a single commodity at `enter_notify',
+        so the commodity name is never parsed.
+        Parameters
+        ----------
+        agent : cyclus agent
+            This is the agent that is making the call to the listener.
+        time : int
+            Timestep that the call is made.
+        value : object
+            This is the value of the object being recorded in the time
+            series.
+        commod : str
+            Name of the time series, unused.
+        """
+        # the slot is found first, it may reallocate the storage
+        i = self._slot(time)
+        self.data[i] += value
+
+    def contiguous(self):
+        """ Returns whether every timestep from the first to the last one
+            is part of the series. """
+        return self.count == self.stop - self.start
+
+    def __contains__(self, time):
+        if self.origin is None:
+            return False
+        i = time - self.origin
+        return 0 <= i < len(self.present) and bool(self.present[i])
+
+    def __getitem__(self, time):
+        i = self._slot(time)
+        return float(self.data[i])
+
+    def __setitem__(self, time, value):
+        i = self._slot(time)
+        self.data[i] = value
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __reversed__(self):
+        return reversed(self.keys())
+
+    def keys(self):
+        if self.count == 0:
+            return range(0)
+        if self.contiguous():
+            return range(self.start, self.stop)
+        lo = self.start - self.origin
+        hi = self.stop - self.origin
+        return (np.flatnonzero(self.present[lo:hi]) + self.start).tolist()
+
+    def values(self):
+        """ Returns the values of the series as a read-only array, a view
+            of the storage if no timestep is missing. """
+        if self.count == 0:
+            return np.zeros(0)
+        lo = self.start - self.origin
+        hi = self.stop - self.origin
+        if self.contiguous():
+            view = self.data[lo:hi]
+        else:
+            view = self.data[lo:hi][self.present[lo:hi]]
+        view.flags.writeable = False
+        return view
+
+    def items(self):
+        return zip(self.keys(), self.values().tolist())
+
+
+def series_values(ts, last=0):
+    """ Returns the values of time series [ts] as an array of floats, only
+        the [last] ones if [last] is positive. The values of a
+        TimeSeriesAccumulator are not copied, and only the last values of
+        a dictionary are read. """
+    if isinstance(ts, TimeSeriesAccumulator):
+        values = ts.values()
+        return values[-last:] if last > 0 else values
+    if last > 0:
+        try:
+            tail = list(itertools.islice(reversed(ts.values()), last))
+        except TypeError:
+            tail = list(ts.values())[-last:]
+        else:
+            tail.reverse()
+        return np.array(tail, dtype=float)
+    return np.array(list(ts.values()), dtype=float)
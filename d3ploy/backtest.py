@@ -0,0 +1,216 @@
+"""
+This backtest.py file contains the offline backtesting of calc methods on
+the supply and demand time series recorded in the output of a cyclus
+simulation.
+
+Every calc method is run as a rolling backtest on the recorded series:
+each value is predicted from the values before it, as it would have been
+during the simulation, so calc methods and their settings are compared
+without running the simulation again. The backtests of the methods and
+commodities run in parallel in a process pool.
+
+Usage:
+    python -m d3ploy.backtest output.sqlite -m ma arma kalman poly
+"""
+
+import argparse
+import math
+import sqlite3 as lite
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from d3ploy.shadow import backtest
+
+
+def format_simid(simid):
+    """ Returns the SimId [simid] of a cyclus output file as the string
+        cyclus prints, such as 2f3b4c1e-.... """
+    if isinstance(simid, bytes) and len(simid) == 16:
+        return str(uuid.UUID(bytes=simid))
+    return str(simid)
+
+
+def check_simid(file_name, simids, simid=None):
+    """ Returns SimId [simid], as format_simid prints it, if it is one of
+        the simulations [simids] held by cyclus output file [file_name],
+        or None if it is not given and the file holds one simulation.
+        Raises a ValueError otherwise. """
+    if simid is None and len(simids) > 1:
+        raise ValueError(
+            '%s holds the simulations %s, give the SimId of the one '
+            'to load.' % (file_name, ', '.join(sorted(simids))))
+    if simid is not None:
+        simid = str(simid).lower()
+        if simid not in simids:
+            raise ValueError('%s holds no simulation %s.' % (file_name,
+                                                             simid))
+    return simid
+
+
+def load_series(file_name, sides=('supply', 'demand'), commods=None,
+                simid=None):
+    """
+    Loads the time series recorded by the institutions in a cyclus
+    output file, summed over the agents recording them.
+    Parameters
+    ----------
+    file_name : str
+        name of the sqlite file
+    sides : list of str
+        recorded time series to load, such as supply, demand or capacity
+    commods : list of str
+        commodities to load, all of them if not given
+    simid : str
+        SimId of the simulation to load, needed if the file holds
+        several simulations
+    Returns
+    -------
+    series : dictionary
+        key: (side, commodity)
+        value: dictionary of time series, key: time, value: value
+    """
+    con = lite.connect(file_name)
+    try:
+        cur = con.cursor()
+        tables = [row[0] for row in cur.execute(
+            "select name from sqlite_master where type = 'table'")]
+        selected = []
+        simids = set()
+        for table in tables:
+            for side in sides:
+                prefix = 'timeseries' + side
+                if not table.lower().startswith(prefix):
+                    continue
+                commod = table[len(prefix):]
+                if commod == '' or (commods is not None and
+                                    commod not in commods):
+                    continue
+                selected.append((side, commod, table))
+                simids.update(format_simid(row[0]) for row in cur.execute(
+                    'select distinct SimId from "%s"' % table))
+        simid = check_simid(file_name, simids, simid)
+        series = {}
+        for side, commod, table in selected:
+            ts = {}
+            for sim, t, v in cur.execute(
+                    'select SimId, time, sum(value) from "%s" '
+                    'group by SimId, time order by time' % table):
+                if simid is None or format_simid(sim) == simid:
+                    ts[int(t)] = float(v)
+            series[(side, commod)] = ts
+    finally:
+        con.close()
+    return series
+
+
+def backtest_job(job):
+    """ Runs the backtest of one calc method on one time series and
+        returns its error and timing statistics. """
+    method, ts, window, steps, back_steps, degree, history = job
+    if window <= 0:
+        window = len(ts)
+    try:
+        errors, cpu = backtest(method, ts, window=window, steps=steps,
+                               back_steps=back_steps, degree=degree,
+                               history=history)
+    except Exception as e:
+        return {'count': 0, 'mae': float('nan'), 'rmse': float('nan'),
+                'bias': float('nan'), 'cpu': float('nan'),
+                'error': '%s: %s' % (type(e).__name__, e)}
+    count = max(len(errors), 1)
+    return {'count': len(errors),
+            'mae': sum(abs(e) for e in errors) / count,
+            'rmse': math.sqrt(sum(e ** 2 for e in errors) / count),
+            'bias': sum(errors) / count,
+            'cpu': cpu,
+            'error': None}
+
+
+def run_backtest(series, methods, window=0, steps=1, back_steps=10,
+                 degree=1, history=0, processes=None):
+    """
+    Backtests every calc method of [methods] on every time series of
+    [series].
+    Parameters
+    ----------
+    series : dictionary
+        key: any, such as the (side, commodity) keys of load_series
+        value: dictionary of time series
+    window : int
+        number of last values of each time series backtested, all of
+        them if 0
+    history : int
+        number of values each prediction is made from, all of the
+        previous values if 0
+    processes : int
+        number of worker processes, one per CPU if not given. The
+        backtests run in this process if 1.
+    Returns
+    -------
+    results : dictionary
+        key: (method, key of series)
+        value: dictionary of the number of predictions, mean absolute
+        error, root mean squared error, mean error (bias), mean CPU
+        time per call, and the error raised by the method if any
+    """
+    keys = [(method, key) for method in methods for key in sorted(series)]
+    jobs = [(method, series[key], window, steps, back_steps, degree, history)
+            for method, key in keys]
+    if processes == 1:
+        stats = [backtest_job(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            stats = list(executor.map(backtest_job, jobs))
+    return dict(zip(keys, stats))
+
+
+def report(results):
+    """ Returns the results of run_backtest as a text table, one line
+        per method and time series. """
+    lines = ['%-16s %-24s %8s %14s %14s %14s %12s' % (
+        'method', 'series', 'count', 'mae', 'rmse', 'bias', 'cpu [us]')]
+    for (method, key), stats in sorted(results.items(), key=str):
+        name = '_'.join(key) if isinstance(key, tuple) else str(key)
+        if stats['error'] is not None:
+            lines.append('%-16s %-24s failed: %s' % (method, name,
+                                                     stats['error']))
+            continue
+        lines.append('%-16s %-24s %8d %14.6g %14.6g %14.6g %12.1f' % (
+            method, name, stats['count'], stats['mae'], stats['rmse'],
+            stats['bias'], stats['cpu'] * 1e6))
+    return '\n'.join(lines)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description='Backtests calc methods on the supply and demand '
+                    'recorded in a cyclus output file.')
+    parser.add_argument('file', help='cyclus sqlite output file')
+    parser.add_argument('-m', '--methods', nargs='+', default=['ma', 'arma'],
+                        help='calc methods to backtest')
+    parser.add_argument('-c', '--commods', nargs='+', default=None,
+                        help='commodities to backtest, all if not given')
+    parser.add_argument('-s', '--sides', nargs='+',
+                        default=['supply', 'demand'],
+                        help='recorded time series to backtest')
+    parser.add_argument('--simid', default=None,
+                        help='SimId of the simulation to backtest, needed '
+                             'if the file holds several simulations')
+    parser.add_argument('--window', type=int, default=0)
+    parser.add_argument('--steps', type=int, default=1)
+    parser.add_argument('--back-steps', type=int, default=10)
+    parser.add_argument('--degree', type=int, default=1)
+    parser.add_argument('--history', type=int, default=0)
+    parser.add_argument('--processes', type=int, default=None)
+    args = parser.parse_args(args)
+    series = load_series(args.file, sides=args.sides, commods=args.commods,
+                         simid=args.simid)
+    results = run_backtest(series, args.methods, window=args.window,
+                           steps=args.steps, back_steps=args.back_steps,
+                           degree=args.degree, history=args.history,
+                           processes=args.processes)
+    print(report(results))
+
+
+if __name__ == '__main__':
+    main()
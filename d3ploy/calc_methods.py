@@ -0,0 +1,337 @@
+"""
+This calc_methods.py file contains the registry of prediction methods
+used by `timeseries_inst.py' and `supply_driven_deployment_inst.py'.
+
+The backend module of a calc method is only imported the first time the
+method is requested, so an institution that only uses `ma' never pays
+for importing statsmodels, arch or pmdarima.
+"""
+
+import importlib
+
+
+class MethodRegistry(object):
+    """
+    Maps the name of a calc method to the function implementing it.
+    Each method is registered with the module and function name that
+    implement it and the kind of arguments it takes:
+
+    no : steps, std_dev, back_steps (Non-optimizing methods)
+    do : back_steps, degree (Deterministic-optimizing methods)
+    ml : period (Machine learning methods)
+
+    Methods registered with memo=True also take a FitFailureMemo, and
+    methods registered with state=True a ForecastState, both kept per
+    time series. Methods registered with a [batch] function
+    can predict a list of time series in one call, and methods registered
+    with a [path] function can return their forecasts of several
+    timesteps, with their standard errors and their response to the
+    error of the next value, in one call. The methods that are cheap to
+    fit, such as ma and poly, have no path function. Each method also
+    declares a [cost] rank, lowest for the cheapest to fit, which the
+    auto calc method uses to choose between equally accurate methods
+    without measuring their time. Methods registered with linear=True
+    make forecasts that are linear in the values of the time series, so
+    the change of a forecast with one value is the same whatever that
+    value is.
+    """
+
+    def __init__(self):
+        self.specs = {}
+        self.functions = {}
+        self.memo_methods = set()
+        self.state_methods = set()
+        self.batch_specs = {}
+        self.path_specs = {}
+        self.costs = {}
+        self.linear_methods = set()
+
+    def register(self, name, module, function, kind, memo=False, batch=None,
+                 path=None, state=False, cost=0, linear=False):
+        """ Registers calc method [name] as [module].[function] without
+            importing [module]. """
+        self.specs[name] = (module, function, kind)
+        self.costs[name] = cost
+        self.functions.pop(name, None)
+        self.functions.pop((name, 'batch'), None)
+        self.functions.pop((name, 'path'), None)
+        if memo:
+            self.memo_methods.add(name)
+        else:
+            self.memo_methods.discard(name)
+        if state:
+            self.state_methods.add(name)
+        else:
+            self.state_methods.discard(name)
+        if linear:
+            self.linear_methods.add(name)
+        else:
+            self.linear_methods.discard(name)
+        if batch is not None:
+            self.batch_specs[name] = (module, batch)
+        else:
+            self.batch_specs.pop(name, None)
+        if path is not None:
+            self.path_specs[name] = (module, path)
+        else:
+            self.path_specs.pop(name, None)
+
+    def __contains__(self, name):
+        return name in self.specs
+
+    def __iter__(self):
+        return iter(self.specs)
+
+    def __len__(self):
+        return len(self.specs)
+
+    def __getitem__(self, name):
+        try:
+            return self.functions[name]
+        except KeyError:
+            pass
+        if name not in self.specs:
+            raise ValueError(
+                'The input calc_method is not valid. Check again.')
+        module, function, kind = self.specs[name]
+        func = getattr(importlib.import_module(module), function)
+        self.functions[name] = func
+        return func
+
+    def batch(self, name):
+        """ Returns the batch function of calc method [name], or None if
+            it has none. """
+        return self._extra(name, 'batch', self.batch_specs)
+
+    def path(self, name):
+        """ Returns the path function of calc method [name], or None if
+            it has none. """
+        return self._extra(name, 'path', self.path_specs)
+
+    def _extra(self, name, extra, specs):
+        if name not in specs:
+            return None
+        key = (name, extra)
+        if key not in self.functions:
+            module, function = specs[name]
+            self.functions[key] = getattr(importlib.import_module(module),
+                                          function)
+        return self.functions[key]
+
+    def kind(self, name):
+        """ Returns the kind of arguments calc method [name] takes. """
+        if name not in self.specs:
+            raise ValueError(
+                'The input calc_method is not valid. Check again.')
+        return self.specs[name][2]
+
+    def cost(self, name):
+        """ Returns the cost rank calc method [name] is registered with. """
+        if name not in self.specs:
+            raise ValueError(
+                'The input calc_method is not valid. Check again.')
+        return self.costs[name]
+
+    def loaded(self):
+        """ Returns the names of the calc methods imported so far. """
+        return [name for name in self.functions if name in self.specs]
+
+
+CALC_METHODS = MethodRegistry()
+# cost ranks: 0 for the methods updated in constant time or averaging a
+# few values, 1 for the closed-form least-squares fits, 2 for the
+# transforms and smoothing fits, 3 for the maximum likelihood fits
+CALC_METHODS.register('ma', 'd3ploy.NO_solvers', 'predict_ma', 'no',
+                      linear=True)
+CALC_METHODS.register('arma', 'd3ploy.NO_solvers', 'predict_arma', 'no',
+                      batch='predict_arma_batch', path='predict_arma_path',
+                      cost=1)
+CALC_METHODS.register('arma_mle', 'd3ploy.NO_solvers', 'predict_arma_mle',
+                      'no', memo=True, path='predict_arma_mle_path', cost=3)
+CALC_METHODS.register('arch', 'd3ploy.NO_solvers', 'predict_arch', 'no',
+                      memo=True, path='predict_arch_path', cost=3)
+CALC_METHODS.register('kalman', 'd3ploy.NO_solvers', 'predict_kalman', 'no',
+                      state=True)
+CALC_METHODS.register('poly', 'd3ploy.DO_solvers',
+                      'polyfit_regression', 'do', cost=1, linear=True)
+CALC_METHODS.register('exp_smoothing', 'd3ploy.DO_solvers',
+                      'exp_smoothing', 'do', path='exp_smoothing_path',
+                      cost=2)
+CALC_METHODS.register('holt_winters', 'd3ploy.DO_solvers',
+                      'holt_winters', 'do', path='holt_winters_path', cost=2)
+CALC_METHODS.register('fft', 'd3ploy.DO_solvers', 'fft', 'do',
+                      path='fft_path', cost=2)
+CALC_METHODS.register('sw_seasonal', 'd3ploy.ML_solvers',
+                      'stepwise_seasonal', 'ml', memo=True,
+                      path='stepwise_seasonal_path', cost=3)
+CALC_METHODS.register('fast_seasonal', 'd3ploy.ML_solvers', 'fast_seasonal',
+                      'ml', state=True)
+
+
+def forecast(calc_method, ts, steps=1, std_dev=0, back_steps=10, degree=1,
+             memo=None, refit=0, state=None):
+    """ Predicts the next value of time series [ts] with [calc_method],
+        passing each method the arguments its kind takes.
+    Parameters:
+    -----------
+    calc_method: str
+        name of a registered calc method
+    ts: dictionary
+        key: time
+        value: value of the time series at time
+    steps: int
+        number of timesteps forward to predict
+    std_dev: float
+        standard deviation adjustment
+    back_steps: int
+        number of steps backwards used for the prediction
+    degree: int
+        degree of the fitting polynomial, or period for sw_seasonal
+    memo: FitFailureMemo
+        memo of the time series, only used by the methods that fall
+        back to the moving average when their fit fails
+    refit: int
+        if given with a state, the forecast path of a method with a path
+        function is kept in the state and reused for [refit] timesteps,
+        updated with the values of ts observed since it was fit
+    state: ForecastState
+        state of the time series, used by the methods that keep a model
+        between calls and to keep forecast paths
+
+    Returns:
+    --------
+    x: float
+        predicted value of the time series
+    """
+    kind = CALC_METHODS.kind(calc_method)
+    kwargs = {}
+    if memo is not None and calc_method in CALC_METHODS.memo_methods:
+        kwargs['memo'] = memo
+    if state is not None and calc_method in CALC_METHODS.state_methods:
+        kwargs['state'] = state
+    if kind == 'no':
+        kwargs.update(steps=steps, std_dev=std_dev, back_steps=back_steps)
+    elif kind == 'do':
+        kwargs.update(back_steps=back_steps, degree=degree)
+    else:
+        kwargs.update(period=degree)
+    if refit > 0 and state is not None and \
+            CALC_METHODS.path(calc_method) is not None:
+        return forecast_from_path(calc_method, ts, state, refit, std_dev,
+                                  horizon(calc_method, steps), kwargs)
+    return CALC_METHODS[calc_method](ts, **kwargs)
+
+
+class ForecastState(object):
+    """
+    What the calc methods keep between calls on one time series, apart
+    from its FitFailureMemo: the [model] a method such as kalman updates
+    with each new value, and the ForecastPath reused when refit is set.
+    """
+
+    def __init__(self):
+        self.model = None
+        self.path = None
+
+
+class ForecastPath(object):
+    """
+    Forecast path of [calc_method] fit to a time series up to time
+    [fit], updated with the values observed after [fit] without fitting
+    the method again. [mean], [se] and [response] are the forecasts 1 to
+    len(mean) timesteps after [fit], their standard errors and their
+    change per unit error of the value after [fit] (the psi weights of
+    the model); each observed value adds its error, times the response,
+    to the forecasts after it.
+    """
+
+    def __init__(self, calc_method, fit, mean, se, response):
+        self.calc_method = calc_method
+        self.fit = fit
+        self.mean = mean
+        self.se = se
+        self.response = response
+        self.errors = []
+
+    def covers(self, calc_method, last, refit, h):
+        """ Returns if the path can forecast [h] timesteps after time
+            [last] within [refit] timesteps of its fit. """
+        return calc_method == self.calc_method and \
+            self.fit <= last < self.fit + refit and \
+            last - self.fit + h <= len(self.mean)
+
+    def predict(self, i):
+        """ Returns the forecast of the value [i] + 1 timesteps after
+            [fit], given the errors of the values observed so far. """
+        x = self.mean[i]
+        for k, error in enumerate(self.errors):
+            x += self.response[i - k - 1] * error
+        return x
+
+    def forecast(self, ts, last, h, std_dev=0):
+        """ Returns the forecast of time series [ts] [h] timesteps after
+            time [last], after recording the errors of the values of [ts]
+            observed since the last call. """
+        while len(self.errors) < last - self.fit:
+            i = len(self.errors)
+            self.errors.append(ts[self.fit + i + 1] - self.predict(i))
+        i = last - self.fit + h - 1
+        return self.predict(i) + std_dev * self.se[h - 1]
+
+
+def forecast_from_path(calc_method, ts, state, refit, std_dev, h, kwargs):
+    """ Predicts the value of time series [ts] [h] timesteps after its
+        last value from the ForecastPath kept in [state], computing a new
+        path of [refit] + [h] - 1 timesteps if the kept one is older than
+        [refit] timesteps, and adds [std_dev] standard errors. A path
+        without a response, such as the moving average a method falls
+        back to when its fit fails, is not kept. """
+    last = next(reversed(ts))
+    path = state.path
+    if path is None or not path.covers(calc_method, last, refit, h):
+        mean, se, response = CALC_METHODS.path(calc_method)(
+            ts, refit + h - 1, **kwargs)
+        if response is None:
+            state.path = None
+            return mean[h - 1] + std_dev * se[h - 1]
+        path = ForecastPath(calc_method, last, mean, se, response)
+        state.path = path
+    return path.forecast(ts, last, h, std_dev)
+
+
+def horizon(calc_method, steps=1):
+    """ Returns how many timesteps ahead of the last value of a time
+        series [calc_method] predicts. Only the Non-optimizing methods
+        use [steps], the others always predict the next timestep. """
+    if CALC_METHODS.kind(calc_method) == 'no':
+        return steps
+    return 1
+
+
+def forecast_batch(calc_method, series, steps=1, std_dev=0, back_steps=10,
+                   degree=1):
+    """ Predicts the next value of every time series of the dictionary
+        [series] with [calc_method], in one call if the method has a
+        batch function and one call per time series otherwise.
+    Parameters:
+    -----------
+    series: dictionary
+        key: any
+        value: time series, as taken by forecast
+
+    Returns:
+    --------
+    x: dictionary
+        key: the keys of series
+        value: predicted value of the time series
+    """
+    keys = list(series.keys())
+    batch = CALC_METHODS.batch(calc_method)
+    if batch is None:
+        return {key: forecast(calc_method, series[key], steps=steps,
+                              std_dev=std_dev, back_steps=back_steps,
+                              degree=degree)
+                for key in keys}
+    values = batch([series[key] for key in keys], steps=steps,
+                   std_dev=std_dev, back_steps=back_steps)
+    return dict(zip(keys, values))
@@ -0,0 +1,335 @@
+"""
+This forecasting.py file contains the forecasting shared by
+`timeseries_inst.py' and `supply_driven_deployment_inst.py'.
+
+Both institutions predict two time series per commodity and deploy
+facilities when their difference falls short: the side the institution
+deploys (supply for TimeSeriesInst, capacity for
+SupplyDrivenDeploymentInst) and the side it deploys against (demand and
+supply respectively). ForecastingMixin implements everything that only
+depends on which side is which: the retirement schedules, the pipelined,
+batched, refit and auto forecasts, the shadow methods and the residual
+and Monte Carlo margins.
+"""
+
+import numpy as np
+
+from d3ploy.calc_methods import CALC_METHODS, forecast, horizon
+from d3ploy.calc_methods import ForecastState, forecast_batch
+from d3ploy.retirement import predict_with_retirement
+from d3ploy.residuals import ResidualMargin
+from d3ploy.NO_solvers import FitFailureMemo, mc_deviations
+
+
+class ForecastingMixin(object):
+    """
+    Forecasting of the [deployed_side] and [other_side] time series of
+    each commodity, kept by the institution in its commodity_<side>
+    dictionaries. The standard deviation adjustment of every forecast is
+    the state variable named [std_dev_var].
+    """
+
+    deployed_side = None
+    other_side = None
+    std_dev_var = None
+
+    def series(self, side, commod):
+        """ Returns the [side] time series of [commod]. """
+        return getattr(self, 'commodity_' + side)[commod]
+
+    def forecasts_other(self, commod):
+        """ Returns if the other side of [commod] is forecast, rather than
+            known ahead. """
+        return True
+
+    def planned(self, commod):
+        """ Returns if the deployment of [commod] follows a plan rather
+            than the forecasts of each timestep. """
+        return False
+
+    def forecast_std_dev(self):
+        """ Returns the standard deviation adjustment of the forecasts,
+            0 if mc_paths is set, as the Monte Carlo margin replaces
+            it. """
+        if self.mc_paths > 0:
+            return 0
+        return getattr(self, self.std_dev_var)
+
+    def build_notify(self, child):
+        """
+        Records the entry time and lifetime of a facility built by the
+        institution, and schedules the loss of its capacity.
+        Parameters
+        ----------
+        child : cyclus agent
+            The agent that was just built.
+        """
+        entry = (child.prototype, child.enter_time, child.lifetime)
+        self.fleet[child.id] = entry
+        if not self.fresh:
+            self.schedule_retirement(*entry)
+
+    def decom_notify(self, child):
+        """
+        Moves the scheduled loss of a facility's capacity to the current
+        timestep if it is decommissioned before the end of its lifetime.
+        Parameters
+        ----------
+        child : cyclus agent
+            The agent that is being decommissioned.
+        """
+        entry = self.fleet.pop(child.id, None)
+        if entry is None or self.fresh:
+            return
+        proto, enter_time, lifetime = entry
+        time = self.context.time + 1
+        for commod, proto_dict in self.deploy_commodity_dict.items():
+            if proto not in proto_dict:
+                continue
+            cap = proto_dict[proto]['cap']
+            if lifetime >= 0:
+                self.commodity_retirement[commod].remove(
+                    enter_time + lifetime, cap)
+            self.commodity_retirement[commod].add(time, cap)
+
+    def schedule_retirement(self, proto, enter_time, lifetime):
+        """
+        Schedules the loss of the capacity of a facility of prototype
+        [proto] at the end of its lifetime, for every commodity it
+        supplies. A lifetime of -1 means the facility never retires.
+        """
+        if lifetime < 0:
+            return
+        for commod, proto_dict in self.deploy_commodity_dict.items():
+            if proto in proto_dict:
+                self.commodity_retirement[commod].add(
+                    enter_time + lifetime, proto_dict[proto]['cap'])
+
+    def tick(self):
+        """
+        This is the tick method of the institution. If pipeline is set,
+        the forecast fits of this timestep are started in the background
+        from the history up to the previous timestep.
+        """
+        if not self.pipeline or self.fresh:
+            return
+        time = self.context.time
+        for commod in self.commodity_dict:
+            self.submit_forecast(self.deployed_side, commod, time,
+                                 self.retirement_schedule(commod))
+            if self.forecasts_other(commod):
+                self.submit_forecast(self.other_side, commod, time)
+
+    def submit_forecast(self, side, commod, time, schedule=None):
+        """ Starts the pipelined forecast of the [side] time series of
+            [commod] from its history before [time]. """
+        method = self.forecast_method(side, commod)
+        self.forecast_pipeline.submit((side, commod), method,
+                                      self.series(side, commod), time,
+                                      schedule=schedule,
+                                      steps=self.steps,
+                                      std_dev=self.forecast_std_dev(),
+                                      back_steps=self.back_steps,
+                                      degree=self.degree)
+
+    def retirement_schedule(self, commod):
+        """ Returns the retirement schedule of [commod] if track_retirement
+            is set, None otherwise. """
+        if self.track_retirement:
+            return self.commodity_retirement[commod]
+        return None
+
+    def failure_memo(self, side, commod, method=None):
+        """ Returns the FitFailureMemo of [method], calc_method by
+            default, on the [side] time series of [commod]. """
+        if method is None:
+            method = self.calc_method
+        key = (side, commod, method)
+        if key not in self.fit_failures:
+            self.fit_failures[key] = FitFailureMemo()
+        return self.fit_failures[key]
+
+    def forecast_state(self, side, commod, method=None):
+        """ Returns the ForecastState of [method], calc_method by
+            default, on the [side] time series of [commod]. """
+        if method is None:
+            method = self.calc_method
+        key = (side, commod, method)
+        if key not in self.forecast_states:
+            self.forecast_states[key] = ForecastState()
+        return self.forecast_states[key]
+
+    def forecast_method(self, side, commod):
+        """ Returns the calc method predicting the [side] time series of
+            [commod], which the auto calc_method chooses per series. """
+        if self.auto is None:
+            return self.calc_method
+        return self.auto.method((side, commod), self.series(side, commod),
+                                self.context.time)
+
+    def prediction_horizon(self, commod):
+        """ Returns how many timesteps ahead the deployed side of [commod]
+            is predicted. """
+        return horizon(self.forecast_method(self.deployed_side, commod),
+                       self.steps)
+
+    def fit_diagnostics(self):
+        """ Returns the failure counts of the forecaster fits, keyed by
+            (side, commodity, calc_method). """
+        return {key: memo.diagnostics()
+                for key, memo in self.fit_failures.items()}
+
+    def shadow_forecasts(self, commod, time):
+        """
+        Runs the shadow methods on both sides of [commod] observed up to
+        [time].
+        """
+        sides = [self.deployed_side]
+        if self.forecasts_other(commod):
+            sides.append(self.other_side)
+        for side in sides:
+            self.shadow.evaluate(side, commod, self.series(side, commod),
+                                 time, steps=self.steps,
+                                 back_steps=self.back_steps,
+                                 degree=self.degree)
+
+    def shadow_diagnostics(self):
+        """ Returns the forecast errors and CPU time per call of the
+            shadow methods, keyed by (method, side, commodity). """
+        if self.shadow is None:
+            return {}
+        return self.shadow.diagnostics()
+
+    def batch_forecasts(self, time):
+        """
+        Predicts both sides of every commodity in a single call if the
+        calc_method has a batch function, for predict_side to use. The
+        time series without a value at [time] yet are left to it.
+        """
+        self.batched = {}
+        if self.forecast_refit > 0 or \
+                CALC_METHODS.batch(self.calc_method) is None:
+            return
+        deployed = self.deployed_side
+        series = {}
+        for commod in self.commodity_dict:
+            if self.planned(commod):
+                continue
+            history = self.series(deployed, commod)
+            if time in history:
+                schedule = self.retirement_schedule(commod)
+                if schedule is not None:
+                    history = schedule.corrected(history)
+                series[(deployed, commod)] = history
+            history = self.series(self.other_side, commod)
+            if self.forecasts_other(commod) and time in history:
+                series[(self.other_side, commod)] = history
+        self.batched = forecast_batch(self.calc_method, series,
+                                      steps=self.steps,
+                                      std_dev=self.forecast_std_dev(),
+                                      back_steps=self.back_steps,
+                                      degree=self.degree)
+        h = horizon(self.calc_method, self.steps)
+        for commod in self.commodity_dict:
+            schedule = self.retirement_schedule(commod)
+            if schedule is not None and (deployed, commod) in self.batched:
+                self.batched[(deployed, commod)] -= schedule.retired(time + h)
+
+    def residual_margin(self, commod, time, deployed, other):
+        """
+        Returns the safety margin to add to the difference between the
+        deployed side [deployed] and the other side [other] predicted at
+        [time] for [commod], from the residuals of both forecasts over the
+        last residual_window timesteps.
+        """
+        if commod not in self.residual_margins:
+            self.residual_margins[commod] = ResidualMargin(
+                self.residual_window, self.residual_quantile)
+        return self.residual_margins[commod].margin(
+            time, deployed, other,
+            self.series(self.deployed_side, commod)[time],
+            self.series(self.other_side, commod)[time],
+            self.prediction_horizon(commod))
+
+    def residual_deploy(self, deploy_dicts):
+        """
+        Records the capacity of the facilities in [deploy_dicts], scheduled
+        at the current timestep after its forecasts were made, in the
+        residuals of the deployed side of every commodity they supply.
+        """
+        for margins in (self.residual_margins, self.mc_margins):
+            for commod, margin in margins.items():
+                proto_dict = self.deploy_commodity_dict[commod]
+                margin.deploy(sum(num * proto_dict[proto]['cap']
+                                  for deploy_dict in deploy_dicts
+                                  for proto, num in deploy_dict.items()
+                                  if proto in proto_dict))
+
+    def mc_margin(self, commod, time, deployed, other):
+        """
+        Returns the margin to add to the difference between the deployed
+        side [deployed] and the other side [other] predicted at [time]
+        for [commod] to deploy against the mc_quantile of the shortfall,
+        from mc_paths Monte Carlo paths of both series. The paths
+        bootstrap the residuals of the last mc_window forecasts of each
+        side, and the values of an AR(1) fit of each series until three
+        residuals are observed.
+        """
+        if commod not in self.mc_margins:
+            self.mc_margins[commod] = ResidualMargin(self.mc_window,
+                                                     self.mc_quantile)
+        margin = self.mc_margins[commod]
+        margin.record(time, deployed, other,
+                      self.series(self.deployed_side, commod)[time],
+                      self.series(self.other_side, commod)[time],
+                      self.prediction_horizon(commod))
+        deviations = margin.deviations(self.mc_paths, self.mc_rng,
+                                       other=self.forecasts_other(commod))
+        if deviations is None:
+            series = self.series(self.deployed_side, commod)
+            schedule = self.retirement_schedule(commod)
+            if schedule is not None:
+                series = schedule.corrected(series)
+            deviations = self.mc_deviations(series, commod)
+            if self.forecasts_other(commod):
+                deviations = deviations - self.mc_deviations(
+                    self.series(self.other_side, commod), commod)
+        return np.quantile(deviations, 1 - self.mc_quantile)
+
+    def mc_deviations(self, ts, commod):
+        """ Returns the Monte Carlo deviations of time series [ts] at the
+            prediction horizon of [commod], from an AR(1) fit. """
+        return mc_deviations(ts, steps=self.prediction_horizon(commod),
+                             back_steps=self.back_steps,
+                             n_paths=self.mc_paths, rng=self.mc_rng)
+
+    def predict_side(self, side, commod, time):
+        """
+        Returns the forecast of the [side] time series of [commod] made at
+        [time]: the pipelined or batched one if there is one, a forecast
+        of calc_method otherwise. The retirements scheduled are taken out
+        of the deployed side if track_retirement is set.
+        """
+        schedule = None
+        if side == self.deployed_side:
+            schedule = self.retirement_schedule(commod)
+        if self.pipeline:
+            value = self.forecast_pipeline.result(
+                (side, commod), self.series(side, commod), time,
+                schedule=schedule)
+            if value is not None:
+                return value
+        if (side, commod) in self.batched:
+            return self.batched.pop((side, commod))
+        method = self.forecast_method(side, commod)
+        kwargs = dict(steps=self.steps,
+                      std_dev=self.forecast_std_dev(),
+                      back_steps=self.back_steps,
+                      degree=self.degree,
+                      memo=self.failure_memo(side, commod, method),
+                      state=self.forecast_state(side, commod, method),
+                      refit=self.forecast_refit)
+        if schedule is not None:
+            return predict_with_retirement(method, self.series(side, commod),
+                                           schedule, time, **kwargs)
+        return forecast(method, self.series(side, commod), **kwargs)
@@ -0,0 +1,130 @@
+"""
+This pipeline.py file contains the background forecasting used by
+`timeseries_inst.py' and `supply_driven_deployment_inst.py' when their
+`pipeline' option is set.
+
+The forecasts of timestep t are fit in a worker thread during tick, from
+the history up to t-1, while cyclus performs the dynamic resource
+exchange. The decision phase then only corrects them with the value
+observed at t, along the sensitivity of the forecast to that value.
+
+The correction is only exact for the calc methods registered as linear
+(ma and poly), whose forecast moves by the same amount per unit of the
+value observed at t whatever that value is. The other methods fit their
+parameters to the values, so they are not pipelined and are forecast in
+the decision phase as usual. The fits only overlap the exchange if cyclus
+releases the GIL while it runs it, which has not been measured.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+from d3ploy.calc_methods import CALC_METHODS, forecast, horizon
+
+# worker thread shared by the pipelines of every institution, started on
+# first use, so pipelines that are dropped leave no thread behind
+_EXECUTOR = None
+
+
+def executor():
+    """ Returns the worker thread shared by every ForecastPipeline. """
+    global _EXECUTOR
+    if _EXECUTOR is None:
+        _EXECUTOR = ThreadPoolExecutor(max_workers=1)
+    return _EXECUTOR
+
+
+def fit_ahead(calc_method, ts, steps=1, std_dev=0, back_steps=10, degree=1):
+    """ Predicts, from a time series that ends one timestep before the
+        current one, the forecast the calc method would make from the
+        current timestep if its value were the last one of the time
+        series, and how much that forecast moves per unit of the value
+        of the current timestep. Only exact for linear calc methods.
+    Parameters:
+    -----------
+    calc_method: str
+        name of a registered linear calc method
+    ts: dictionary
+        key: time
+        value: value of the time series at time, up to the previous
+               timestep
+    steps, std_dev, back_steps, degree:
+        passed to the calc method
+
+    Returns:
+    --------
+    base: float
+        value the current timestep is filled with, the last one of ts
+    x_ahead: float
+        forecast from the time series extended with base
+    slope: float
+        change of x_ahead per unit change of the value of the current
+        timestep, so the forecast from the observed value is
+        x_ahead + slope * (observed - base)
+    """
+    time = max(ts) + 1
+    base = ts[time - 1]
+    delta = max(abs(base), 1.0)
+    x = []
+    for value in (base, base + delta):
+        extended = dict(ts)
+        extended[time] = value
+        x.append(forecast(calc_method, extended, steps=steps,
+                          std_dev=std_dev, back_steps=back_steps,
+                          degree=degree))
+    return base, x[0], (x[1] - x[0]) / delta
+
+
+class ForecastPipeline(object):
+    """
+    Runs the forecast fits of an institution in the background thread
+    shared by every institution. Each forecast is identified by a key,
+    for example (`supply', commod).
+    """
+
+    def __init__(self):
+        self.pending = {}
+
+    def submit(self, key, calc_method, ts, time, schedule=None, steps=1,
+               std_dev=0, back_steps=10, degree=1):
+        """
+        Starts fitting the forecast [key] of timestep [time] from the
+        values of time series [ts] before [time], if [calc_method] is
+        linear.
+        Parameters
+        ----------
+        schedule : RetirementSchedule
+            If given, the fit uses the retirement-corrected series.
+        """
+        if calc_method not in CALC_METHODS.linear_methods:
+            return
+        history = {t: v for t, v in ts.items() if t < time}
+        if len(history) == 0:
+            return
+        if schedule is not None:
+            history = schedule.corrected(history)
+        future = executor().submit(fit_ahead, calc_method, history,
+                                   steps=steps, std_dev=std_dev,
+                                   back_steps=back_steps, degree=degree)
+        self.pending[key] = (future, time, horizon(calc_method, steps))
+
+    def result(self, key, ts, time, schedule=None):
+        """
+        Waits for the forecast [key] and corrects it with the value of
+        time series [ts] observed at [time].
+        Returns
+        -------
+        x : float or None
+            The corrected forecast, or None if no fit of [time] was
+            started for [key].
+        """
+        future, submit_time, h = self.pending.pop(key, (None, None, None))
+        if future is None or submit_time != time:
+            return None
+        base, x_ahead, slope = future.result()
+        observed = ts[time]
+        if schedule is not None:
+            observed += schedule.retired(time)
+        x = x_ahead + slope * (observed - base)
+        if schedule is not None:
+            x -= schedule.retired(time + h)
+        return x
@@ -0,0 +1,125 @@
+"""
+This planner.py file contains the horizon deployment planning used by
+`timeseries_inst.py' for its driving commodity when its `plan_horizon'
+option is set.
+
+The demand of the driving commodity is given by the demand equation, so
+it does not have to be forecast one timestep at a time. Together with
+the retirements of the facilities already built, it fixes the
+deployment needed over the next timesteps, which is planned once and
+only planned again when the observed supply departs from the plan.
+"""
+
+import numpy as np
+
+import d3ploy.solver as solver
+
+
+class HorizonPlan(object):
+    """
+    Deployment schedule of a commodity over the timesteps following
+    [start], with the supply expected at each of them.
+    """
+
+    def __init__(self, start, builds, expected):
+        self.start = start
+        self.builds = builds
+        self.expected = expected
+
+    def end(self):
+        """ Returns the last timestep covered by the plan. """
+        return self.start + len(self.expected)
+
+    def expected_supply(self, time):
+        """ Returns the supply the plan expects at [time], or None if
+            [time] is not covered by the plan. """
+        if self.start < time <= self.end():
+            return self.expected[time - self.start - 1]
+        return None
+
+    def deviates(self, time, supply, tolerance):
+        """ Returns True if the supply observed at [time] departs from
+            the expected supply by more than [tolerance], relative to
+            the expected supply, or if [time] is not covered. """
+        expected = self.expected_supply(time)
+        if expected is None or time >= self.end():
+            return True
+        return abs(supply - expected) > tolerance * max(abs(expected), 1.0)
+
+    def pop(self, time):
+        """ Returns, and removes from the plan, the builds of [time]. """
+        return self.builds.pop(time, {})
+
+
+def plan_deployment(commodity_supply, commodity_dict, commod, demand, time,
+                    schedule=None, method='greedy', resolution=0, table=None,
+                    cache=None, agent_weight=0):
+    """ Plans the deployment of [commod] needed to meet [demand] over the
+        timesteps following [time], accounting for the capacity known to
+        retire and for the builds planned earlier in the horizon.
+    Parameters:
+    -----------
+    commodity_supply: dictionary
+        key: commod
+        value: dictionary
+            key: time
+            value: observed supply of commod at time
+    commodity_dict: dictionary
+        key: str
+            commodity name
+        value: dictionary
+            key: str
+                prototype name
+            value: dictionary
+                key: 'cap', 'pref', 'constraint_commod', 'constraint'
+    commod: str
+        commodity driving deployment
+    demand: array
+        demand of commod at timesteps [time] + 1 to [time] + len(demand)
+    time: int
+        current timestep
+    schedule: RetirementSchedule
+        retirements of the facilities supplying commod
+    method, resolution, table, cache, agent_weight:
+        passed to deploy_solver
+
+    Returns:
+    --------
+    plan: HorizonPlan
+        builds keyed by the timestep they are scheduled at, facilities
+        scheduled at a timestep supply from the next one
+    """
+    proto_commod = commodity_dict[commod]
+    supply = float(commodity_supply[commod][time])
+    times = np.arange(time + 1, time + 1 + len(demand))
+    if schedule is not None:
+        supply = supply - (schedule.retired(times) - schedule.retired(time))
+    else:
+        supply = np.full(len(times), supply)
+    # constraint commodities are assumed to stay at their current supply
+    constraint_supply = {}
+    for val_dict in proto_commod.values():
+        if val_dict['constraint_commod'] != '0':
+            constraint = val_dict['constraint_commod']
+            constraint_supply[constraint] = commodity_supply[constraint][time]
+
+    builds = {}
+    built = 0.0
+    expected = np.zeros(len(times))
+    for i, t in enumerate(times.tolist()):
+        diff = supply[i] + built - demand[i]
+        if diff < 0:
+            future_supply = {c: {t - 1: s}
+                             for c, s in constraint_supply.items()}
+            deploy_dict = solver.deploy_solver(future_supply, commodity_dict,
+                                               commod, diff, t - 1,
+                                               method=method,
+                                               resolution=resolution,
+                                               table=table, cache=cache,
+                                               agent_weight=agent_weight)
+            if len(deploy_dict) > 0:
+                builds[t - 1] = deploy_dict
+                built += sum(num * proto_commod[proto]['cap']
+                             for proto, num in deploy_dict.items())
+        expected[i] = supply[i] + built
+    return HorizonPlan(time, builds, expected.tolist())
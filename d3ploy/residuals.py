@@ -0,0 +1,223 @@
+"""
+This residuals.py file contains the bookkeeping of forecast residuals
+used by `timeseries_inst.py' and `supply_driven_deployment_inst.py' when
+their `residual_window' or `mc_paths' option is set.
+
+Each side of a commodity keeps the residuals of its own forecasts: the
+value each decision predicts is compared with the value observed once its
+timestep comes, less the capacity the institution deployed in between,
+which the forecast could not know about. The recent residuals of both
+sides give an empirical safety margin that does not assume they are
+normal, either as their quantiles or bootstrapped into Monte Carlo paths.
+"""
+
+import heapq
+import math
+from collections import deque
+
+import numpy as np
+
+
+class RollingQuantile(object):
+    """
+    Sliding window of the last [size] values of a stream, split into two
+    heaps around its [q] quantile: a max-heap of the values up to the
+    quantile and a min-heap of the values above it. A value is added and
+    the oldest one evicted in O(log size); evicted values are removed from
+    the heaps lazily, once they reach the top, and the heaps are rebuilt
+    when the evicted values outnumber the live ones.
+    """
+
+    def __init__(self, size=100, q=0.5):
+        self.size = size
+        self.q = q
+        self.window = deque()
+        self.lower = []
+        self.upper = []
+        self.side = {}
+        self.n_lower = 0
+        self.count = 0
+
+    def __len__(self):
+        return len(self.window)
+
+    def add(self, value):
+        """ Adds [value] to the window, evicting the oldest value if the
+            window is full. """
+        key = self.count
+        self.count += 1
+        self.window.append((value, key))
+        self.prune()
+        if self.lower and value <= -self.lower[0][0]:
+            self.push_lower(value, key)
+        else:
+            self.push_upper(value, key)
+        if len(self.window) > self.size:
+            old, old_key = self.window.popleft()
+            if self.side.pop(old_key) == 'lower':
+                self.n_lower -= 1
+        self.rebalance()
+        if len(self.lower) + len(self.upper) > 2 * len(self.window) + 16:
+            self.compact()
+
+    def push_lower(self, value, key):
+        heapq.heappush(self.lower, (-value, key))
+        self.side[key] = 'lower'
+        self.n_lower += 1
+
+    def push_upper(self, value, key):
+        heapq.heappush(self.upper, (value, key))
+        self.side[key] = 'upper'
+
+    def prune(self):
+        """ Pops the evicted values off the top of both heaps. """
+        while self.lower and self.lower[0][1] not in self.side:
+            heapq.heappop(self.lower)
+        while self.upper and self.upper[0][1] not in self.side:
+            heapq.heappop(self.upper)
+
+    def rebalance(self):
+        """ Moves values between the heaps until the lower heap holds the
+            values up to the rank of the quantile. """
+        target = int(math.floor(self.q * (len(self.window) - 1))) + 1
+        self.prune()
+        while self.n_lower > target:
+            value, key = heapq.heappop(self.lower)
+            self.n_lower -= 1
+            self.push_upper(-value, key)
+            self.prune()
+        while self.n_lower < target:
+            value, key = heapq.heappop(self.upper)
+            self.push_lower(value, key)
+            self.prune()
+
+    def compact(self):
+        """ Rebuilds both heaps from the values in the window. """
+        self.lower = [(v, k) for v, k in self.lower if k in self.side]
+        self.upper = [(v, k) for v, k in self.upper if k in self.side]
+        heapq.heapify(self.lower)
+        heapq.heapify(self.upper)
+
+    def quantile(self):
+        """
+        Returns the [q] quantile of the window, interpolated linearly
+        between the closest ranks like numpy.quantile.
+        Returns
+        -------
+        x : float
+            The quantile, 0 if the window is empty.
+        """
+        if len(self.window) == 0:
+            return 0.0
+        pos = self.q * (len(self.window) - 1)
+        lo = -self.lower[0][0]
+        frac = pos - math.floor(pos)
+        if frac == 0 or not self.upper:
+            return lo
+        return lo + frac * (self.upper[0][0] - lo)
+
+
+class ForecastResiduals(object):
+    """
+    Residuals of the forecasts of one time series, each one observed
+    [horizon] timesteps after it is predicted, kept for their [q]
+    quantile.
+    """
+
+    def __init__(self, size=100, q=0.5):
+        self.residuals = RollingQuantile(size, q)
+        self.pending = {}
+
+    def record(self, time, predicted, observed, horizon):
+        """
+        Records the residual of the value predicted for [time], if any,
+        and the value [predicted] for [time] + [horizon].
+        Parameters
+        ----------
+        observed : float
+            Value observed at [time].
+        """
+        previous = self.pending.pop(time, None)
+        if previous is not None:
+            self.residuals.add(observed - previous)
+        self.pending[time + horizon] = predicted
+
+    def deployed(self, capacity):
+        """ Adds [capacity], deployed after the pending values were
+            predicted, to them, so that it does not count as a residual. """
+        for time in self.pending:
+            self.pending[time] += capacity
+
+    def quantile(self):
+        return self.residuals.quantile()
+
+    def values(self):
+        """ Returns the residuals in the window, oldest first. """
+        return [value for value, key in self.residuals.window]
+
+
+class ResidualMargin(object):
+    """
+    Residuals of the forecasts of both sides of a commodity: the side the
+    institution deploys ([deployed]) and the side it deploys against
+    ([other]), whose difference the institution predicts.
+    """
+
+    def __init__(self, size=100, q=0.95):
+        self.deployed_residuals = ForecastResiduals(size, 1 - q)
+        self.other_residuals = ForecastResiduals(size, q)
+
+    def record(self, time, deployed, other, observed_deployed,
+               observed_other, horizon):
+        """
+        Records the residuals of both sides observed at [time] and their
+        values [deployed] and [other] predicted for [time] + [horizon].
+        """
+        self.deployed_residuals.record(time, deployed, observed_deployed,
+                                       horizon)
+        self.other_residuals.record(time, other, observed_other, horizon)
+
+    def margin(self, time, deployed, other, observed_deployed,
+               observed_other, horizon):
+        """
+        Records the residuals of both sides like record.
+        Returns
+        -------
+        margin : float
+            The (1 - q) quantile of the residuals of the deployed side
+            less the q quantile of the residuals of the other side, to add
+            to the predicted difference, 0 before any residual is
+            observed. The quantiles of both sides add up, which covers q
+            of the difference even when their errors move together.
+        """
+        self.record(time, deployed, other, observed_deployed, observed_other,
+                    horizon)
+        return self.deployed_residuals.quantile() - \
+            self.other_residuals.quantile()
+
+    def deviations(self, n_paths, rng, other=True):
+        """
+        Draws [n_paths] Monte Carlo deviations of the difference between
+        both sides from their predicted difference, by bootstrapping the
+        residuals of each side independently. The residuals of the other
+        side are left out if [other] is False.
+        Returns
+        -------
+        x : Array of [n_paths] deviations, None if a side bootstrapped
+            has less than three residuals.
+        """
+        deployed = self.deployed_residuals.values()
+        if len(deployed) < 3:
+            return None
+        x = rng.choice(deployed, size=n_paths)
+        if other:
+            residuals = self.other_residuals.values()
+            if len(residuals) < 3:
+                return None
+            x = x - rng.choice(residuals, size=n_paths)
+        return x
+
+    def deploy(self, capacity):
+        """ Records [capacity] deployed by the institution at the current
+            timestep. """
+        self.deployed_residuals.deployed(capacity)
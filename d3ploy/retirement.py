@@ -0,0 +1,159 @@
+"""
+This retirement.py file contains the bookkeeping of facility retirements
+used by `timeseries_inst.py' and `supply_driven_deployment_inst.py'.
+
+Facilities built by an institution leave the simulation at a known time
+(entry time + lifetime), so the capacity they take with them does not
+have to be discovered by the forecasters after the fact.
+"""
+
+import numpy as np
+
+from d3ploy.accumulator import TimeSeriesAccumulator
+from d3ploy.calc_methods import forecast, horizon
+
+
+def present_offsets(ts, start):
+    """ Returns the offsets from [start] of the timesteps of
+        TimeSeriesAccumulator [ts] from [start] on, [start] being at
+        least its first timestep if it has any. """
+    if len(ts) == 0 or start >= ts.stop:
+        return np.zeros(0, dtype=int)
+    return np.flatnonzero(ts.present[max(start, ts.start) - ts.origin:
+                                     ts.stop - ts.origin])
+
+
+class RetirementSchedule(object):
+    """
+    Deterministic schedule of the capacity a commodity loses as the
+    facilities supplying it reach the end of their lifetime.
+
+    The corrected series of the TimeSeriesAccumulator it was last asked
+    for is kept, and only the timesteps from the last one corrected, or
+    from the earliest loss scheduled or removed since, are corrected
+    again.
+    """
+
+    def __init__(self):
+        self.losses = {}
+        self.times = np.zeros(0)
+        self.cumulative = np.zeros(0)
+        self.fresh = True
+        self.source = None
+        self.series = None
+        # first timestep of the kept corrected series to correct again
+        self.stale = None
+
+    def _changed(self, time):
+        if self.stale is not None:
+            self.stale = min(self.stale, time)
+        self.fresh = False
+
+    def add(self, time, cap):
+        """ Schedules the loss of [cap] from timestep [time] onwards. """
+        self.losses[time] = self.losses.get(time, 0.0) + cap
+        self._changed(time)
+
+    def remove(self, time, cap):
+        """ Removes a loss of [cap] previously scheduled at [time]. """
+        if time not in self.losses:
+            return
+        self.losses[time] -= cap
+        if abs(self.losses[time]) < 1e-12:
+            del self.losses[time]
+        self._changed(time)
+
+    def _update(self):
+        times = sorted(self.losses)
+        self.times = np.array(times, dtype=float)
+        self.cumulative = np.cumsum([self.losses[t] for t in times])
+        self.fresh = True
+
+    def retired(self, time):
+        """
+        Returns the capacity retired at or before [time].
+        Parameters
+        ----------
+        time : int or array of ints
+            Timestep(s) to evaluate.
+        Returns
+        -------
+        retired : float or array of floats
+            Cumulative capacity retired at [time].
+        """
+        if not self.fresh:
+            self._update()
+        if len(self.times) == 0:
+            return 0.0 * np.asarray(time, dtype=float)
+        indx = np.searchsorted(self.times, time, side='right')
+        cumulative = np.append(0.0, self.cumulative)
+        return cumulative[indx]
+
+    def corrected(self, ts):
+        """ Returns time series [ts] with the capacity retired at each
+            timestep added back, that is the series that would have been
+            observed without any retirements. The corrected series of a
+            TimeSeriesAccumulator is kept and must not be modified; its
+            last timestep is corrected again on the next call, as records
+            of the current timestep may still come. """
+        if isinstance(ts, TimeSeriesAccumulator):
+            return self._corrected_accumulator(ts)
+        times = np.fromiter(ts.keys(), dtype=float)
+        values = np.asarray(list(ts.values()), dtype=float)
+        values = values + self.retired(times)
+        return dict(zip(ts.keys(), values))
+
+    def _corrected_accumulator(self, ts):
+        if ts is not self.source:
+            self.source = ts
+            self.series = TimeSeriesAccumulator()
+            self.stale = None
+        if len(ts) == 0:
+            return self.series
+        start = ts.start if self.stale is None else max(self.stale, ts.start)
+        present = present_offsets(ts, start)
+        if len(ts) - len(present) != \
+                len(self.series) - len(present_offsets(self.series, start)):
+            # a timestep before [start] was recorded since the last call
+            start = ts.start
+            present = present_offsets(ts, start)
+        lo = start - ts.origin
+        hi = ts.stop - ts.origin
+        times = present + start
+        values = ts.data[lo:hi][present] + self.retired(times)
+        for time, value in zip(times.tolist(), values.tolist()):
+            self.series[time] = value
+        self.stale = ts.stop - 1
+        return self.series
+
+
+def predict_with_retirement(calc_method, ts, schedule, time, steps=1,
+                            std_dev=0, back_steps=10, degree=1, memo=None,
+                            refit=0, state=None):
+    """ Predicts the supply of a commodity by combining the forecast of
+        [calc_method] on the retirement-corrected time series with the
+        capacity known to retire before the predicted timestep.
+    Parameters:
+    -----------
+    calc_method: str
+        name of a registered calc method, a cheap one (ma, poly) is
+        usually enough once retirements are accounted for
+    ts: dictionary
+        key: time
+        value: observed supply at time
+    schedule: RetirementSchedule
+        retirements of the facilities supplying the commodity
+    time: int
+        current timestep, the last entry of ts
+    steps, std_dev, back_steps, degree, memo, refit, state:
+        passed to forecast
+
+    Returns:
+    --------
+    x: float
+        predicted supply
+    """
+    x = forecast(calc_method, schedule.corrected(ts), steps=steps,
+                 std_dev=std_dev, back_steps=back_steps, degree=degree,
+                 memo=memo, refit=refit, state=state)
+    return x - schedule.retired(time + horizon(calc_method, steps))
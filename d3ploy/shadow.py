@@ -0,0 +1,207 @@
+"""
+This shadow.py file contains the shadow evaluation of calc methods used
+by `timeseries_inst.py' and `supply_driven_deployment_inst.py' when their
+`shadow_methods' option is set.
+
+Shadow methods forecast the same time series as the calc method of the
+institution, but their forecasts never reach the deployment decision.
+Each forecast is compared with the value observed once its timestep
+comes, and the CPU time of each call is measured, so a single run gives
+the accuracy and cost of every method.
+"""
+
+import math
+import time as timer
+
+from d3ploy.calc_methods import CALC_METHODS, ForecastState, forecast
+from d3ploy.calc_methods import horizon
+from d3ploy.NO_solvers import FitFailureMemo
+
+
+class ShadowEvaluator(object):
+    """
+    Runs calc methods [methods] in shadow mode and accumulates, for each
+    (method, side, commodity), the forecast errors and CPU time.
+    """
+
+    def __init__(self, methods):
+        self.methods = list(methods)
+        self.memos = {}
+        self.states = {}
+        self.pending = {}
+        self.stats = {}
+
+    def evaluate(self, side, commod, ts, time, steps=1, back_steps=10,
+                 degree=1, methods=None):
+        """
+        Scores the forecasts of the [side] time series [ts] of [commod]
+        made for [time], and forecasts it again with every method.
+        Parameters
+        ----------
+        ts : dictionary
+            key: time
+            value: observed value at time, up to [time]
+        methods : list of str
+            methods to run, all of them if not given
+        """
+        if methods is None:
+            methods = self.methods
+        for method in methods:
+            key = (method, side, commod)
+            if key not in self.stats:
+                self.stats[key] = {'count': 0, 'abs_error': 0.0,
+                                   'sq_error': 0.0, 'cpu': 0.0, 'calls': 0,
+                                   'failures': 0}
+                self.memos[key] = FitFailureMemo()
+                self.states[key] = ForecastState()
+                self.pending[key] = {}
+            stats = self.stats[key]
+            predicted = self.pending[key].pop(time, None)
+            if predicted is not None:
+                error = ts[time] - predicted
+                stats['count'] += 1
+                stats['abs_error'] += abs(error)
+                stats['sq_error'] += error ** 2
+            start = timer.process_time()
+            try:
+                x = forecast(method, ts, steps=steps, std_dev=0,
+                             back_steps=back_steps, degree=degree,
+                             memo=self.memos[key], state=self.states[key])
+            except Exception:
+                stats['failures'] += 1
+                continue
+            finally:
+                stats['cpu'] += timer.process_time() - start
+                stats['calls'] += 1
+            self.pending[key][time + horizon(method, steps)] = float(x)
+
+    def diagnostics(self):
+        """ Returns the mean absolute error, root mean squared error and
+            mean CPU time per call of every (method, side, commodity). """
+        report = {}
+        for key, stats in self.stats.items():
+            count = max(stats['count'], 1)
+            report[key] = {'mae': stats['abs_error'] / count,
+                           'rmse': math.sqrt(stats['sq_error'] / count),
+                           'cpu': stats['cpu'] / max(stats['calls'], 1),
+                           'count': stats['count'],
+                           'failures': stats['failures']}
+        return report
+
+    def summary(self, commod):
+        """ Returns the diagnostics of [commod] as text, one entry per
+            method and side. """
+        out_text = ""
+        for (method, side, c), stats in sorted(self.diagnostics().items()):
+            if c != commod:
+                continue
+            out_text += " shadow_%s_%s_mae %g cpu %g" % (
+                method, side, stats['mae'], stats['cpu'])
+        return out_text
+
+
+def backtest(calc_method, ts, window=20, steps=1, back_steps=10, degree=1,
+             history=0):
+    """
+    Runs a rolling backtest of [calc_method] over the last [window]
+    predictable values of time series [ts]: each of them is predicted
+    from the values before it, as it would have been during the run.
+    Parameters
+    ----------
+    ts : dictionary
+        key: time
+        value: value of the time series at time, in order of time
+    history : int
+        number of values each prediction is made from, all of the
+        previous values if 0
+    Returns
+    -------
+    errors : list of floats
+        observed minus predicted value of each backtested timestep
+    cpu : float
+        mean CPU time of a prediction
+    """
+    times = list(ts.keys())
+    values = list(ts.values())
+    h = horizon(calc_method, steps)
+    memo = FitFailureMemo()
+    state = ForecastState()
+    errors = []
+    cpu = 0.0
+    for end in range(max(1, len(values) - h - window + 1),
+                     len(values) - h + 1):
+        start = 0 if history <= 0 else max(0, end - history)
+        past = dict(zip(times[start:end], values[start:end]))
+        t0 = timer.process_time()
+        x = forecast(calc_method, past, steps=steps, std_dev=0,
+                     back_steps=back_steps, degree=degree, memo=memo,
+                     state=state)
+        cpu += timer.process_time() - t0
+        errors.append(values[end - 1 + h] - float(x))
+    return errors, cpu / max(len(errors), 1)
+
+
+class AutoSelector(object):
+    """
+    Chooses, for each time series, the calc method of [methods] of the
+    lowest cost rank declared in CALC_METHODS among those whose mean
+    absolute error in a backtest over the last [window] timesteps is
+    within [tolerance] of the best one, relative to it, and the first
+    listed among methods of the same rank. The choice does not depend
+    on timing, so the same series always gives the same choice. Each
+    value of the backtest is predicted from the [history] values before
+    it. The choice is made again every [interval] timesteps, and the
+    errors and the CPU times per call measured in the backtests are kept
+    in [scores] for diagnostics. Until a time series can be backtested,
+    the first method is used.
+    """
+
+    def __init__(self, methods, tolerance=0.1, interval=20, window=20,
+                 history=100, steps=1, back_steps=10, degree=1):
+        self.methods = list(methods)
+        self.tolerance = tolerance
+        self.interval = interval
+        self.window = window
+        self.history = history
+        self.steps = steps
+        self.back_steps = back_steps
+        self.degree = degree
+        self.choices = {}
+        self.scores = {}
+
+    def method(self, key, ts, time):
+        """ Returns the method chosen for time series [ts], identified
+            by [key], at [time]. """
+        choice = self.choices.get(key)
+        if choice is not None and time - choice[1] < self.interval:
+            return choice[0]
+        if len(ts) < self.window + self.steps + 1:
+            return self.methods[0]
+        method = self.choose(key, ts)
+        self.choices[key] = (method, time)
+        return method
+
+    def choose(self, key, ts):
+        """ Backtests every method on time series [ts] and returns the
+            accurate enough one of the lowest cost rank, the first
+            listed among methods of the same rank. """
+        scores = {}
+        for method in self.methods:
+            try:
+                errors, cpu = backtest(method, ts, window=self.window,
+                                       steps=self.steps,
+                                       back_steps=self.back_steps,
+                                       degree=self.degree,
+                                       history=self.history)
+            except Exception:
+                continue
+            if len(errors) > 0:
+                scores[method] = (sum(abs(e) for e in errors) / len(errors),
+                                  cpu)
+        self.scores[key] = scores
+        if len(scores) == 0:
+            return self.methods[0]
+        best = min(mae for mae, cpu in scores.values())
+        accurate = [method for method in self.methods if method in scores and
+                    scores[method][0] <= best * (1 + self.tolerance) + 1e-12]
+        return min(accurate, key=CALC_METHODS.cost)
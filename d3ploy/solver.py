@@ -11,7 +11,147 @@ aid `timeseries_inst.py'.
 """
 
 
-def deploy_solver(commodity_supply, commodity_dict, commod, diff, time):
+# number of timesteps of preferences the institutions evaluate ahead at
+# enter_notify, the table is extended past it by doubling
+PREFERENCE_HORIZON = 256
+
+
+class PrototypeTable(object):
+    """
+    Capacities of the prototypes of a commodity as an array, presorted
+    by descending capacity. Institutions build one per commodity at
+    enter_notify, so the solver never sorts the prototypes itself.
+
+    If [horizon] is given, the preference of every prototype is also
+    evaluated once for timesteps 0 to [horizon] - 1 into a
+    (prototype x time) array, extended by doubling if the simulation
+    runs past it, and the constraints are kept as a boolean mask,
+    updated only for the constraint commodities whose supply changed.
+    """
+
+    def __init__(self, proto_commod, horizon=0):
+        protos = list(proto_commod.keys())
+        caps = np.array([float(proto_commod[proto]['cap'])
+                         for proto in protos])
+        # stable, so prototypes with the same capacity keep input order
+        order = np.argsort(-caps, kind='stable')
+        self.protos = [protos[i] for i in order]
+        self.caps = caps[order]
+        self.cap_list = self.caps.tolist()
+
+        # preferences and constraints keep the input order
+        self.names = protos
+        self.pref_eqs = [str(proto_commod[proto]['pref']) for proto in protos]
+        self.horizon = 0
+        self.prefs = np.zeros((len(protos), 0))
+        constrained = [i for i, proto in enumerate(protos)
+                       if proto_commod[proto]['constraint_commod'] != '0']
+        self.constrained = np.array(constrained, dtype=int)
+        self.constraint_commods = sorted(set(
+            proto_commod[protos[i]]['constraint_commod'] for i in constrained))
+        self.constraint_index = np.array(
+            [self.constraint_commods.index(
+                proto_commod[protos[i]]['constraint_commod'])
+             for i in constrained], dtype=int)
+        self.thresholds = np.array(
+            [float(proto_commod[protos[i]]['constraint'])
+             for i in constrained])
+        self.feasible = np.ones(len(protos), dtype=bool)
+        # supply of each constraint commodity at the last update
+        self.supply = np.full(len(self.constraint_commods), np.nan)
+        if horizon > 0:
+            self.extend(horizon)
+
+    def extend(self, horizon):
+        """ Evaluates the preferences of timesteps [self.horizon] to
+            [horizon] - 1. """
+        times = np.arange(self.horizon, horizon)
+        block = np.array([evaluate_preference_eq(eq, times)
+                          for eq in self.pref_eqs]).reshape(
+                              len(self.names), len(times))
+        self.prefs = np.hstack((self.prefs, block))
+        self.horizon = horizon
+
+    def preferences(self, time):
+        """ Returns the preferences of the prototypes at [time],
+            as returned by evaluate_preference. """
+        if time >= self.horizon:
+            self.extend(max(2 * self.horizon, time + 1))
+        return dict(zip(self.names, self.prefs[:, time].tolist()))
+
+    def update_constraints(self, commodity_supply, time):
+        """ Updates the mask of the prototypes whose constraint is met,
+            looking up the supply of each constraint commodity once and
+            checking again only the prototypes constrained by the
+            commodities whose supply changed since the last update. """
+        if len(self.constrained) == 0:
+            return self.feasible
+        supply = np.array([commodity_supply[commod][time]
+                           for commod in self.constraint_commods],
+                          dtype=float)
+        # nan at the first update, so every row is checked
+        changed = ~(supply == self.supply)
+        if not changed.any():
+            return self.feasible
+        rows = changed[self.constraint_index]
+        self.feasible[self.constrained[rows]] = \
+            supply[self.constraint_index[rows]] >= self.thresholds[rows]
+        self.supply = supply
+        return self.feasible
+
+    def check_constraint(self, commodity_supply, eval_pref_fac, time):
+        """ Same as check_constraint, using the constraint mask. """
+        feasible = self.update_constraints(commodity_supply, time)
+        for i in self.constrained:
+            if not feasible[i]:
+                eval_pref_fac[self.names[i]] = -1e299
+        return eval_pref_fac
+
+
+class PlanCache(object):
+    """
+    Least recently used cache of deployment plans. Plans are keyed by
+    commodity, shortfall rounded up to the smallest prototype capacity
+    and the ranking of the preferences and constraints. A plan is only
+    cached if it covers the rounded shortfall, so it covers every
+    shortfall it is returned for.
+    """
+
+    def __init__(self, size=128):
+        self.size = size
+        self.plans = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """ Returns the plan cached for [key], or None. """
+        plan = self.plans.get(key)
+        if plan is None:
+            self.misses += 1
+            return None
+        self.plans.move_to_end(key)
+        self.hits += 1
+        return plan
+
+    def put(self, key, plan):
+        """ Caches [plan] for [key], evicting the least recently used
+            plan if the cache is full. """
+        self.plans[key] = plan
+        self.plans.move_to_end(key)
+        while len(self.plans) > self.size:
+            self.plans.popitem(last=False)
+
+    def stats(self):
+        calls = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / calls if calls else 0.0,
+                'plans': len(self.plans)}
+
+
+def deploy_solver(commodity_supply, commodity_dict, commod, diff, time,
+                  method='greedy', resolution=0, table=None, cache=None,
+                  agent_weight=0):
     """ This function optimizes prototypes to deploy to minimize over
         deployment of prototypes.
     Paramters:
@@ -35,6 +175,23 @@ def deploy_solver(commodity_supply, commodity_dict, commod, diff, time):
         lack in supply
     time: int
         time of evaluation
+    method: str
+        how to deploy when the preferences are the same,
+        `greedy' for minimize_number_of_deployment,
+        `exact' for minimize_overbuild or
+        `agent_count' for minimize_agents
+    resolution: float
+        capacity resolution of the exact and agent_count methods
+    table: PrototypeTable
+        presorted prototypes of commod, built if not given, its
+        preference and constraint tables are used if it has any
+    cache: PlanCache
+        if given, plans are looked up in the cache, and added to it
+        if they also cover the shortfall rounded up to the smallest
+        prototype capacity
+    agent_weight: float
+        capacity-equivalent cost of each facility deployed by the
+        agent_count method
 
     Returns:
     --------
@@ -46,9 +203,14 @@ def deploy_solver(commodity_supply, commodity_dict, commod, diff, time):
     proto_commod = commodity_dict[commod]
     # if the preference is defined
 
-    eval_pref_fac = evaluate_preference(proto_commod, time)
-    eval_pref_fac = check_constraint(proto_commod, commodity_supply,
-                                     eval_pref_fac, time)
+    if table is not None and table.horizon > 0:
+        eval_pref_fac = table.preferences(time)
+        eval_pref_fac = table.check_constraint(commodity_supply,
+                                               eval_pref_fac, time)
+    else:
+        eval_pref_fac = evaluate_preference(proto_commod, time)
+        eval_pref_fac = check_constraint(proto_commod, commodity_supply,
+                                         eval_pref_fac, time)
     filtered_pref_fac = {}
     for key, val in eval_pref_fac.items():
         val = int(val)
@@ -57,17 +219,53 @@ def deploy_solver(commodity_supply, commodity_dict, commod, diff, time):
         else:
             filtered_pref_fac[key] = -1
 
+    tied = len(set(filtered_pref_fac.values())) == 1
+    if cache is not None:
+        if table is None:
+            table = PrototypeTable(proto_commod)
+        min_cap = table.cap_list[-1]
+        quantum = int(math.ceil(diff / min_cap - 1e-9))
+        key = (commod, quantum, tied,
+               tuple(sorted(eval_pref_fac, key=eval_pref_fac.get,
+                            reverse=True)),
+               tuple(val <= -1e299 for val in eval_pref_fac.values()))
+        plan = cache.get(key)
+        if plan is not None:
+            return dict(plan)
+
     # check if the preference values are different
-    if len(set(filtered_pref_fac.values())) != 1:
+    if not tied and method == 'agent_count':
+        # deploy the prototypes sharing the highest preference,
+        # such as a prototype and its lumped variants
+        top = max(eval_pref_fac.values())
+        group = {proto: val_dict for proto, val_dict in proto_commod.items()
+                 if eval_pref_fac[proto] == top}
+        plan = minimize_agents(group, diff, agent_weight, resolution)
+    elif not tied:
         # if there is a difference,
         # deploy the one with highest preference
         # until it oversupplies
-        return preference_deploy(proto_commod, eval_pref_fac, diff)
+        plan = preference_deploy(proto_commod, eval_pref_fac, diff)
 
     # if preference is not given,
     # or all the preference values are the same,
     # deploy to minimize number of deployment
-    return minimize_number_of_deployment(proto_commod, diff)
+    elif method == 'exact':
+        plan = minimize_overbuild(proto_commod, diff, resolution, table)
+    elif method == 'agent_count':
+        plan = minimize_agents(proto_commod, diff, agent_weight, resolution,
+                               table)
+    elif method == 'greedy':
+        plan = minimize_number_of_deployment(proto_commod, diff, table)
+    else:
+        raise ValueError('The deploy method %s is not valid.' % method)
+    # the plan is only reused for other shortfalls of the same bucket if
+    # it also covers the largest of them
+    if cache is not None and \
+            sum(num * proto_commod[proto]['cap']
+                for proto, num in plan.items()) >= quantum * min_cap - 1e-9:
+        cache.put(key, dict(plan))
+    return plan
 
 
 def evaluate_preference(proto_commod, time):
@@ -80,6 +278,33 @@ def evaluate_preference(proto_commod, time):
     return eval_pref_fac
 
 
+def evaluate_preference_eq(pref, times):
+    """ Evaluates preference equation [pref] at every timestep of the
+        array [times] at once, or one timestep at a time if the
+        equation does not support arrays. The timesteps are floats, so
+        equations such as 2**t do not wrap around as integers would,
+        and the values that are not finite are evaluated again one at a
+        time with integer timesteps, as evaluate_preference does. """
+    t = np.asarray(times, dtype=float)
+    try:
+        with np.errstate(all='ignore'):
+            values = np.asarray(eval(pref), dtype=float)
+        values = np.broadcast_to(values, t.shape).astype(float)
+    except Exception:
+        values = []
+        for t in times.tolist():
+            values.append(float(eval(pref)))
+        return np.array(values)
+    for i in np.flatnonzero(~np.isfinite(values)).tolist():
+        t = int(times[i])
+        try:
+            values[i] = float(eval(pref))
+        except (ArithmeticError, ValueError):
+            # such as 1/t at t = 0, kept as evaluated over the array
+            pass
+    return values
+
+
 def check_constraint(proto_commod, commodity_supply, eval_pref_fac, time):
     for proto, val_dict in proto_commod.items():
         if val_dict['constraint_commod'] != '0':
@@ -112,24 +337,13 @@ def preference_deploy(proto_commod, pref_fac, diff):
     """
     # get the facility with highest preference
     deploy_dict = {}
-    proto = sorted(pref_fac,
-                   key=pref_fac.get, reverse=True)[0]
-    if diff >= proto_commod[proto]['cap']:
-        deploy_dict[proto] = 1
-        diff -= proto_commod[proto]['cap']
-        while diff > proto_commod[proto]['cap']:
-            deploy_dict[proto] += 1
-            diff -= proto_commod[proto]['cap']
-        if diff == 0:
-            return deploy_dict
-        else:
-            deploy_dict[proto] += 1
-    elif diff > 0:
-        deploy_dict[proto] = 1
+    proto = max(pref_fac, key=pref_fac.get)
+    if diff > 0:
+        deploy_dict[proto] = int(math.ceil(diff / proto_commod[proto]['cap']))
     return deploy_dict
 
 
-def minimize_number_of_deployment(proto_commod, remainder):
+def minimize_number_of_deployment(proto_commod, remainder, table=None):
     """ This function deploys facilities to meet the lack in
     capacity by deploying the least number of facilities.
 
@@ -140,6 +354,8 @@ def minimize_number_of_deployment(proto_commod, remainder):
         value: prototype capacity
     remainder: float
         amount of capacity that is needed
+    table: PrototypeTable
+        presorted prototypes, built if not given
 
     Returns:
     --------
@@ -147,26 +363,22 @@ def minimize_number_of_deployment(proto_commod, remainder):
         key: prototype name
         value: number of prototype to deploy
     """
+    if table is None:
+        table = PrototypeTable(proto_commod)
     deploy_dict = {}
-    cap_dict = {}
-    for proto, val_dict in proto_commod.items():
-        cap_dict[proto] = val_dict['cap']
-    min_cap = min(cap_dict.values())
-    key_list = sorted(cap_dict, key=cap_dict.get, reverse=True)
-    for proto in key_list:
-        # if diff still smaller than the proto capacity,
-        if remainder >= proto_commod[proto]['cap']:
-            deploy_dict[proto] = 1
-            remainder -= proto_commod[proto]['cap']
-            while remainder > proto_commod[proto]['cap']:
-                deploy_dict[proto] += 1
-                remainder -= proto_commod[proto]['cap']
+    for proto, cap in zip(table.protos, table.cap_list):
+        # deploy until the remainder is at most one unit of the
+        # prototype, which is left for smaller prototypes
+        if remainder >= cap:
+            num = max(1, int(math.ceil(remainder / cap)) - 1)
+            deploy_dict[proto] = num
+            remainder -= num * cap
     if remainder == 0:
         return deploy_dict
 
-    for proto in list(reversed(key_list)):
+    for proto, cap in zip(reversed(table.protos), reversed(table.cap_list)):
         # see if the prototype cap is bigger than remainder
-        if remainder > proto_commod[proto]['cap']:
+        if remainder > cap:
             continue
         if proto in deploy_dict.keys():
             deploy_dict[proto] += 1
@@ -175,3 +387,411 @@ def minimize_number_of_deployment(proto_commod, remainder):
         break
 
     return deploy_dict
+
+
+# minimum number of units reaching each quantized capacity, memoized per
+# set of quantized prototype capacities, least recently used first
+DP_TABLES = OrderedDict()
+
+# number of sets of quantized prototype capacities memoized in DP_TABLES
+DP_TABLES_SIZE = 8
+
+# largest number of quantized capacity cells solved exactly
+MAX_DP_CELLS = 200000
+
+
+def dp_table(quanta, size):
+    """ Returns the coin-change tables of the quantized capacities
+        [quanta] covering at least [size] cells, extending the memoized
+        tables if needed. Only the tables of the DP_TABLES_SIZE most
+        recently used sets of capacities are kept.
+
+    Parameters:
+    ----------
+    quanta: tuple of ints
+        quantized prototype capacities
+    size: int
+        number of cells (capacities 0 to size - 1) needed
+
+    Returns:
+    --------
+    count: array of floats
+        minimum number of units adding up to each capacity,
+        inf if the capacity cannot be reached
+    last: array of ints
+        index of the prototype added last to reach each capacity
+    """
+    count, last = DP_TABLES.get(quanta, (np.zeros(1), np.zeros(1, int)))
+    start = len(count)
+    if start < size:
+        size = max(size, 2 * start)
+        count = np.append(count, np.full(size - start, np.inf))
+        last = np.append(last, np.full(size - start, -1, dtype=int))
+        # unbounded coin change, one prototype at a time: along the cells
+        # of a residue modulo [q], the units needed are a running minimum
+        # of the count so far plus one unit per [q] cells. The cells
+        # before [start] are already solved, the last [q] of them seed
+        # the new ones.
+        for indx, q in enumerate(quanta):
+            base = max(start - q, 0)
+            rows = -(-(size - base) // q)
+            cells = np.full(rows * q, np.inf)
+            cells[:size - base] = count[base:]
+            cells = cells.reshape(rows, q)
+            units = np.arange(rows)[:, None]
+            best = np.minimum.accumulate(cells - units, axis=0) + units
+            best = best.ravel()[:size - base]
+            better = best < count[base:]
+            count[base:][better] = best[better]
+            last[base:][better] = indx
+    DP_TABLES[quanta] = (count, last)
+    DP_TABLES.move_to_end(quanta)
+    while len(DP_TABLES) > DP_TABLES_SIZE:
+        DP_TABLES.popitem(last=False)
+    return count, last
+
+
+def minimize_overbuild(proto_commod, remainder, resolution=0, table=None):
+    """ This function deploys facilities to meet the lack in capacity
+    with the least overbuilt capacity and, among those deployments,
+    the least number of facilities. It solves the coin-change problem
+    exactly over capacities quantized to [resolution].
+
+    Shortfalls larger than MAX_DP_CELLS cells are first covered with the
+    largest prototype, and only the rest is solved exactly.
+
+    Parameters:
+    ----------
+    proto_commod: dictionary
+        key: prototype name
+        value: dictionary
+            key: 'cap', 'pref', 'constraint_commod', 'constraint'
+            value
+    remainder: float
+        amount of capacity that is needed
+    resolution: float
+        capacity quantum, defaults to a tenth of the smallest
+        prototype capacity
+    table: PrototypeTable
+        presorted prototypes, built if not given
+
+    Returns:
+    --------
+    deploy_dict: dictionary
+        key: prototype name
+        value: number of prototype to deploy
+    """
+    return minimize_agents(proto_commod, remainder, 0, resolution, table)
+
+
+def minimize_agents(proto_commod, remainder, agent_weight, resolution=0,
+                    table=None):
+    """ This function deploys facilities to meet the lack in capacity
+    while minimizing the overbuilt capacity plus [agent_weight] for
+    every facility deployed, so that a few large facilities are
+    preferred over many small ones when they do not overbuild by more
+    than [agent_weight] per facility saved. Ties are broken by the
+    least overbuilt capacity. It solves the coin-change problem exactly
+    over capacities quantized to [resolution].
+
+    Shortfalls larger than MAX_DP_CELLS cells are first covered with the
+    largest prototype, and only the rest is solved exactly. The table
+    only spans the cells a deployment can end on, so prototypes larger
+    than the shortfall are weighed as a single facility instead.
+
+    Parameters:
+    ----------
+    proto_commod: dictionary
+        key: prototype name
+        value: dictionary
+            key: 'cap', 'pref', 'constraint_commod', 'constraint'
+            value
+    remainder: float
+        amount of capacity that is needed
+    agent_weight: float
+        capacity-equivalent cost of each facility deployed,
+        0 for the least overbuilt capacity and then the least number
+        of facilities
+    resolution: float
+        capacity quantum, defaults to a tenth of the smallest
+        prototype capacity
+    table: PrototypeTable
+        presorted prototypes, built if not given
+
+    Returns:
+    --------
+    deploy_dict: dictionary
+        key: prototype name
+        value: number of prototype to deploy
+    """
+    deploy_dict = {}
+    if remainder <= 0:
+        return deploy_dict
+    if table is None:
+        table = PrototypeTable(proto_commod)
+    protos = table.protos
+    caps = table.caps
+    if resolution <= 0:
+        resolution = caps.min() / 10.0
+    # capacities are rounded down, so a deployment reaching the quantized
+    # shortfall never has less than the real shortfall
+    quanta = np.maximum(np.floor(caps / resolution + 1e-9), 1).astype(int)
+    need = int(math.ceil(remainder / resolution - 1e-9))
+    largest = int(np.argmax(quanta))
+    counts = np.zeros(len(protos), dtype=int)
+    if need > MAX_DP_CELLS:
+        bulk = int(math.ceil((need - MAX_DP_CELLS) / quanta[largest]))
+        counts[largest] = bulk
+        need -= bulk * quanta[largest]
+    cell = 0
+    small = np.arange(len(quanta))
+    if need > 0:
+        # the smallest prototype alone reaches a cell below need + its
+        # quantum, and a prototype at least that large only overbuilds
+        # more on its own, so it is left out of the table
+        size = need + quanta.min()
+        small = np.nonzero(quanta < size)[0]
+        count, last = dp_table(tuple(quanta[small]), size)
+        reachable = np.nonzero(np.isfinite(count[need:]))[0]
+        cell = need + int(reachable[0])
+    if need > 0 and agent_weight > 0:
+        # overbuilding by more than the cost of the facilities of the
+        # least overbuilt deployment never pays off
+        window = int(math.ceil(agent_weight * count[cell] / resolution))
+        window = min(window, MAX_DP_CELLS)
+        size = cell + window + 1
+        small = np.nonzero(quanta < size)[0]
+        count, last = dp_table(tuple(quanta[small]), size)
+        cells = np.arange(cell, size)
+        cost = (cells - need) * resolution + agent_weight * count[cells]
+        cell = int(cells[np.argmin(cost)])
+        # a prototype left out of the table covers the shortfall alone
+        large = np.nonzero(quanta >= size)[0]
+        if len(large) > 0:
+            indx = int(large[np.argmin(quanta[large])])
+            if (quanta[indx] - need) * resolution + agent_weight < \
+                    cost.min():
+                counts[indx] += 1
+                cell = 0
+    while cell > 0:
+        indx = small[last[cell]]
+        counts[indx] += 1
+        cell -= quanta[indx]
+    # a prototype smaller than one quantum is counted as one quantum, so
+    # the real capacity is topped up with the prototype overbuilding least
+    missing = remainder - np.dot(counts, caps)
+    while missing > 1e-9 * remainder:
+        fits = np.nonzero(caps >= missing)[0]
+        if len(fits) > 0:
+            indx = int(fits[np.argmin(caps[fits])])
+        else:
+            indx = int(np.argmax(caps))
+        counts[indx] += 1
+        missing -= caps[indx]
+    for indx in np.nonzero(counts)[0]:
+        deploy_dict[protos[indx]] = int(counts[indx])
+    return deploy_dict
+
+
+def lump_prototypes(commodity_dict, lumped_prototypes):
+    """ Adds lumped variants of prototypes to the prototypes of each
+    commodity. A lumped variant is a prototype equivalent to [factor]
+    facilities of its base prototype, so deploying it instead of many
+    small facilities reduces the number of agents in the simulation.
+
+    Parameters:
+    ----------
+    commodity_dict: dictionary
+        key: commodity name
+        value: dictionary
+            key: prototype name
+            value: dictionary
+                key: 'cap', 'pref', 'constraint_commod', 'constraint'
+                value
+    lumped_prototypes: list of str
+        base_lumped_factor format, where lumped is the prototype name of
+        the variant of prototype base with factor times its capacity
+
+    Returns:
+    --------
+    lumped_dict: dictionary
+        commodity_dict with the lumped variants added, the variants
+        have the preference and constraint of their base prototype
+    """
+    lumped_dict = {commod: dict(proto_commod)
+                   for commod, proto_commod in commodity_dict.items()}
+    for entry in lumped_prototypes:
+        z = entry.split('_')
+        if len(z) != 3:
+            raise ValueError(
+                'Input is malformed: need base_lumped_factor')
+        base, lumped, factor = z[0], z[1], float(z[2])
+        for proto_commod in lumped_dict.values():
+            if base not in proto_commod:
+                continue
+            val_dict = dict(proto_commod[base])
+            val_dict['cap'] = val_dict['cap'] * factor
+            proto_commod[lumped] = val_dict
+    return lumped_dict
+
+
+def joint_deploy_solver(commodity_supply, commodity_dict, diffs, time,
+                        time_limit=10.0):
+    """ This function deploys prototypes for all commodities at once,
+    with a mixed-integer program solved by `scipy.optimize.milp'.
+
+    A prototype with a constraint can only be deployed if the supply of
+    its constraint commodity, including the supply deployed in the same
+    program to cover the shortfall of that commodity, reaches the
+    constraint. No commodity is built beyond its own shortfall. The
+    objective is the overbuilt capacity, in units of the smallest
+    prototype of each commodity, plus a small cost per facility.
+    Prototypes below the highest preference of their commodity, ranked
+    by integer part like deploy_solver, cost a thousand times more per
+    rank, so they are only deployed when the preferred ones are
+    constrained.
+    Shortfalls that cannot be met are left as a heavily penalized slack.
+
+    Parameters:
+    ----------
+    commodity_supply: dictionary
+        key: commod
+        value: dictionary
+            key: time
+            value: amount of supply of commod at time
+    commodity_dict: dictionary
+        key: commodity name
+        value: dictionary
+            key: prototype name
+            value: dictionary
+                key: 'cap', 'pref', 'constraint_commod', 'constraint'
+                value
+    diffs: dictionary
+        key: commodity name
+        value: difference between supply and demand, negative if
+               there is a lack in supply
+    time: int
+        time of evaluation
+    time_limit: float
+        time limit of the solver in seconds
+
+    Returns:
+    --------
+    deploy_dicts: dictionary
+        key: commodity name
+        value: dictionary
+            key: prototype name
+            value: number of prototype to deploy
+    """
+    from scipy.optimize import milp, LinearConstraint, Bounds
+    from scipy.sparse import coo_matrix
+
+    shortfall = {commod: max(-diffs.get(commod, 0.0), 0.0)
+                 for commod in commodity_dict}
+
+    # one integer variable per (commodity, prototype)
+    variables = []
+    cost = []
+    upper = []
+    for commod, proto_commod in commodity_dict.items():
+        min_cap = min(val['cap'] for val in proto_commod.values())
+        # preferences are ranked by their integer part, negative ones
+        # all tied, as deploy_solver compares them
+        pref = {proto: max(int(val), -1) for proto, val in
+                evaluate_preference(proto_commod, time).items()}
+        levels = sorted(set(pref.values()), reverse=True)
+        for proto, val_dict in proto_commod.items():
+            rank = levels.index(pref[proto])
+            variables.append((commod, proto))
+            cost.append(val_dict['cap'] / min_cap * (1 + 1e3 * rank) + 1e-3)
+            upper.append(math.ceil(shortfall[commod] / val_dict['cap']))
+    n_x = len(variables)
+    # one binary variable per constrained prototype
+    constrained = [j for j, (commod, proto) in enumerate(variables)
+                   if commodity_dict[commod][proto]['constraint_commod'] != '0']
+    # one slack variable per commodity
+    commods = list(commodity_dict.keys())
+    n_y = len(constrained)
+    n = n_x + n_y + len(commods)
+    c = np.zeros(n)
+    c[:n_x] = cost
+    c[n_x + n_y:] = 1e6
+    lb = np.zeros(n)
+    ub = np.full(n, np.inf)
+    ub[:n_x] = upper
+    ub[n_x:n_x + n_y] = 1
+    integrality = np.zeros(n)
+    integrality[:n_x + n_y] = 1
+
+    rows, cols, vals = [], [], []
+    row_lb, row_ub = [], []
+    index = defaultdict(list)
+    for j, (commod, proto) in enumerate(variables):
+        index[commod].append(j)
+    # meet the shortfall of every commodity, or pay for the slack
+    for i, commod in enumerate(commods):
+        if shortfall[commod] <= 0:
+            continue
+        min_cap = min(val['cap'] for val in commodity_dict[commod].values())
+        for j in index[commod]:
+            rows.append(len(row_lb))
+            cols.append(j)
+            vals.append(commodity_dict[commod][variables[j][1]]['cap'])
+        rows.append(len(row_lb))
+        cols.append(n_x + n_y + i)
+        vals.append(min_cap)
+        row_lb.append(shortfall[commod])
+        row_ub.append(np.inf)
+        # nothing is built beyond covering the shortfall, so that no
+        # facility is deployed only to lift a constraint
+        max_cap = max(val['cap'] for val in commodity_dict[commod].values())
+        for j in index[commod]:
+            rows.append(len(row_lb))
+            cols.append(j)
+            vals.append(commodity_dict[commod][variables[j][1]]['cap'])
+        row_lb.append(-np.inf)
+        row_ub.append(shortfall[commod] + max_cap * (1 - 1e-9))
+    for i, j in enumerate(constrained):
+        commod, proto = variables[j]
+        val_dict = commodity_dict[commod][proto]
+        k = val_dict['constraint_commod']
+        # x_j <= ub_j * y_j
+        rows.extend([len(row_lb), len(row_lb)])
+        cols.extend([j, n_x + i])
+        vals.extend([1.0, -ub[j]])
+        row_lb.append(-np.inf)
+        row_ub.append(0.0)
+        # supply_k + deployed supply of k >= constraint * y_j
+        current = 0.0
+        if k in commodity_supply:
+            current = commodity_supply[k][time]
+        for jk in index.get(k, []):
+            rows.append(len(row_lb))
+            cols.append(jk)
+            vals.append(commodity_dict[k][variables[jk][1]]['cap'])
+        rows.append(len(row_lb))
+        cols.append(n_x + i)
+        vals.append(-float(val_dict['constraint']))
+        row_lb.append(-current)
+        row_ub.append(np.inf)
+
+    constraints = []
+    if len(row_lb) > 0:
+        A = coo_matrix((vals, (rows, cols)), shape=(len(row_lb), n))
+        constraints.append(LinearConstraint(A, row_lb, row_ub))
+    res = milp(c, integrality=integrality, bounds=Bounds(lb, ub),
+               constraints=constraints,
+               options={'time_limit': time_limit})
+    if res.x is None:
+        # no feasible solution within the time limit,
+        # deploy each commodity on its own
+        return {commod: deploy_solver(commodity_supply, commodity_dict,
+                                      commod, -shortfall[commod], time)
+                for commod in commods if shortfall[commod] > 0}
+
+    deploy_dicts = {}
+    for j, (commod, proto) in enumerate(variables):
+        num = int(round(res.x[j]))
+        if num > 0:
+            deploy_dicts.setdefault(commod, {})[proto] = num
+    return deploy_dicts
@@ -11,25 +11,28 @@ import copy
 import math
 from collections import defaultdict
 import numpy as np
-import scipy as sp
 
 from cyclus.agents import Institution, Agent
 from cyclus import lib
 import cyclus.typesystem as ts
 import d3ploy.solver as solver
-import d3ploy.NO_solvers as no
-import d3ploy.DO_solvers as do
-import d3ploy.ML_solvers as ml
+from d3ploy.accumulator import TimeSeriesAccumulator
+from d3ploy.forecasting import ForecastingMixin
+from d3ploy.retirement import RetirementSchedule
+from d3ploy.pipeline import ForecastPipeline
+from d3ploy.shadow import ShadowEvaluator, AutoSelector
 
-CALC_METHODS = {}
 
-
-class SupplyDrivenDeploymentInst(Institution):
+class SupplyDrivenDeploymentInst(ForecastingMixin, Institution):
     """
     This institution deploys facilities based on demand curves using
     time series methods.
     """
 
+    deployed_side = 'capacity'
+    other_side = 'supply'
+    std_dev_var = 'capacity_std_dev'
+
     commodities = ts.VectorString(
         doc="A list of commodities that the institution will manage. " +
             "commodity_prototype_capacity format" +
@@ -44,7 +47,8 @@ class SupplyDrivenDeploymentInst(Institution):
         "the supply and capacity for the commodities of " +
         "this institution. Currently this can be ma for " +
         "moving average, or arma for autoregressive " +
-        "moving average.",
+        "moving average, or auto to choose one of " +
+        "auto_methods for each time series.",
         tooltip="Calculation method used to predict supply/capacity",
         uilabel="Calculation Method"
     )
@@ -108,21 +112,228 @@ class SupplyDrivenDeploymentInst(Institution):
         default=1
     )
 
+    track_retirement = ts.Bool(
+        doc="If True, the institution tracks the entry time and lifetime " +
+            "of the facilities it builds, and combines the known schedule " +
+            "of retiring capacity with the calc_method's capacity prediction. " +
+            "A cheap calc_method (ma, poly) is usually enough in this case.",
+        tooltip="Boolean to indicate whether or not to track retirements.",
+        uilabel="Track Retirements",
+        default=False
+    )
+
+    pipeline = ts.Bool(
+        doc="If True, the forecasts of each timestep are fit in a " +
+            "background thread during tick, from the history up to the " +
+            "previous timestep, while cyclus performs the resource " +
+            "exchange. The decision then only corrects them with the " +
+            "value observed at the current timestep, along the change " +
+            "of each forecast per unit of that value. This is exact for " +
+            "ma and poly, whose forecasts are linear in the values, so " +
+            "only they are pipelined; the other calc methods are fit in " +
+            "the decision. The fits only overlap the exchange if cyclus " +
+            "releases the GIL during it, which is not measured.",
+        tooltip="Boolean to indicate whether or not to fit forecasts in tick.",
+        uilabel="Pipelined Forecasts",
+        default=False
+    )
+
+    deploy_method = ts.String(
+        doc="The method used to choose the facilities to deploy when the " +
+            "preferences of the prototypes are the same. This can be " +
+            "greedy, to deploy the largest prototypes first, exact, to " +
+            "deploy with the least overbuilt capacity and then the least " +
+            "number of facilities, or agent_count, to deploy with the " +
+            "least overbuilt capacity plus agent_weight per facility. " +
+            "If this is joint, all commodities are deployed together " +
+            "by a mixed-integer program that couples " +
+            "the prototypes with constraints to the deployment of their " +
+            "constraint commodity.",
+        tooltip="Deployment method for prototypes with the same preference",
+        uilabel="Deploy Method",
+        default="greedy"
+    )
+
+    deploy_resolution = ts.Double(
+        doc="The capacity resolution of the exact deploy method. If this " +
+            "is set to '0' a tenth of the smallest prototype capacity is " +
+            "used.",
+        tooltip="Capacity resolution of the exact deploy method",
+        uilabel="Deploy Resolution",
+        default=0
+    )
+
+    plan_cache_size = ts.Int(
+        doc="The number of deployment plans kept in a least recently used " +
+            "cache, keyed by commodity, shortfall rounded up to the " +
+            "smallest prototype capacity and preference ranking. If this " +
+            "is set to '0' plans are not cached.",
+        tooltip="Size of the deployment plan cache",
+        uilabel="Plan Cache Size",
+        default=0
+    )
+
+    agent_weight = ts.Double(
+        doc="The capacity-equivalent cost of each facility deployed by the " +
+            "agent_count deploy method. A facility is worth saving if it " +
+            "overbuilds less than agent_weight.",
+        tooltip="Cost of each facility deployed by the agent_count method",
+        uilabel="Agent Weight",
+        default=0
+    )
+
+    lumped_prototypes = ts.VectorString(
+        doc="A list of lumped variants of the prototypes, used by the " +
+            "agent_count deploy method. base_lumped_factor format, where " +
+            "lumped is the prototype equivalent to factor facilities of " +
+            "prototype base.",
+        tooltip="List of lumped prototypes",
+        uilabel="Lumped Prototypes",
+        default=[]
+    )
+
+    joint_time_limit = ts.Double(
+        doc="The time limit, in seconds, of the mixed-integer program " +
+            "solved each timestep by the joint deploy method.",
+        tooltip="Time limit of the joint deploy method",
+        uilabel="Joint Time Limit",
+        default=10
+    )
+
+    forecast_refit = ts.Int(
+        doc="The number of timesteps the forecast path of a calc method " +
+            "is reused before it is fit again. In between, the fit model " +
+            "is run on from the values observed since the fit. The ma " +
+            "and poly methods are always fit. If this is set to '0' the " +
+            "calc method is fit every timestep.",
+        tooltip="Number of timesteps a forecast path is reused",
+        uilabel="Forecast Refit Interval",
+        default=0
+    )
+
+    mc_paths = ts.Int(
+        doc="The number of Monte Carlo paths of the capacity and supply of " +
+            "each commodity drawn every timestep by bootstrapping the " +
+            "residuals of the last mc_window forecasts of the calc " +
+            "method, or of an AR(1) fit of their last back_steps values " +
+            "until three residuals are observed. The institution then " +
+            "deploys against the mc_quantile of the shortfall instead " +
+            "of its predicted value, and capacity_std_dev is not used. If this " +
+            "is set to '0' no paths are drawn.",
+        tooltip="Number of Monte Carlo forecast paths",
+        uilabel="Monte Carlo Paths",
+        default=0
+    )
+
+    mc_quantile = ts.Double(
+        doc="The quantile of the Monte Carlo shortfall that the " +
+            "institution deploys against, if mc_paths is set.",
+        tooltip="Quantile of the Monte Carlo shortfall to deploy against",
+        uilabel="Monte Carlo Quantile",
+        default=0.95
+    )
+
+    mc_window = ts.Int(
+        doc="The number of recent forecast residuals of the capacity and " +
+            "supply of each commodity the Monte Carlo paths are drawn " +
+            "from, if mc_paths is set.",
+        tooltip="Number of residuals the Monte Carlo paths are drawn from",
+        uilabel="Monte Carlo Window",
+        default=100
+    )
+
+    residual_window = ts.Int(
+        doc="The number of recent residuals of the predicted capacity and " +
+            "supply of each commodity kept in a sliding window, leaving " +
+            "out the capacity deployed after each prediction. The " +
+            "(1 - residual_quantile) quantile of the capacity residuals less " +
+            "the residual_quantile quantile of the supply residuals is " +
+            "added to the predicted difference as a safety margin. If " +
+            "this is set to '0' no margin is applied.",
+        tooltip="Number of forecast residuals in the safety margin window",
+        uilabel="Residual Window",
+        default=0
+    )
+
+    residual_quantile = ts.Double(
+        doc="The quantile of the forecast residuals covered by the " +
+            "safety margin, if residual_window is set.",
+        tooltip="Quantile of the forecast residuals covered by the margin",
+        uilabel="Residual Quantile",
+        default=0.95
+    )
+
+    shadow_methods = ts.VectorString(
+        doc="A list of calc methods run in shadow mode next to calc_method " +
+            "on the capacity and supply of every commodity. Their " +
+            "forecasts never influence deployment, but their forecast " +
+            "errors and CPU time per commodity are measured, and written " +
+            "to the text output if record is set.",
+        tooltip="List of calc methods to evaluate in shadow mode",
+        uilabel="Shadow Methods",
+        default=[]
+    )
+
+    auto_methods = ts.VectorString(
+        doc="The calc methods the auto calc_method chooses from. For " +
+            "each time series, auto backtests them over the last " +
+            "auto_interval timesteps and uses the one of the lowest " +
+            "cost rank among those whose mean absolute error is within " +
+            "auto_tolerance of the best one. The cost ranks are fixed " +
+            "per method in calc_methods, not measured at run time, so " +
+            "the choice does not depend on timing; the list order " +
+            "breaks ties between methods of the same rank. The first " +
+            "listed is used until a choice can be made.",
+        tooltip="List of calc methods the auto calc method chooses from",
+        uilabel="Auto Methods",
+        default=['ma', 'kalman', 'poly', 'arma']
+    )
+
+    auto_tolerance = ts.Double(
+        doc="The error of a calc method chosen by auto, relative to the " +
+            "error of the most accurate one, that is accepted for a " +
+            "method of lower cost rank.",
+        tooltip="Relative error tolerance of the auto calc method",
+        uilabel="Auto Tolerance",
+        default=0.1
+    )
+
+    auto_interval = ts.Int(
+        doc="The number of timesteps between the choices of the auto " +
+            "calc method, and the number of timesteps it backtests.",
+        tooltip="Number of timesteps between choices of the auto method",
+        uilabel="Auto Interval",
+        default=20
+    )
+
+    auto_history = ts.Int(
+        doc="The number of values before each value of the backtests " +
+            "of the auto calc method that it is predicted from.",
+        tooltip="Number of values each backtest prediction is made from",
+        uilabel="Auto History",
+        default=100
+    )
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.commodity_capacity = {}
         self.commodity_supply = {}
         self.rev_commodity_capacity = {}
         self.rev_commodity_supply = {}
+        self.commodity_retirement = {}
+        self.fleet = {}
+        self.forecast_pipeline = ForecastPipeline()
+        self.fit_failures = {}
+        self.forecast_states = {}
+        self.prototype_tables = {}
+        self.plan_cache = None
+        self.mc_rng = np.random.RandomState(0)
+        self.residual_margins = {}
+        self.mc_margins = {}
+        self.batched = {}
+        self.shadow = None
+        self.auto = None
         self.fresh = True
-        CALC_METHODS['ma'] = no.predict_ma
-        CALC_METHODS['arma'] = no.predict_arma
-        CALC_METHODS['arch'] = no.predict_arch
-        CALC_METHODS['poly'] = do.polyfit_regression
-        CALC_METHODS['exp_smoothing'] = do.exp_smoothing
-        CALC_METHODS['holt_winters'] = do.holt_winters
-        CALC_METHODS['fft'] = do.fft
-        CALC_METHODS['sw_seasonal'] = ml.stepwise_seasonal
 
     def print_variables(self):
         print('commodities: %s' % self.commodity_dict)
@@ -170,15 +381,40 @@ class SupplyDrivenDeploymentInst(Institution):
         if self.fresh:
             # convert list of strings to dictionary
             self.commodity_dict = self.parse_commodities(self.commodities)
+            self.deploy_commodity_dict = self.commodity_dict
+            if self.deploy_method == 'agent_count':
+                self.deploy_commodity_dict = solver.lump_prototypes(
+                    self.commodity_dict, self.lumped_prototypes)
             for commod in self.commodity_dict:
                 # swap supply and demand for supply_inst
                 # change demand into capacity
-                lib.TIME_SERIES_LISTENERS["supply" +
-                                          commod].append(self.extract_supply)
-                lib.TIME_SERIES_LISTENERS["demand" +
-                                          commod].append(self.extract_capacity)
-                self.commodity_capacity[commod] = defaultdict(float)
-                self.commodity_supply[commod] = defaultdict(float)
+                # each listener is bound to its commodity's accumulator
+                self.commodity_capacity[commod] = TimeSeriesAccumulator()
+                self.commodity_supply[commod] = TimeSeriesAccumulator()
+                lib.TIME_SERIES_LISTENERS["supply" + commod].append(
+                    self.commodity_supply[commod].listener)
+                lib.TIME_SERIES_LISTENERS["demand" + commod].append(
+                    self.commodity_capacity[commod].listener)
+            for commod, proto_dict in self.deploy_commodity_dict.items():
+                self.commodity_retirement[commod] = RetirementSchedule()
+                self.prototype_tables[commod] = solver.PrototypeTable(
+                    proto_dict, horizon=self.context.time +
+                    solver.PREFERENCE_HORIZON)
+            if self.plan_cache_size > 0:
+                self.plan_cache = solver.PlanCache(self.plan_cache_size)
+            if self.calc_method == 'auto':
+                self.auto = AutoSelector(self.auto_methods,
+                                         tolerance=self.auto_tolerance,
+                                         interval=self.auto_interval,
+                                         window=self.auto_interval,
+                                         history=self.auto_history,
+                                         steps=self.steps,
+                                         back_steps=self.back_steps,
+                                         degree=self.degree)
+            if len(self.shadow_methods) > 0:
+                self.shadow = ShadowEvaluator(self.shadow_methods)
+            for entry in self.fleet.values():
+                self.schedule_retirement(*entry)
             self.fresh = False
 
     def decision(self):
@@ -187,27 +423,58 @@ class SupplyDrivenDeploymentInst(Institution):
         in supply and capacity and makes the the decision to deploy facilities or not.
         """
         time = self.context.time
+        diffs = {}
+        deployed = []
+        self.batch_forecasts(time)
         for commod, proto_dict in self.commodity_dict.items():
 
             diff, capacity, supply = self.calc_diff(commod, time)
             lib.record_time_series('calc_supply'+commod, self, supply)
             lib.record_time_series('calc_capacity'+commod, self, capacity)
 
-            if diff < 0:
+            diffs[commod] = diff
+            if diff < 0 and self.deploy_method != 'joint':
                 deploy_dict = solver.deploy_solver(
-                    self.commodity_supply, self.commodity_dict, commod, diff, time)
+                    self.commodity_supply, self.deploy_commodity_dict, commod,
+                    diff, time,
+                    method=self.deploy_method,
+                    resolution=self.deploy_resolution,
+                    table=self.prototype_tables[commod],
+                    cache=self.plan_cache,
+                    agent_weight=self.agent_weight)
                 for proto, num in deploy_dict.items():
                     for i in range(num):
                         self.context.schedule_build(self, proto)
+                deployed.append(deploy_dict)
+            if self.shadow is not None:
+                self.shadow_forecasts(commod, time)
             if self.record:
                 out_text = "Time " + str(time) + \
                     " Deployed " + str(len(self.children))
                 out_text += " capacity " + \
                     str(self.commodity_capacity[commod][time])
                 out_text += " supply " + \
-                    str(self.commodity_supply[commod][time]) + "\n"
+                    str(self.commodity_supply[commod][time])
+                if self.plan_cache is not None:
+                    stats = self.plan_cache.stats()
+                    out_text += " plan_cache_hits " + str(stats['hits'])
+                    out_text += " plan_cache_misses " + str(stats['misses'])
+                if self.shadow is not None:
+                    out_text += self.shadow.summary(commod)
+                out_text += "\n"
                 with open(commod + ".txt", 'a') as f:
                     f.write(out_text)
+        if self.deploy_method == 'joint' and \
+                any(diff < 0 for diff in diffs.values()):
+            deploy_dicts = solver.joint_deploy_solver(
+                self.commodity_supply, self.commodity_dict, diffs, time,
+                time_limit=self.joint_time_limit)
+            for commod, deploy_dict in deploy_dicts.items():
+                for proto, num in deploy_dict.items():
+                    for i in range(num):
+                        self.context.schedule_build(self, proto)
+                deployed.append(deploy_dict)
+        self.residual_deploy(deployed)
 
     def calc_diff(self, commod, time):
         """
@@ -230,79 +497,17 @@ class SupplyDrivenDeploymentInst(Institution):
             self.commodity_supply[commod][time] = 0
         if time not in self.commodity_capacity[commod]:
             self.commodity_capacity[commod][time] = 0.0
-        capacity = self.predict_capacity(commod)
+        capacity = self.predict_capacity(commod, time)
         supply = self.predict_supply(commod, time)
         diff = capacity - supply
+        if self.residual_window > 0:
+            diff += self.residual_margin(commod, time, capacity, supply)
+        if self.mc_paths > 0:
+            diff += self.mc_margin(commod, time, capacity, supply)
         return diff, capacity, supply
 
-    def predict_capacity(self, commod):
-        if self.calc_method in ['arma', 'ma', 'arch']:
-            capacity = CALC_METHODS[self.calc_method](self.commodity_capacity[commod],
-                                                      steps=self.steps,
-                                                      std_dev=self.capacity_std_dev,
-                                                      back_steps=self.back_steps)
-        elif self.calc_method in ['poly', 'exp_smoothing', 'holt_winters', 'fft']:
-            capacity = CALC_METHODS[self.calc_method](self.commodity_capacity[commod],
-                                                      back_steps=self.back_steps,
-                                                      degree=self.degree)
-        elif self.calc_method in ['sw_seasonal']:
-            capacity = CALC_METHODS[self.calc_method](self.commodity_capacity[commod],
-                                                      period=self.degree)
-        else:
-            raise ValueError(
-                'The input calc_method is not valid. Check again.')
-        return capacity
+    def predict_capacity(self, commod, time):
+        return self.predict_side('capacity', commod, time)
 
     def predict_supply(self, commod, time):
-        if self.calc_method in ['arma', 'ma', 'arch']:
-            supply = CALC_METHODS[self.calc_method](self.commodity_supply[commod],
-                                                    steps=self.steps,
-                                                    std_dev=self.capacity_std_dev,
-                                                    back_steps=self.back_steps)
-        elif self.calc_method in ['poly', 'exp_smoothing', 'holt_winters', 'fft']:
-            supply = CALC_METHODS[self.calc_method](self.commodity_supply[commod],
-                                                    back_steps=self.back_steps,
-                                                    degree=self.degree)
-        elif self.calc_method in ['sw_seasonal']:
-            supply = CALC_METHODS[self.calc_method](self.commodity_supply[commod],
-                                                    period=self.degree)
-        else:
-            raise ValueError(
-                'The input calc_method is not valid. Check again.')
-        return supply
-
-    def extract_capacity(self, agent, time, value, commod):
-        """
-        Gather information on the available capacity of a commodity over the
-        lifetime of the simulation.
-        Parameters
-        ----------
-        agent : cyclus agent
-            This is the agent that is making the call to the listener.
-        time : int
-            Timestep that the call is made.
-        value : object
-            This is the value of the object being recorded in the time
-            series.
-        """
-        commod = commod[6:]
-        self.commodity_capacity[commod][time] += value
-        # update commodities
-        # self.commodity_dict[commod] = {agent.prototype: value}
-
-    def extract_supply(self, agent, time, value, commod):
-        """
-        Gather information on the capacity of a commodity over the
-        lifetime of the simulation.
-        Parameters
-        ----------
-        agent : cyclus agent
-            This is the agent that is making the call to the listener.
-        time : int
-            Timestep that the call is made.
-        value : object
-            This is the value of the object being recorded in the time
-            series.
-        """
-        commod = commod[6:]
-        self.commodity_supply[commod][time] += value
+        return self.predict_side('supply', commod, time)
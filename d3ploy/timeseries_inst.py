@@ -10,25 +10,29 @@ import copy
 import math
 from collections import defaultdict
 import numpy as np
-import scipy as sp
 
 from cyclus.agents import Institution, Agent
 from cyclus import lib
 import cyclus.typesystem as ts
 import d3ploy.solver as solver
-import d3ploy.NO_solvers as no
-import d3ploy.DO_solvers as do
-import d3ploy.ML_solvers as ml
+from d3ploy.accumulator import TimeSeriesAccumulator
+from d3ploy.forecasting import ForecastingMixin
+from d3ploy.retirement import RetirementSchedule
+from d3ploy.pipeline import ForecastPipeline
+from d3ploy.shadow import ShadowEvaluator, AutoSelector
+from d3ploy.planner import plan_deployment
 
-CALC_METHODS = {}
 
-
-class TimeSeriesInst(Institution):
+class TimeSeriesInst(ForecastingMixin, Institution):
     """
     This institution deploys facilities based on demand curves using
     time series methods.
     """
 
+    deployed_side = 'supply'
+    other_side = 'demand'
+    std_dev_var = 'supply_std_dev'
+
     commodities = ts.VectorString(
         doc="A list of commodities that the institution will manage. " +
             "commodity_prototype_capacity format" +
@@ -47,7 +51,8 @@ class TimeSeriesInst(Institution):
     calc_method = ts.String(
         doc="This is the calculated method used to determine the supply and demand " +
         "for the commodities of this institution. Currently this can be ma for " +
-        "moving average, or arma for autoregressive moving average.",
+        "moving average, or arma for autoregressive moving average, or auto " +
+        "to choose one of auto_methods for each time series.",
         tooltip="Calculation method used to predict supply/demand",
         uilabel="Calculation Method"
     )
@@ -116,21 +121,262 @@ class TimeSeriesInst(Institution):
         default=1
     )
 
+    track_retirement = ts.Bool(
+        doc="If True, the institution tracks the entry time and lifetime " +
+            "of the facilities it builds, and combines the known schedule " +
+            "of retiring supply with the calc_method's supply prediction. " +
+            "A cheap calc_method (ma, poly) is usually enough in this case.",
+        tooltip="Boolean to indicate whether or not to track retirements.",
+        uilabel="Track Retirements",
+        default=False
+    )
+
+    pipeline = ts.Bool(
+        doc="If True, the forecasts of each timestep are fit in a " +
+            "background thread during tick, from the history up to the " +
+            "previous timestep, while cyclus performs the resource " +
+            "exchange. The decision then only corrects them with the " +
+            "value observed at the current timestep, along the change " +
+            "of each forecast per unit of that value. This is exact for " +
+            "ma and poly, whose forecasts are linear in the values, so " +
+            "only they are pipelined; the other calc methods are fit in " +
+            "the decision. The fits only overlap the exchange if cyclus " +
+            "releases the GIL during it, which is not measured.",
+        tooltip="Boolean to indicate whether or not to fit forecasts in tick.",
+        uilabel="Pipelined Forecasts",
+        default=False
+    )
+
+    deploy_method = ts.String(
+        doc="The method used to choose the facilities to deploy when the " +
+            "preferences of the prototypes are the same. This can be " +
+            "greedy, to deploy the largest prototypes first, exact, to " +
+            "deploy with the least overbuilt capacity and then the least " +
+            "number of facilities, or agent_count, to deploy with the " +
+            "least overbuilt capacity plus agent_weight per facility. " +
+            "If this is joint, all commodities are deployed together " +
+            "by a mixed-integer program that couples " +
+            "the prototypes with constraints to the deployment of their " +
+            "constraint commodity.",
+        tooltip="Deployment method for prototypes with the same preference",
+        uilabel="Deploy Method",
+        default="greedy"
+    )
+
+    deploy_resolution = ts.Double(
+        doc="The capacity resolution of the exact deploy method. If this " +
+            "is set to '0' a tenth of the smallest prototype capacity is " +
+            "used.",
+        tooltip="Capacity resolution of the exact deploy method",
+        uilabel="Deploy Resolution",
+        default=0
+    )
+
+    plan_cache_size = ts.Int(
+        doc="The number of deployment plans kept in a least recently used " +
+            "cache, keyed by commodity, shortfall rounded up to the " +
+            "smallest prototype capacity and preference ranking. If this " +
+            "is set to '0' plans are not cached.",
+        tooltip="Size of the deployment plan cache",
+        uilabel="Plan Cache Size",
+        default=0
+    )
+
+    agent_weight = ts.Double(
+        doc="The capacity-equivalent cost of each facility deployed by the " +
+            "agent_count deploy method. A facility is worth saving if it " +
+            "overbuilds less than agent_weight.",
+        tooltip="Cost of each facility deployed by the agent_count method",
+        uilabel="Agent Weight",
+        default=0
+    )
+
+    lumped_prototypes = ts.VectorString(
+        doc="A list of lumped variants of the prototypes, used by the " +
+            "agent_count deploy method. base_lumped_factor format, where " +
+            "lumped is the prototype equivalent to factor facilities of " +
+            "prototype base.",
+        tooltip="List of lumped prototypes",
+        uilabel="Lumped Prototypes",
+        default=[]
+    )
+
+    joint_time_limit = ts.Double(
+        doc="The time limit, in seconds, of the mixed-integer program " +
+            "solved each timestep by the joint deploy method.",
+        tooltip="Time limit of the joint deploy method",
+        uilabel="Joint Time Limit",
+        default=10
+    )
+
+    plan_horizon = ts.Int(
+        doc="The number of timesteps over which the deployment of the " +
+            "driving commodity is planned at once from the demand " +
+            "equation and the known retirements. The planned builds are " +
+            "queued, and the plan is only made again when the observed " +
+            "supply departs from it or it runs out. If this is set to " +
+            "'0' the driving commodity is forecast every timestep. " +
+            "Not used by the joint deploy method.",
+        tooltip="Planning horizon of the driving commodity",
+        uilabel="Plan Horizon",
+        default=0
+    )
+
+    plan_tolerance = ts.Double(
+        doc="The departure of the observed supply of the driving " +
+            "commodity from the planned supply, relative to the planned " +
+            "supply, above which the deployment is planned again.",
+        tooltip="Relative supply departure that triggers a new plan",
+        uilabel="Plan Tolerance",
+        default=0.01
+    )
+
+    forecast_refit = ts.Int(
+        doc="The number of timesteps the forecast path of a calc method " +
+            "is reused before it is fit again. In between, the fit model " +
+            "is run on from the values observed since the fit. The ma " +
+            "and poly methods are always fit. If this is set to '0' the " +
+            "calc method is fit every timestep.",
+        tooltip="Number of timesteps a forecast path is reused",
+        uilabel="Forecast Refit Interval",
+        default=0
+    )
+
+    mc_paths = ts.Int(
+        doc="The number of Monte Carlo paths of the supply and demand of " +
+            "each commodity drawn every timestep by bootstrapping the " +
+            "residuals of the last mc_window forecasts of the calc " +
+            "method, or of an AR(1) fit of their last back_steps values " +
+            "until three residuals are observed. The institution then " +
+            "deploys against the mc_quantile of the shortfall instead " +
+            "of its predicted value, and supply_std_dev is not used. If this " +
+            "is set to '0' no paths are drawn.",
+        tooltip="Number of Monte Carlo forecast paths",
+        uilabel="Monte Carlo Paths",
+        default=0
+    )
+
+    mc_quantile = ts.Double(
+        doc="The quantile of the Monte Carlo shortfall that the " +
+            "institution deploys against, if mc_paths is set.",
+        tooltip="Quantile of the Monte Carlo shortfall to deploy against",
+        uilabel="Monte Carlo Quantile",
+        default=0.95
+    )
+
+    mc_window = ts.Int(
+        doc="The number of recent forecast residuals of the supply and " +
+            "demand of each commodity the Monte Carlo paths are drawn " +
+            "from, if mc_paths is set.",
+        tooltip="Number of residuals the Monte Carlo paths are drawn from",
+        uilabel="Monte Carlo Window",
+        default=100
+    )
+
+    residual_window = ts.Int(
+        doc="The number of recent residuals of the predicted supply and " +
+            "demand of each commodity kept in a sliding window, leaving " +
+            "out the capacity deployed after each prediction. The " +
+            "(1 - residual_quantile) quantile of the supply residuals less " +
+            "the residual_quantile quantile of the demand residuals is " +
+            "added to the predicted difference as a safety margin. If " +
+            "this is set to '0' no margin is applied.",
+        tooltip="Number of forecast residuals in the safety margin window",
+        uilabel="Residual Window",
+        default=0
+    )
+
+    residual_quantile = ts.Double(
+        doc="The quantile of the forecast residuals covered by the " +
+            "safety margin, if residual_window is set.",
+        tooltip="Quantile of the forecast residuals covered by the margin",
+        uilabel="Residual Quantile",
+        default=0.95
+    )
+
+    shadow_methods = ts.VectorString(
+        doc="A list of calc methods run in shadow mode next to calc_method " +
+            "on the supply and demand of every commodity. Their forecasts never " +
+            "influence deployment, but their forecast errors and CPU time " +
+            "per commodity are measured, and written to the text output " +
+            "if record is set.",
+        tooltip="List of calc methods to evaluate in shadow mode",
+        uilabel="Shadow Methods",
+        default=[]
+    )
+
+    auto_methods = ts.VectorString(
+        doc="The calc methods the auto calc_method chooses from. For " +
+            "each time series, auto backtests them over the last " +
+            "auto_interval timesteps and uses the one of the lowest " +
+            "cost rank among those whose mean absolute error is within " +
+            "auto_tolerance of the best one. The cost ranks are fixed " +
+            "per method in calc_methods, not measured at run time, so " +
+            "the choice does not depend on timing; the list order " +
+            "breaks ties between methods of the same rank. The first " +
+            "listed is used until a choice can be made.",
+        tooltip="List of calc methods the auto calc method chooses from",
+        uilabel="Auto Methods",
+        default=['ma', 'kalman', 'poly', 'arma']
+    )
+
+    auto_tolerance = ts.Double(
+        doc="The error of a calc method chosen by auto, relative to the " +
+            "error of the most accurate one, that is accepted for a " +
+            "method of lower cost rank.",
+        tooltip="Relative error tolerance of the auto calc method",
+        uilabel="Auto Tolerance",
+        default=0.1
+    )
+
+    auto_interval = ts.Int(
+        doc="The number of timesteps between the choices of the auto " +
+            "calc method, and the number of timesteps it backtests.",
+        tooltip="Number of timesteps between choices of the auto method",
+        uilabel="Auto Interval",
+        default=20
+    )
+
+    auto_history = ts.Int(
+        doc="The number of values before each value of the backtests " +
+            "of the auto calc method that it is predicted from.",
+        tooltip="Number of values each backtest prediction is made from",
+        uilabel="Auto History",
+        default=100
+    )
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.commodity_supply = {}
         self.commodity_demand = {}
         self.rev_commodity_supply = {}
         self.rev_commodity_demand = {}
+        self.commodity_retirement = {}
+        self.fleet = {}
+        self.forecast_pipeline = ForecastPipeline()
+        self.fit_failures = {}
+        self.forecast_states = {}
+        self.prototype_tables = {}
+        self.plan_cache = None
+        self.mc_rng = np.random.RandomState(0)
+        self.residual_margins = {}
+        self.mc_margins = {}
+        self.batched = {}
+        self.shadow = None
+        self.auto = None
+        self.plans = {}
         self.fresh = True
-        CALC_METHODS['ma'] = no.predict_ma
-        CALC_METHODS['arma'] = no.predict_arma
-        CALC_METHODS['arch'] = no.predict_arch
-        CALC_METHODS['poly'] = do.polyfit_regression
-        CALC_METHODS['exp_smoothing'] = do.exp_smoothing
-        CALC_METHODS['holt_winters'] = do.holt_winters
-        CALC_METHODS['fft'] = do.fft
-        CALC_METHODS['sw_seasonal'] = ml.stepwise_seasonal
+
+    def forecasts_other(self, commod):
+        """ Returns if the demand of [commod] is forecast, rather than
+            given by demand_eq. """
+        return commod != self.driving_commod
+
+    def planned(self, commod):
+        """ Returns if the deployment of [commod] follows the plan of
+            follow_plan. """
+        return commod == self.driving_commod and self.plan_horizon > 0 and \
+            self.deploy_method != 'joint'
 
     def print_variables(self):
         print('commodities: %s' % self.commodity_dict)
@@ -178,6 +424,10 @@ class TimeSeriesInst(Institution):
         if self.fresh:
             # convert list of strings to dictionary
             self.commodity_dict = self.parse_commodities(self.commodities)
+            self.deploy_commodity_dict = self.commodity_dict
+            if self.deploy_method == 'agent_count':
+                self.deploy_commodity_dict = solver.lump_prototypes(
+                    self.commodity_dict, self.lumped_prototypes)
             commod_list = list(self.commodity_dict.keys())
             for key, val in self.commodity_dict.items():
                 for key2, val2 in val.items():
@@ -185,12 +435,33 @@ class TimeSeriesInst(Institution):
                         commod_list.append(val2['constraint_commod'])
             commod_list = list(set(commod_list))
             for commod in commod_list:
-                lib.TIME_SERIES_LISTENERS["supply" +
-                                          commod].append(self.extract_supply)
-                lib.TIME_SERIES_LISTENERS["demand" +
-                                          commod].append(self.extract_demand)
-                self.commodity_supply[commod] = defaultdict(float)
-                self.commodity_demand[commod] = defaultdict(float)
+                # each listener is bound to its commodity's accumulator
+                self.commodity_supply[commod] = TimeSeriesAccumulator()
+                self.commodity_demand[commod] = TimeSeriesAccumulator()
+                lib.TIME_SERIES_LISTENERS["supply" + commod].append(
+                    self.commodity_supply[commod].listener)
+                lib.TIME_SERIES_LISTENERS["demand" + commod].append(
+                    self.commodity_demand[commod].listener)
+            for commod, proto_dict in self.deploy_commodity_dict.items():
+                self.commodity_retirement[commod] = RetirementSchedule()
+                self.prototype_tables[commod] = solver.PrototypeTable(
+                    proto_dict, horizon=self.context.time +
+                    solver.PREFERENCE_HORIZON)
+            if self.plan_cache_size > 0:
+                self.plan_cache = solver.PlanCache(self.plan_cache_size)
+            if self.calc_method == 'auto':
+                self.auto = AutoSelector(self.auto_methods,
+                                         tolerance=self.auto_tolerance,
+                                         interval=self.auto_interval,
+                                         window=self.auto_interval,
+                                         history=self.auto_history,
+                                         steps=self.steps,
+                                         back_steps=self.back_steps,
+                                         degree=self.degree)
+            if len(self.shadow_methods) > 0:
+                self.shadow = ShadowEvaluator(self.shadow_methods)
+            for entry in self.fleet.values():
+                self.schedule_retirement(*entry)
             self.fresh = False
 
     def decision(self):
@@ -199,27 +470,109 @@ class TimeSeriesInst(Institution):
         in supply and demand and makes the the decision to deploy facilities or not.
         """
         time = self.context.time
+        diffs = {}
+        deployed = []
+        self.batch_forecasts(time)
         for commod, proto_dict in self.commodity_dict.items():
 
-            diff, supply, demand = self.calc_diff(commod, time)
+            planned = self.planned(commod)
+            if planned:
+                deploy_dict, supply, demand = self.follow_plan(commod, time)
+                diff = supply - demand
+            else:
+                diff, supply, demand = self.calc_diff(commod, time)
             lib.record_time_series('calc_supply'+commod, self, supply)
             lib.record_time_series('calc_demand'+commod, self, demand)
 
-            if diff < 0:
+            diffs[commod] = diff
+            if not planned and diff < 0 and self.deploy_method != 'joint':
                 deploy_dict = solver.deploy_solver(
-                    self.commodity_supply, self.commodity_dict, commod, diff, time)
-                for proto, num in deploy_dict.items():
-                    for i in range(num):
-                        self.context.schedule_build(self, proto)
+                    self.commodity_supply, self.deploy_commodity_dict, commod,
+                    diff, time,
+                    method=self.deploy_method,
+                    resolution=self.deploy_resolution,
+                    table=self.prototype_tables[commod],
+                    cache=self.plan_cache,
+                    agent_weight=self.agent_weight)
+            elif not planned:
+                deploy_dict = {}
+            for proto, num in deploy_dict.items():
+                for i in range(num):
+                    self.context.schedule_build(self, proto)
+            deployed.append(deploy_dict)
+            if self.shadow is not None:
+                self.shadow_forecasts(commod, time)
             if self.record:
                 out_text = "Time " + str(time) + \
                     " Deployed " + str(len(self.children))
                 out_text += " supply " + \
                     str(self.commodity_supply[commod][time])
                 out_text += " demand " + \
-                    str(self.commodity_demand[commod][time]) + "\n"
+                    str(self.commodity_demand[commod][time])
+                if self.plan_cache is not None:
+                    stats = self.plan_cache.stats()
+                    out_text += " plan_cache_hits " + str(stats['hits'])
+                    out_text += " plan_cache_misses " + str(stats['misses'])
+                if self.shadow is not None:
+                    out_text += self.shadow.summary(commod)
+                out_text += "\n"
                 with open(commod + ".txt", 'a') as f:
                     f.write(out_text)
+        if self.deploy_method == 'joint' and \
+                any(diff < 0 for diff in diffs.values()):
+            deploy_dicts = solver.joint_deploy_solver(
+                self.commodity_supply, self.commodity_dict, diffs, time,
+                time_limit=self.joint_time_limit)
+            for commod, deploy_dict in deploy_dicts.items():
+                for proto, num in deploy_dict.items():
+                    for i in range(num):
+                        self.context.schedule_build(self, proto)
+                deployed.append(deploy_dict)
+        self.residual_deploy(deployed)
+
+    def follow_plan(self, commod, time):
+        """
+        Returns the builds of [time] from the deployment plan of [commod],
+        planning the deployment of the next plan_horizon timesteps first
+        if there is no plan yet, the plan has run out or the supply
+        observed at [time] departs from it.
+        Parameters
+        ----------
+        time : int
+            This is the current timestep.
+        Returns
+        -------
+        deploy_dict : dict
+            Number of facilities of each prototype to build at [time].
+        supply : double
+            The planned supply of the commodity at [time] + 1.
+        demand : double
+            The demand of the commodity at [time] + 1.
+        """
+        if time not in self.commodity_demand[commod]:
+            t = 0
+            self.commodity_demand[commod][time] = eval(self.demand_eq)
+        if time not in self.commodity_supply[commod]:
+            self.commodity_supply[commod][time] = 0.0
+        plan = self.plans.get(commod)
+        if plan is None or plan.deviates(time,
+                                         self.commodity_supply[commod][time],
+                                         self.plan_tolerance):
+            times = np.arange(time + 1, time + 1 + self.plan_horizon)
+            demand = solver.evaluate_preference_eq(self.demand_eq, times)
+            plan = plan_deployment(self.commodity_supply,
+                                   self.deploy_commodity_dict, commod, demand,
+                                   time,
+                                   schedule=self.commodity_retirement[commod],
+                                   method=self.deploy_method,
+                                   resolution=self.deploy_resolution,
+                                   table=self.prototype_tables[commod],
+                                   cache=self.plan_cache,
+                                   agent_weight=self.agent_weight)
+            self.plans[commod] = plan
+        demand = self.demand_calc(time + 1)
+        self.commodity_demand[commod][time + 1] = demand
+        return plan.pop(time), plan.expected_supply(time + 1), demand
 
     def calc_diff(self, commod, time):
         """
@@ -242,86 +595,24 @@ class TimeSeriesInst(Institution):
             self.commodity_demand[commod][time] = eval(self.demand_eq)
         if time not in self.commodity_supply[commod]:
             self.commodity_supply[commod][time] = 0.0
-        supply = self.predict_supply(commod)
+        supply = self.predict_supply(commod, time)
         demand = self.predict_demand(commod, time)
         diff = supply - demand
+        if self.residual_window > 0:
+            diff += self.residual_margin(commod, time, supply, demand)
+        if self.mc_paths > 0:
+            diff += self.mc_margin(commod, time, supply, demand)
         return diff, supply, demand
 
-    def predict_supply(self, commod):
-        if self.calc_method in ['arma', 'ma', 'arch']:
-            supply = CALC_METHODS[self.calc_method](self.commodity_supply[commod],
-                                                    steps=self.steps,
-                                                    std_dev=self.supply_std_dev,
-                                                    back_steps=self.back_steps)
-        elif self.calc_method in ['poly', 'exp_smoothing', 'holt_winters', 'fft']:
-            supply = CALC_METHODS[self.calc_method](self.commodity_supply[commod],
-                                                    back_steps=self.back_steps,
-                                                    degree=self.degree)
-        elif self.calc_method in ['sw_seasonal']:
-            supply = CALC_METHODS[self.calc_method](self.commodity_supply[commod],
-                                                    period=self.degree)
-        else:
-            raise ValueError(
-                'The input calc_method is not valid. Check again.')
-        return supply
+    def predict_supply(self, commod, time):
+        return self.predict_side('supply', commod, time)
 
     def predict_demand(self, commod, time):
         if commod == self.driving_commod:
             demand = self.demand_calc(time+1)
             self.commodity_demand[commod][time+1] = demand
-        else:
-            if self.calc_method in ['arma', 'ma', 'arch']:
-                demand = CALC_METHODS[self.calc_method](self.commodity_demand[commod],
-                                                        steps=self.steps,
-                                                        std_dev=self.supply_std_dev,
-                                                        back_steps=self.back_steps)
-            elif self.calc_method in ['poly', 'exp_smoothing', 'holt_winters', 'fft']:
-                demand = CALC_METHODS[self.calc_method](self.commodity_demand[commod],
-                                                        back_steps=self.back_steps,
-                                                        degree=self.degree)
-            elif self.calc_method in ['sw_seasonal']:
-                demand = CALC_METHODS[self.calc_method](self.commodity_demand[commod],
-                                                        period=self.degree)
-            else:
-                raise ValueError(
-                    'The input calc_method is not valid. Check again.')
-        return demand
-
-    def extract_supply(self, agent, time, value, commod):
-        """
-        Gather information on the available supply of a commodity over the
-        lifetime of the simulation.
-        Parameters
-        ----------
-        agent : cyclus agent
-            This is the agent that is making the call to the listener.
-        time : int
-            Timestep that the call is made.
-        value : object
-            This is the value of the object being recorded in the time
-            series.
-        """
-        commod = commod[6:]
-        self.commodity_supply[commod][time] += value
-        # update commodities
-        # self.commodity_dict[commod] = {agent.prototype: value}
-
-    def extract_demand(self, agent, time, value, commod):
-        """
-        Gather information on the demand of a commodity over the
-        lifetime of the simulation.
-        Parameters
-        ----------
-        agent : cyclus agent
-            This is the agent that is making the call to the listener.
-        time : int
-            Timestep that the call is made.
-        value : object
-            This is the value of the object being recorded in the time
-            series.
-        """
-        commod = commod[6:]
-        self.commodity_demand[commod][time] += value
+            return demand
+        return self.predict_side('demand', commod, time)
 
     def demand_calc(self, time):
         """
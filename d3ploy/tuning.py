@@ -0,0 +1,310 @@
+"""
+This tuning.py file contains the search of the back_steps, degree and
+steps settings of a calc method on historical time series, such as the
+supply and demand recorded in a cyclus output file.
+
+The candidate settings, a grid or a random sample of it, are backtested
+by successive halving: every round evaluates the remaining candidates on
+the next part of the time series and only keeps the most accurate ones,
+so bad candidates are stopped early. Every candidate is scored on the
+value the same number of timesteps ahead, the largest horizon of the
+candidates, so the candidates of different steps are compared on the
+same predictions. The rounds run in a process pool whose workers
+receive the time series once and build the history of the time series
+up to each end index once for all the candidates, so each prediction
+sees every value before it, as in shadow.backtest.
+
+Usage:
+    python -m d3ploy.tuning output.sqlite -m poly --back-steps 5 10 20
+        --degree 1 2 --steps 1 2
+"""
+
+import argparse
+import itertools
+import math
+import random
+import time as timer
+from concurrent.futures import ProcessPoolExecutor
+
+from d3ploy.calc_methods import CALC_METHODS, ForecastState, forecast
+from d3ploy.calc_methods import horizon
+from d3ploy.NO_solvers import FitFailureMemo
+
+_SERIES = {}
+_WINDOWS = {}
+
+# settings each kind of calc method takes, see calc_methods.MethodRegistry
+SETTINGS = {'no': ('back_steps', 'steps'),
+            'do': ('back_steps', 'degree'),
+            'ml': ('degree',)}
+
+
+class History(object):
+    """
+    The first [end] values of a time series of [times] and [values], read
+    like the dictionary of those values. The histories of every end index
+    share the lists of the time series: keys, values and items iterate
+    over the first [end] entries of the lists without slicing them.
+    """
+
+    def __init__(self, times, values, index, end):
+        self.times = times
+        self.data = values
+        self.index = index
+        self.end = end
+
+    def __len__(self):
+        return self.end
+
+    def __contains__(self, time):
+        return self.index.get(time, self.end) < self.end
+
+    def __getitem__(self, time):
+        if time not in self:
+            raise KeyError(time)
+        return self.data[self.index[time]]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __reversed__(self):
+        return (self.times[i] for i in range(self.end - 1, -1, -1))
+
+    def keys(self):
+        return itertools.islice(self.times, self.end)
+
+    def values(self):
+        return itertools.islice(self.data, self.end)
+
+    def items(self):
+        return zip(self.keys(), self.values())
+
+
+def init_worker(series):
+    """ Keeps the time series [series] in the worker process, as lists of
+        times and values. """
+    global _SERIES, _WINDOWS
+    _SERIES = {key: (list(ts.keys()), list(ts.values()))
+               for key, ts in series.items()}
+    _WINDOWS = {}
+
+
+def windows(key):
+    """ Returns, for each index of time series [key], the history of the
+        values before it, computed once per worker and shared by every
+        candidate. """
+    if key not in _WINDOWS:
+        times, values = _SERIES[key]
+        index = {t: i for i, t in enumerate(times)}
+        _WINDOWS[key] = [History(times, values, index, end)
+                         for end in range(len(values) + 1)]
+    return _WINDOWS[key]
+
+
+def evaluate_job(job):
+    """
+    Backtests a candidate on time series [key], predicting from each end
+    index from lo to hi the value [lead] timesteps ahead of it.
+    Returns
+    -------
+    stats : tuple
+        sum of absolute errors, number of predictions and CPU time, or
+        None if the calc method failed
+    """
+    method, key, back_steps, degree, steps, lo, hi, lead = job
+    times, values = _SERIES[key]
+    past = windows(key)
+    memo = FitFailureMemo()
+    state = ForecastState()
+    abs_error = 0.0
+    count = 0
+    cpu = 0.0
+    try:
+        for end in range(lo, hi):
+            if end - 1 + lead >= len(values):
+                break
+            start = timer.process_time()
+            x = forecast(method, past[end], steps=steps, std_dev=0,
+                         back_steps=back_steps, degree=degree, memo=memo,
+                         state=state)
+            cpu += timer.process_time() - start
+            abs_error += abs(values[end - 1 + lead] - float(x))
+            count += 1
+    except Exception:
+        return None
+    return abs_error, count, cpu
+
+
+def candidates(back_steps, degrees, steps, n_random=0, seed=0, method=None):
+    """ Returns the grid of (back_steps, degree, steps) settings, or a
+        random sample of [n_random] of them if given. If calc method
+        [method] is given, the settings it does not take only keep their
+        first value, since every value gives the same forecast. """
+    if method is not None:
+        taken = SETTINGS[CALC_METHODS.kind(method)]
+        if 'back_steps' not in taken:
+            back_steps = back_steps[:1]
+        if 'degree' not in taken:
+            degrees = degrees[:1]
+        if 'steps' not in taken:
+            steps = steps[:1]
+    grid = list(itertools.product(back_steps, degrees, steps))
+    if 0 < n_random < len(grid):
+        grid = random.Random(seed).sample(grid, n_random)
+    return grid
+
+
+def tune(series, method, back_steps=(5, 10, 20), degrees=(1,), steps=(1,),
+         n_random=0, rounds=3, keep=0.5, warmup=10, processes=None, seed=0):
+    """
+    Searches the settings of calc method [method] on time series [series].
+    Parameters
+    ----------
+    series : dictionary
+        key: any, such as the (side, commodity) keys of
+        backtest.load_series
+        value: dictionary of time series
+    back_steps, degrees, steps : lists of int
+        values of the settings searched. The settings [method] does not
+        take, such as the steps of a Deterministic-optimizing method,
+        are only searched at their first value.
+    n_random : int
+        number of candidates sampled from the grid, the whole grid if 0
+    rounds : int
+        number of rounds of successive halving. Each round evaluates the
+        remaining candidates on an equal part of the time series.
+    keep : float
+        fraction of the candidates kept after each round but the last
+    warmup : int
+        number of values of each time series that are never predicted
+    processes : int
+        number of worker processes, one per CPU if not given. The search
+        runs in this process if 1.
+    Returns
+    -------
+    results : list of dictionaries
+        back_steps, degree, steps, error, cpu, count and rounds of each
+        candidate, the ones evaluated longest and most accurate first.
+        The error is the mean absolute error of each time series, relative
+        to its mean absolute value, averaged over the time series; every
+        candidate is scored on the value as many timesteps ahead as the
+        largest horizon of the candidates. The cpu is the mean CPU time
+        of a prediction.
+    """
+    keys = sorted(series)
+    scale = {}
+    for key in keys:
+        values = list(series[key].values())
+        scale[key] = max(sum(abs(v) for v in values) / max(len(values), 1),
+                         1e-12)
+    length = min(len(series[key]) for key in keys)
+    bounds = [int(round(warmup + (length - warmup) * r / float(rounds)))
+              for r in range(rounds + 1)]
+    stats = {c: {'abs_error': dict.fromkeys(keys, 0.0),
+                 'count': dict.fromkeys(keys, 0), 'cpu': 0.0, 'rounds': 0}
+             for c in candidates(back_steps, degrees, steps, n_random, seed,
+                                 method)}
+    alive = list(stats)
+    lead = max(horizon(method, c[2]) for c in alive)
+    if processes == 1:
+        init_worker(series)
+        executor = None
+        run = map
+    else:
+        executor = ProcessPoolExecutor(max_workers=processes,
+                                       initializer=init_worker,
+                                       initargs=(series,))
+        run = executor.map
+    try:
+        for r in range(rounds):
+            jobs = [(method, key, c[0], c[1], c[2], bounds[r], bounds[r + 1],
+                     lead) for c in alive for key in keys]
+            failed = set()
+            for job, result in zip(jobs, run(evaluate_job, jobs)):
+                c = job[2:5]
+                if result is None:
+                    failed.add(c)
+                    continue
+                stats[c]['abs_error'][job[1]] += result[0]
+                stats[c]['count'][job[1]] += result[1]
+                stats[c]['cpu'] += result[2]
+            for c in failed:
+                stats.pop(c)
+            alive = [c for c in alive if c not in failed]
+            for c in alive:
+                stats[c]['rounds'] = r + 1
+            if r < rounds - 1 and len(alive) > 1:
+                alive.sort(key=lambda c: error(stats[c], keys, scale))
+                alive = alive[:max(1, int(math.ceil(len(alive) * keep)))]
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    results = []
+    for c, s in stats.items():
+        count = sum(s['count'].values())
+        results.append({'back_steps': c[0], 'degree': c[1], 'steps': c[2],
+                        'error': error(s, keys, scale),
+                        'cpu': s['cpu'] / max(count, 1), 'count': count,
+                        'rounds': s['rounds']})
+    results.sort(key=lambda x: (-x['rounds'], x['error'], x['cpu']))
+    return results
+
+
+def error(stats, keys, scale):
+    """ Returns the relative mean absolute error of a candidate, averaged
+        over the time series [keys]. """
+    return sum(stats['abs_error'][key] / max(stats['count'][key], 1) /
+               scale[key] for key in keys) / len(keys)
+
+
+def report(results, top=10):
+    """ Returns the [top] first results of tune as a text table. """
+    lines = ['%10s %7s %6s %14s %12s %8s %7s' % (
+        'back_steps', 'degree', 'steps', 'error', 'cpu [us]', 'count',
+        'rounds')]
+    for x in results[:top]:
+        lines.append('%10d %7d %6d %14.6g %12.1f %8d %7d' % (
+            x['back_steps'], x['degree'], x['steps'], x['error'],
+            x['cpu'] * 1e6, x['count'], x['rounds']))
+    return '\n'.join(lines)
+
+
+def main(args=None):
+    from d3ploy.backtest import load_series
+    parser = argparse.ArgumentParser(
+        description='Searches the back_steps, degree and steps of a calc '
+                    'method on the supply and demand recorded in a cyclus '
+                    'output file.')
+    parser.add_argument('file', help='cyclus sqlite output file')
+    parser.add_argument('-m', '--method', default='poly',
+                        help='calc method to tune')
+    parser.add_argument('-c', '--commods', nargs='+', default=None,
+                        help='commodities to tune on, all if not given')
+    parser.add_argument('-s', '--sides', nargs='+',
+                        default=['supply', 'demand'],
+                        help='recorded time series to tune on')
+    parser.add_argument('--simid', default=None,
+                        help='SimId of the simulation to tune on, needed '
+                             'if the file holds several simulations')
+    parser.add_argument('--back-steps', type=int, nargs='+',
+                        default=[5, 10, 20])
+    parser.add_argument('--degree', type=int, nargs='+', default=[1])
+    parser.add_argument('--steps', type=int, nargs='+', default=[1])
+    parser.add_argument('--random', type=int, default=0,
+                        help='number of candidates sampled from the grid')
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--keep', type=float, default=0.5)
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--processes', type=int, default=None)
+    args = parser.parse_args(args)
+    series = load_series(args.file, sides=args.sides, commods=args.commods,
+                         simid=args.simid)
+    results = tune(series, args.method, back_steps=args.back_steps,
+                   degrees=args.degree, steps=args.steps,
+                   n_random=args.random, rounds=args.rounds, keep=args.keep,
+                   warmup=args.warmup, processes=args.processes)
+    print(report(results))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+This python file benchmarks the scaling of the deployment solver.
+
+How to use:
+python [file name] [output json] [repeats]
+
+No cyclus is needed. Random prototype sets of 2 to 10,000 prototypes
+are solved for shortfalls of up to 1e7 times the mean prototype
+capacity, with preferences that are all the same (`tied') or that
+depend on time (`timed'). The times of deploy_solver, preference_deploy
+and minimize_number_of_deployment are written to
+deploy_solver_benchmark.json, so that solver changes can be compared
+from run to run.
+"""
+
+import json
+import sys
+import time
+
+import numpy as np
+
+import d3ploy.solver as solver
+
+proto_counts = [2, 10, 100, 1000, 10000]
+ratios = [1, 10, 1e3, 1e5, 1e7]
+pref_mixes = ['tied', 'timed']
+
+# methods solved in the tied case, with the largest number of prototypes
+# each is run for
+deploy_methods = {'greedy': 10000, 'exact': 100, 'agent_count': 100}
+
+
+def make_commodity(n, pref_mix, seed=0):
+    """ Returns a random commodity of [n] prototypes, in the format of
+        the commodity_dict of the institutions. """
+    rng = np.random.RandomState(seed)
+    proto_commod = {}
+    for i, cap in enumerate(rng.randint(1, 1000, size=n)):
+        if pref_mix == 'tied':
+            pref = '1'
+        else:
+            pref = '%i + %i*t' % (rng.randint(0, 100), rng.randint(-3, 4))
+        proto_commod['proto%i' % i] = {'cap': float(cap),
+                                       'pref': pref,
+                                       'constraint_commod': '0',
+                                       'constraint': 0}
+    return proto_commod
+
+
+def time_call(function, repeats, *args, **kwargs):
+    """ Calls [function] [repeats] times and returns the mean, min and
+        max time of a call. """
+    times = []
+    for i in range(repeats):
+        t0 = time.perf_counter()
+        function(*args, **kwargs)
+        times.append(time.perf_counter() - t0)
+    return {'mean': float(np.mean(times)),
+            'min': float(np.min(times)),
+            'max': float(np.max(times))}
+
+
+def main(output='deploy_solver_benchmark.json', repeats=3):
+    results = []
+    for n in proto_counts:
+        for pref_mix in pref_mixes:
+            proto_commod = make_commodity(n, pref_mix)
+            commodity_dict = {'commod': proto_commod}
+            mean_cap = np.mean([v['cap'] for v in proto_commod.values()])
+            table = solver.PrototypeTable(proto_commod)
+            pref_fac = solver.evaluate_preference(proto_commod, 10)
+            for ratio in ratios:
+                diff = -ratio * mean_cap
+                timings = {}
+                for method, max_n in deploy_methods.items():
+                    if pref_mix == 'tied' and n > max_n:
+                        continue
+                    if pref_mix == 'timed' and method != 'greedy':
+                        continue
+                    timings['deploy_solver_' + method] = time_call(
+                        solver.deploy_solver, repeats, {}, commodity_dict,
+                        'commod', diff, 10, method=method)
+                timings['deploy_solver_table'] = time_call(
+                    solver.deploy_solver, repeats, {}, commodity_dict,
+                    'commod', diff, 10,
+                    table=solver.PrototypeTable(proto_commod, horizon=16))
+                timings['preference_deploy'] = time_call(
+                    solver.preference_deploy, repeats, proto_commod,
+                    pref_fac, -diff)
+                timings['minimize_number_of_deployment'] = time_call(
+                    solver.minimize_number_of_deployment, repeats,
+                    proto_commod, -diff, table)
+                result = {'prototypes': n,
+                          'ratio': ratio,
+                          'preferences': pref_mix,
+                          'timings': timings}
+                results.append(result)
+                print(n, pref_mix, ratio,
+                      {k: '%.2e' % v['mean'] for k, v in timings.items()})
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=4)
+    return results
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if len(args) > 1:
+        args[1] = int(args[1])
+    main(*args)
@@ -0,0 +1,82 @@
+"""
+This python file benchmarks the startup time of the d3ploy archetypes.
+
+How to use:
+python [file name] [output json] [repeats]
+
+Every measurement runs in a fresh python interpreter, so nothing is
+cached between measurements. The import time of each d3ploy module and
+the time of the first request of each calc method (which imports its
+backend module) are written to import_time_benchmark.json.
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+ENV = dict(os.environ)
+ENV['PYTHONPATH'] = ".:" + ENV.get('PYTHONPATH', '')
+
+modules = ['d3ploy.calc_methods', 'd3ploy.solver', 'd3ploy.NO_solvers',
+           'd3ploy.DO_solvers', 'd3ploy.ML_solvers',
+           'd3ploy.timeseries_inst',
+           'd3ploy.supply_driven_deployment_inst']
+
+calc_methods = ["ma", "arma", "arch", "poly",
+                "exp_smoothing", "holt_winters", "fft", "sw_seasonal"]
+
+import_script = """
+import time
+t0 = time.perf_counter()
+import {module}
+print(time.perf_counter() - t0)
+"""
+
+method_script = """
+import time
+from d3ploy.calc_methods import CALC_METHODS
+t0 = time.perf_counter()
+CALC_METHODS['{method}']
+print(time.perf_counter() - t0)
+"""
+
+
+def time_script(script, repeats):
+    """ Runs [script] [repeats] times in fresh interpreters and returns
+        the measured times, or the error if the script fails. """
+    times = []
+    for i in range(repeats):
+        out = subprocess.run([sys.executable, '-c', script], env=ENV,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                             universal_newlines=True)
+        if out.returncode != 0:
+            return {'error': out.stderr.strip().splitlines()[-1]}
+        times.append(float(out.stdout.strip().splitlines()[-1]))
+    return {'mean': float(np.mean(times)),
+            'min': float(np.min(times)),
+            'max': float(np.max(times))}
+
+
+def main(output='import_time_benchmark.json', repeats=5):
+    results = {'import': {}, 'first_request': {}}
+    for module in modules:
+        results['import'][module] = time_script(
+            import_script.format(module=module), repeats)
+        print(module, results['import'][module])
+    for method in calc_methods:
+        results['first_request'][method] = time_script(
+            method_script.format(method=method), repeats)
+        print(method, results['first_request'][method])
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=4)
+    return results
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if len(args) > 1:
+        args[1] = int(args[1])
+    main(*args)
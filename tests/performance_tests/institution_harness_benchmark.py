@@ -0,0 +1,88 @@
+"""
+This python file benchmarks the decision of the institutions outside of
+cyclus, with the stand-in context of tools/harness.py.
+
+How to use:
+python [file name] [timesteps] [output json] [profile]
+
+No cyclus is needed. A timeseries_inst deploying 1000 MW and 50 MW
+reactors for a growing, noisy power demand is run for [timesteps]
+timesteps (default 100,000) with each calc method, each deploy method and
+each kind of preferences, and the time per timestep is written to
+institution_harness_benchmark.json. The deploy methods only choose
+between prototypes of the same preference, so they are run with tied
+preferences. If [profile] is given, the cProfile statistics of each run
+are printed.
+"""
+
+import cProfile
+import json
+import os
+import pstats
+import sys
+import time
+
+# the tools package is not installed, it is imported from the root of
+# the repository
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', '..'))
+from tools.harness import Harness, constant, noisy
+
+calc_methods = ['ma', 'arma', 'kalman', 'poly', 'fast_seasonal']
+deploy_methods = ['greedy', 'exact', 'agent_count']
+# preferences of the lwr and smr prototypes
+preferences = {'ranked': ('1', '2'),
+               'tied': ('1', '1'),
+               'time': ('1', '3-t/25000')}
+
+
+def make_harness(calc_method, deploy_method, prefs='ranked'):
+    lwr, smr = preferences[prefs]
+    config = {'commodities': ['POWER_lwr_1000_' + lwr, 'POWER_smr_50_' + smr],
+              'demand_eq': '10000 + 5*t',
+              'calc_method': calc_method,
+              'deploy_method': deploy_method,
+              'agent_weight': 100.0,
+              'steps': 1,
+              'back_steps': 10}
+    return Harness('TimeSeriesInst', config,
+                   supply={'POWER': noisy(constant(10000), 50)},
+                   lifetime=720)
+
+
+def main(timesteps=100000, output='institution_harness_benchmark.json',
+         profile=False):
+    results = {}
+    runs = [(calc_method, 'greedy', 'ranked')
+            for calc_method in calc_methods] + \
+        [('ma', deploy_method, 'tied') for deploy_method in deploy_methods] + \
+        [('ma', 'greedy', 'time')]
+    for calc_method, deploy_method, prefs in runs:
+        harness = make_harness(calc_method, deploy_method, prefs)
+        profiler = cProfile.Profile() if profile else None
+        t0 = time.perf_counter()
+        if profiler is not None:
+            profiler.runcall(harness.run, timesteps)
+        else:
+            harness.run(timesteps)
+        elapsed = time.perf_counter() - t0
+        key = '%s_%s_%s' % (calc_method, deploy_method, prefs)
+        results[key] = {'timesteps': timesteps,
+                        'seconds': elapsed,
+                        'us_per_step': elapsed / timesteps * 1e6,
+                        'builds': len(harness.context.builds)}
+        print('%-32s %10.1f us/step %8d builds' % (
+            key, results[key]['us_per_step'], results[key]['builds']))
+        if profiler is not None:
+            pstats.Stats(profiler).sort_stats('cumtime').print_stats(15)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if len(args) > 0:
+        args[0] = int(args[0])
+    if len(args) > 2:
+        args[2] = True
+    main(*args)
@@ -0,0 +1,68 @@
+import random
+import pytest
+from collections import defaultdict
+from d3ploy.accumulator import TimeSeriesAccumulator, series_values
+
+
+def test_accumulator_matches_defaultdict():
+    """ Tests if the accumulator behaves like the defaultdict(float)
+        it replaces for listener records and institution updates """
+    acc = TimeSeriesAccumulator(size=4)
+    ref = defaultdict(float)
+    for time in range(3, 40):
+        for i in range(random.randint(0, 3)):
+            value = random.uniform(0, 10)
+            acc.listener(None, time, value, 'supplyfuel')
+            ref[time] += value
+        if time not in ref:
+            ref[time] = 0.0
+        if time not in acc:
+            acc[time] = 0.0
+        assert len(acc) == len(ref)
+        assert list(acc.keys()) == list(ref.keys())
+        assert acc.values() == pytest.approx(list(ref.values()))
+
+
+def test_accumulator_contains():
+    """ Tests if only touched timesteps are part of the series, as keys of
+        the defaultdict it replaces, including the ones before the first
+        timestep touched """
+    acc = TimeSeriesAccumulator(size=4)
+    assert 0 not in acc
+    assert len(acc) == 0
+    assert list(acc.values()) == []
+    acc.listener(None, 5, 1.0, 'demandfuel')
+    assert 5 in acc
+    assert 4 not in acc
+    assert 6 not in acc
+    acc[7] = 2.0
+    assert 6 not in acc
+    assert len(acc) == 2
+    assert list(acc.keys()) == [5, 7]
+    assert list(acc.values()) == [1.0, 2.0]
+    acc[3] = 4.0
+    assert 3 in acc
+    assert list(acc.items()) == [(3, 4.0), (5, 1.0), (7, 2.0)]
+    assert list(reversed(acc)) == [7, 5, 3]
+    assert acc[6] == 0.0
+    assert list(acc.keys()) == [3, 5, 6, 7]
+    acc.listener(None, 20, 1.0, 'demandfuel')
+    assert acc[3] == 4.0 and len(acc) == 5
+
+
+def test_accumulator_values_view():
+    """ Tests if the values of a series without gaps are a read-only view
+        of the storage, and if series_values reads the last values of
+        accumulators and dictionaries alike """
+    acc = TimeSeriesAccumulator(size=4)
+    ref = {}
+    for t in range(10):
+        acc[t] = 2.0 * t
+        ref[t] = 2.0 * t
+    values = acc.values()
+    assert values.base is not None
+    with pytest.raises(ValueError):
+        values[0] = 1.0
+    assert list(series_values(acc, 3)) == [14.0, 16.0, 18.0]
+    assert list(series_values(ref, 3)) == [14.0, 16.0, 18.0]
+    assert list(series_values(ref, 30)) == list(series_values(acc))
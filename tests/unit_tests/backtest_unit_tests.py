@@ -0,0 +1,63 @@
+import sqlite3 as lite
+import uuid
+
+import pytest
+from d3ploy.backtest import load_series, run_backtest, report
+
+
+def write_output(file_name):
+    con = lite.connect(file_name)
+    for table in ['TimeSeriessupplyPOWER', 'TimeSeriesdemandPOWER',
+                  'TimeSeriescalc_supplyPOWER']:
+        con.execute('create table %s (SimId, AgentId, Time, Value)' % table)
+    for t in range(30):
+        for agent in (1, 2):
+            con.execute('insert into TimeSeriessupplyPOWER values '
+                        '(0, ?, ?, ?)', (agent, t, 1.0 * t))
+        con.execute('insert into TimeSeriesdemandPOWER values (0, 1, ?, 5)',
+                    (t,))
+        con.execute('insert into TimeSeriescalc_supplyPOWER values '
+                    '(0, 1, ?, 0)', (t,))
+    con.commit()
+    con.close()
+
+
+def test_backtest_output(tmp_path):
+    """ Tests if the recorded series are loaded summed over the agents,
+        and if every method is backtested on every series """
+    file_name = str(tmp_path / 'output.sqlite')
+    write_output(file_name)
+    series = load_series(file_name)
+    assert sorted(series) == [('demand', 'POWER'), ('supply', 'POWER')]
+    assert series[('supply', 'POWER')][10] == 20.0
+    results = run_backtest(series, ['ma', 'poly', 'not_a_method'],
+                           back_steps=1, processes=1)
+    assert results[('ma', ('supply', 'POWER'))]['count'] == 29
+    assert results[('ma', ('supply', 'POWER'))]['mae'] == pytest.approx(2.0)
+    assert results[('ma', ('demand', 'POWER'))]['mae'] == pytest.approx(0.0)
+    assert results[('not_a_method', ('supply', 'POWER'))]['error'] is not None
+    assert 'failed' in report(results)
+    parallel = run_backtest(series, ['ma'], back_steps=1, processes=2)
+    assert parallel[('ma', ('supply', 'POWER'))]['mae'] == pytest.approx(2.0)
+
+
+def test_load_series_simid(tmp_path):
+    """ Tests if the series of one simulation are loaded from a file
+        holding several, and if a SimId is required to load them """
+    file_name = str(tmp_path / 'output.sqlite')
+    con = lite.connect(file_name)
+    con.execute('create table TimeSeriessupplyPOWER '
+                '(SimId, AgentId, Time, Value)')
+    sims = [uuid.UUID(int=1), uuid.UUID(int=2)]
+    for t in range(10):
+        for i, sim in enumerate(sims):
+            con.execute('insert into TimeSeriessupplyPOWER values '
+                        '(?, 1, ?, ?)', (sim.bytes, t, 100.0 * i + t))
+    con.commit()
+    con.close()
+    with pytest.raises(ValueError):
+        load_series(file_name)
+    with pytest.raises(ValueError):
+        load_series(file_name, simid=str(uuid.UUID(int=3)))
+    series = load_series(file_name, simid=str(sims[1]).upper())
+    assert series[('supply', 'POWER')] == {t: 100.0 + t for t in range(10)}
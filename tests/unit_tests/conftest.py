@@ -0,0 +1,11 @@
+import pytest
+from tools import harness
+
+
+@pytest.fixture
+def stub_cyclus():
+    """ Replaces cyclus by the stand-in modules for the test, and
+        restores it afterwards even if the test fails """
+    harness.install()
+    yield
+    harness.uninstall()
@@ -133,3 +133,412 @@ def test_pref_solver_eq():
         if t > 5:
             assert(deploy_dict['1'] == 5)
     assert(True)
+
+
+def test_exact_deploy_solver():
+    """ Tests if the exact deploy method deploys the least overbuilt
+        capacity, and then the least number of facilities """
+    commod = {'3': {'cap': 3, 'pref': '0',
+                    'constraint_commod': '0', 'constraint': 0},
+              '5': {'cap': 5, 'pref': '0',
+                    'constraint_commod': '0', 'constraint': 0},
+              '7': {'cap': 7, 'pref': '0',
+                    'constraint_commod': '0', 'constraint': 0}}
+    deploy_dict = solver.deploy_solver(commodity_supply={},
+                                       commodity_dict={'commod': commod},
+                                       commod='commod',
+                                       diff=-11,
+                                       time=1,
+                                       method='exact',
+                                       resolution=1)
+    assert deploy_dict == {'5': 1, '3': 2}
+    deploy_dict = solver.deploy_solver(commodity_supply={},
+                                       commodity_dict={'commod': commod},
+                                       commod='commod',
+                                       diff=-14,
+                                       time=1,
+                                       method='exact',
+                                       resolution=1)
+    assert deploy_dict == {'7': 2}
+
+
+def test_plan_cache():
+    """ Tests if cached plans are reused for shortfalls rounded to the
+        same multiple of the smallest capacity, and always cover them """
+    commod = {'3': {'cap': 3, 'pref': '0',
+                    'constraint_commod': '0', 'constraint': 0},
+              '5': {'cap': 5, 'pref': '0',
+                    'constraint_commod': '0', 'constraint': 0}}
+    cache = solver.PlanCache(size=2)
+    for diff in [-10.5, -10.9, -11.0, -12.2, -10.1]:
+        deploy_dict = solver.deploy_solver(commodity_supply={},
+                                           commodity_dict={'commod': commod},
+                                           commod='commod',
+                                           diff=diff,
+                                           time=1,
+                                           cache=cache)
+        deployed_cap = sum(num * commod[proto]['cap']
+                           for proto, num in deploy_dict.items())
+        assert deployed_cap >= -diff
+    assert cache.stats()['hits'] == 3
+    assert cache.stats()['misses'] == 2
+    # a plan is solved for the real shortfall, and only cached if it
+    # covers the rounded one
+    commod = {'1000': {'cap': 1000, 'pref': '0',
+                       'constraint_commod': '0', 'constraint': 0},
+              '300': {'cap': 300, 'pref': '0',
+                      'constraint_commod': '0', 'constraint': 0}}
+    for method in ['greedy', 'exact']:
+        cache = solver.PlanCache(size=2)
+        expected = solver.deploy_solver({}, {'commod': commod}, 'commod',
+                                        -950, 1, method=method)
+        deploy_dict = solver.deploy_solver({}, {'commod': commod},
+                                           'commod', -950, 1,
+                                           method=method, cache=cache)
+        assert deploy_dict == expected
+    # the exact plan of 1000 does not cover the rounded shortfall of 1200
+    assert cache.stats()['plans'] == 0
+
+
+def test_joint_deploy_solver():
+    """ Tests if the joint deploy method lifts the constraint of a
+        preferred prototype with the constraint commodity deployed for
+        its own shortfall in the same timestep, and never deploys the
+        constraint commodity only to lift the constraint """
+    commodity_dict = {'POWER': {'lwr': {'cap': 1000.0,
+                                        'pref': '1',
+                                        'constraint_commod': '0',
+                                        'constraint': 0},
+                                'fr': {'cap': 400.0,
+                                       'pref': '2.5',
+                                       'constraint_commod': 'pu',
+                                       'constraint': 500.0}},
+                      'pu': {'separations': {'cap': 300.0,
+                                             'pref': '0',
+                                             'constraint_commod': '0',
+                                             'constraint': 0}}}
+    commodity_supply = {'pu': {1: 0.0}}
+    deploy_dicts = solver.joint_deploy_solver(commodity_supply,
+                                              commodity_dict,
+                                              {'POWER': -1000, 'pu': 0},
+                                              time=1)
+    assert deploy_dicts == {'POWER': {'lwr': 1}}
+    deploy_dicts = solver.joint_deploy_solver(commodity_supply,
+                                              commodity_dict,
+                                              {'POWER': -1500, 'pu': -550},
+                                              time=1)
+    assert deploy_dicts == {'POWER': {'fr': 4}, 'pu': {'separations': 2}}
+    commodity_supply = {'pu': {1: 600.0}}
+    deploy_dicts = solver.joint_deploy_solver(commodity_supply,
+                                              commodity_dict,
+                                              {'POWER': -1500, 'pu': 0},
+                                              time=1)
+    assert deploy_dicts == {'POWER': {'fr': 4}}
+    # preferences are compared by their integer part, as deploy_solver
+    # does, so lwr and fr are tied and the least overbuilt is deployed
+    commodity_dict['POWER']['lwr']['pref'] = '2.2'
+    deploy_dicts = solver.joint_deploy_solver(commodity_supply,
+                                              commodity_dict,
+                                              {'POWER': -1000, 'pu': 0},
+                                              time=1)
+    assert deploy_dicts == {'POWER': {'lwr': 1}}
+
+
+def test_agent_count_deploy_solver():
+    """ Tests if the agent_count deploy method lumps many small
+        facilities into a lumped variant when it is worth it """
+    commodity_dict = {'fuel': {'source': {'cap': 300.0,
+                                          'pref': '0',
+                                          'constraint_commod': '0',
+                                          'constraint': 0}}}
+    commodity_dict = solver.lump_prototypes(commodity_dict,
+                                            ['source_source100_100'])
+    assert commodity_dict['fuel']['source100']['cap'] == 30000.0
+    deploy_dict = solver.deploy_solver(commodity_supply={},
+                                       commodity_dict=commodity_dict,
+                                       commod='fuel',
+                                       diff=-29000,
+                                       time=1,
+                                       method='agent_count',
+                                       agent_weight=1500)
+    assert deploy_dict == {'source100': 1}
+    deploy_dict = solver.deploy_solver(commodity_supply={},
+                                       commodity_dict=commodity_dict,
+                                       commod='fuel',
+                                       diff=-29000,
+                                       time=1,
+                                       method='agent_count',
+                                       agent_weight=5)
+    assert deploy_dict == {'source': 97}
+
+
+def test_prototype_table_preferences():
+    """ Tests if the precomputed preference and constraint tables give
+        the same deployment as evaluating the preferences every call """
+    commod = {'1': {'cap': 2,
+                    'pref': '1*t',
+                    'constraint_commod': '0',
+                    'constraint': 0},
+              '2': {'cap': 4,
+                    'pref': '10 - (1*t)',
+                    'constraint_commod': '0',
+                    'constraint': 0},
+              '3': {'cap': 3,
+                    'pref': 'max(0, 20 - t)',
+                    'constraint_commod': 'pu',
+                    'constraint': 100}}
+    table = solver.PrototypeTable(commod, horizon=4)
+    for t in range(10):
+        commodity_supply = {'pu': {t: 50.0 * (t % 3)}}
+        for diff in [-1, -10, -25]:
+            expected = solver.deploy_solver(commodity_supply,
+                                            {'commod': commod},
+                                            'commod', diff, t)
+            deploy_dict = solver.deploy_solver(commodity_supply,
+                                               {'commod': commod},
+                                               'commod', diff, t,
+                                               table=table)
+            assert deploy_dict == expected
+    assert table.horizon >= 10
+
+
+def test_prototype_table_large_preferences():
+    """ Tests if the preference table matches evaluate_preference for
+        power-law and exponential preferences, which wrap around when
+        evaluated over integer timesteps """
+    commod = {'power': {'cap': 1, 'pref': 't**5',
+                        'constraint_commod': '0', 'constraint': 0},
+              'exp': {'cap': 1, 'pref': '2**t',
+                      'constraint_commod': '0', 'constraint': 0},
+              'ratio': {'cap': 1, 'pref': '1000 - 1/(t+1)',
+                        'constraint_commod': '0', 'constraint': 0}}
+    table = solver.PrototypeTable(commod, horizon=1000)
+    for t in list(range(0, 1000, 7)) + [62, 63, 64, 999]:
+        expected = solver.evaluate_preference(commod, t)
+        prefs = table.preferences(t)
+        for proto in commod:
+            assert prefs[proto] == pytest.approx(expected[proto], rel=1e-12)
+    commod = {'power': commod['power']}
+    table = solver.PrototypeTable(commod, horizon=8000)
+    for t in [6208, 6209, 7999]:
+        assert table.preferences(t)['power'] == \
+            pytest.approx(solver.evaluate_preference(commod, t)['power'],
+                          rel=1e-12)
+        assert table.preferences(t)['power'] > 0
+
+
+def test_prototype_table_constraints():
+    """ Tests if the constraint mask follows the supply of each constraint
+        commodity when only some of them change between updates """
+    commod = {'a': {'cap': 1, 'pref': '0',
+                    'constraint_commod': 'pu', 'constraint': 10},
+              'b': {'cap': 1, 'pref': '0',
+                    'constraint_commod': 'u', 'constraint': 5},
+              'c': {'cap': 1, 'pref': '0',
+                    'constraint_commod': '0', 'constraint': 0}}
+    table = solver.PrototypeTable(commod)
+    supply = {'pu': {0: 0.0, 1: 20.0, 2: 20.0, 3: 20.0},
+              'u': {0: 5.0, 1: 5.0, 2: 0.0, 3: 0.0}}
+    answers = [[False, True, True], [True, True, True],
+               [True, False, True], [True, False, True]]
+    for t, answer in enumerate(answers):
+        assert table.update_constraints(supply, t).tolist() == answer
+        pref_fac = solver.check_constraint(
+            commod, supply, {'a': 0, 'b': 0, 'c': 0}, t)
+        assert table.check_constraint(
+            supply, {'a': 0, 'b': 0, 'c': 0}, t) == pref_fac
+
+
+def test_exact_deploy_solver_covers_shortfall():
+    """ Tests if the exact deploy method never deploys less than the
+        shortfall when the capacities are not multiples of the
+        resolution """
+    commod = {'a': {'cap': 1.0, 'pref': '0',
+                    'constraint_commod': '0', 'constraint': 0},
+              'b': {'cap': 1.26, 'pref': '0',
+                    'constraint_commod': '0', 'constraint': 0}}
+    assert solver.minimize_overbuild(commod, 1.27) == {'a': 2}
+    rng = random.Random(0)
+    for i in range(200):
+        caps = [rng.uniform(0.5, 5) for j in range(3)]
+        commod = {str(j): {'cap': cap, 'pref': '0',
+                           'constraint_commod': '0', 'constraint': 0}
+                  for j, cap in enumerate(caps)}
+        remainder = rng.uniform(0.1, 30)
+        for resolution in [0, 2.0]:
+            deploy_dict = solver.minimize_overbuild(commod, remainder,
+                                                    resolution)
+            built = sum(num * commod[proto]['cap']
+                        for proto, num in deploy_dict.items())
+            assert built >= remainder - 1e-9
+
+
+def test_exact_deploy_solver_large_capacity():
+    """ Tests if a prototype much larger than the shortfall does not
+        size the coin-change table, which would take minutes and
+        gigabytes for the capacities below """
+    commod = {'big': {'cap': 1e9, 'pref': '0',
+                      'constraint_commod': '0', 'constraint': 0},
+              'tiny': {'cap': 1, 'pref': '0',
+                       'constraint_commod': '0', 'constraint': 0}}
+    deploy_dict = solver.deploy_solver(commodity_supply={},
+                                       commodity_dict={'commod': commod},
+                                       commod='commod',
+                                       diff=-5,
+                                       time=1,
+                                       method='exact')
+    assert deploy_dict == {'tiny': 5}
+    assert solver.minimize_agents(commod, 5, 1e9) == {'big': 1}
+    assert solver.minimize_agents(commod, 5, 0.5) == {'tiny': 5}
+
+
+def test_dp_table():
+    """ Tests if the coin-change tables, built at once or extended, match
+        the cell by cell recurrence, and if only DP_TABLES_SIZE of them
+        are kept """
+    solver.DP_TABLES.clear()
+    for quanta in [(7, 3), (10, 25, 4), (13,)]:
+        size = 300
+        count = [0.0] + [float('inf')] * (size - 1)
+        last = [0] + [-1] * (size - 1)
+        for indx, q in enumerate(quanta):
+            for cell in range(q, size):
+                if count[cell - q] + 1 < count[cell]:
+                    count[cell] = count[cell - q] + 1
+                    last[cell] = indx
+        table_count, table_last = solver.dp_table(quanta, size)
+        assert table_count[:size].tolist() == count
+        assert table_last[:size].tolist() == last
+        # an extended table may reach a capacity with another prototype
+        # in the same number of units
+        solver.DP_TABLES.clear()
+        solver.dp_table(quanta, 37)
+        table_count, table_last = solver.dp_table(quanta, size)
+        assert table_count[:size].tolist() == count
+        for cell in range(1, size):
+            if count[cell] < float('inf'):
+                q = quanta[table_last[cell]]
+                assert table_count[cell - q] + 1 == count[cell]
+    for q in range(20, 20 + 2 * solver.DP_TABLES_SIZE):
+        solver.dp_table((q,), 10)
+    assert len(solver.DP_TABLES) == solver.DP_TABLES_SIZE
+    assert (7, 3) not in solver.DP_TABLES
+    solver.DP_TABLES.clear()
+
+
+def test_agent_count_deploy_solver_covers_shortfall():
+    """ Tests if the agent_count deploy method, directly and through the
+        plan cache, never deploys less than the shortfall when the
+        capacities are not multiples of the resolution """
+    commod = {'a': {'cap': 1.0, 'pref': '0',
+                    'constraint_commod': '0', 'constraint': 0},
+              'b': {'cap': 1.26, 'pref': '0',
+                    'constraint_commod': '0', 'constraint': 0}}
+    assert solver.minimize_agents(commod, 1.27, 0.5) == {'a': 2}
+    rng = random.Random(1)
+    cache = solver.PlanCache(size=16)
+    for i in range(200):
+        caps = [rng.uniform(0.5, 5) for j in range(3)]
+        commod = {str(j): {'cap': cap, 'pref': '0',
+                           'constraint_commod': '0', 'constraint': 0}
+                  for j, cap in enumerate(caps)}
+        remainder = rng.uniform(0.1, 30)
+        for agent_weight, resolution in [(1.0, 0), (3.0, 1.0)]:
+            deploy_dict = solver.minimize_agents(commod, remainder,
+                                                 agent_weight, resolution)
+            built = sum(num * commod[proto]['cap']
+                        for proto, num in deploy_dict.items())
+            assert built >= remainder - 1e-9
+        # the cache keys plans by commodity, whose capacities are fixed
+        name = 'commod%i' % i
+        deploy_dict = solver.deploy_solver(commodity_supply={},
+                                           commodity_dict={name: commod},
+                                           commod=name,
+                                           diff=-remainder,
+                                           time=1,
+                                           method='agent_count',
+                                           cache=cache,
+                                           agent_weight=1.0)
+        built = sum(num * commod[proto]['cap']
+                    for proto, num in deploy_dict.items())
+        assert built >= remainder - 1e-9
+
+
+def loop_preference_deploy(proto_commod, pref_fac, diff):
+    """ preference_deploy as it was before the closed form, subtracting
+        one facility at a time """
+    deploy_dict = {}
+    proto = sorted(pref_fac,
+                   key=pref_fac.get, reverse=True)[0]
+    if diff >= proto_commod[proto]['cap']:
+        deploy_dict[proto] = 1
+        diff -= proto_commod[proto]['cap']
+        while diff > proto_commod[proto]['cap']:
+            deploy_dict[proto] += 1
+            diff -= proto_commod[proto]['cap']
+        if diff == 0:
+            return deploy_dict
+        else:
+            deploy_dict[proto] += 1
+    elif diff > 0:
+        deploy_dict[proto] = 1
+    return deploy_dict
+
+
+def loop_minimize_number_of_deployment(proto_commod, remainder):
+    """ minimize_number_of_deployment as it was before the closed form,
+        subtracting one facility at a time """
+    deploy_dict = {}
+    cap_dict = {}
+    for proto, val_dict in proto_commod.items():
+        cap_dict[proto] = val_dict['cap']
+    key_list = sorted(cap_dict, key=cap_dict.get, reverse=True)
+    for proto in key_list:
+        if remainder >= proto_commod[proto]['cap']:
+            deploy_dict[proto] = 1
+            remainder -= proto_commod[proto]['cap']
+            while remainder > proto_commod[proto]['cap']:
+                deploy_dict[proto] += 1
+                remainder -= proto_commod[proto]['cap']
+    if remainder == 0:
+        return deploy_dict
+
+    for proto in list(reversed(key_list)):
+        if remainder > proto_commod[proto]['cap']:
+            continue
+        if proto in deploy_dict.keys():
+            deploy_dict[proto] += 1
+        else:
+            deploy_dict[proto] = 1
+        break
+
+    return deploy_dict
+
+
+def test_closed_form_deploy_matches_loops():
+    """ Tests if the closed form unit counts of preference_deploy and
+        minimize_number_of_deployment are the ones of the loops they
+        replaced, including shortfalls that are exact multiples of the
+        capacities and capacity ties. The values are multiples of 0.25,
+        so that the loops subtract them without rounding errors """
+    rng = random.Random(2)
+    for i in range(2000):
+        commod = {str(j): {'cap': rng.randint(1, 40) / 4.0,
+                           'pref': '0',
+                           'constraint_commod': '0',
+                           'constraint': 0}
+                  for j in range(rng.randint(1, 4))}
+        caps = [v['cap'] for v in commod.values()]
+        if i % 2:
+            # shortfalls that are sums of whole facilities
+            remainder = sum(rng.randint(0, 5) * cap for cap in caps)
+        else:
+            remainder = rng.randint(0, 400) / 4.0
+        pref_fac = {proto: float(rng.randint(0, 2)) for proto in commod}
+        assert solver.minimize_number_of_deployment(commod, remainder) == \
+            loop_minimize_number_of_deployment(commod, remainder)
+        assert solver.minimize_number_of_deployment(
+            commod, remainder, solver.PrototypeTable(commod)) == \
+            loop_minimize_number_of_deployment(commod, remainder)
+        assert solver.preference_deploy(commod, pref_fac, remainder) == \
+            loop_preference_deploy(commod, pref_fac, remainder)
@@ -0,0 +1,149 @@
+import pytest
+import numpy as np
+import d3ploy.NO_solvers as no
+from d3ploy.calc_methods import ForecastState
+
+
+def test_fit_failure_memo_backoff():
+    """ Tests if the number of skipped fits doubles with every
+        consecutive failure and resets after a success """
+    memo = no.FitFailureMemo(max_backoff=4)
+    skipped = []
+    for i in range(4):
+        memo.failure(ValueError('degenerate series'))
+        n = 0
+        while memo.skip():
+            n += 1
+        skipped.append(n)
+    assert skipped == [1, 2, 4, 4]
+    assert memo.diagnostics()['failures'] == 4
+    assert memo.diagnostics()['skipped'] == 11
+    assert 'degenerate series' in memo.diagnostics()['reason']
+    memo.success()
+    memo.failure(ValueError('degenerate series'))
+    assert memo.backoff == 1
+
+
+def test_mc_deviations():
+    """ Tests if the Monte Carlo deviations of a white noise series
+        spread like its residuals, and vanish for a constant series """
+    rng = np.random.RandomState(1)
+    ts = {t: 100.0 + rng.normal(0, 10) for t in range(2000)}
+    x = no.mc_deviations(ts, steps=1, back_steps=0, n_paths=20000, rng=rng)
+    assert np.std(x) == pytest.approx(10, rel=0.1)
+    assert np.quantile(x, 0.05) == pytest.approx(-16.4, rel=0.1)
+    ts = {t: 5.0 for t in range(20)}
+    assert np.all(no.mc_deviations(ts, steps=3, rng=rng) == 0)
+
+
+def test_predict_kalman():
+    """ Tests if the Kalman filter follows a linear trend, and if the
+        filter kept in the state gives the same forecast as a filter run
+        over the whole series """
+    ts = {t: 5.0 + 2.0 * t for t in range(50)}
+    assert no.predict_kalman(ts, steps=3) == pytest.approx(5.0 + 2.0 * 52,
+                                                           rel=1e-3)
+    rng = np.random.RandomState(2)
+    state = ForecastState()
+    ts = {}
+    for t in range(200):
+        ts[t] = 100.0 + t + rng.normal(0, 5)
+        x = no.predict_kalman(ts, steps=2, std_dev=1, state=state)
+    assert isinstance(state.model, no.KalmanState)
+    assert x == pytest.approx(no.predict_kalman(ts, steps=2, std_dev=1))
+    assert x > no.predict_kalman(ts, steps=2)
+
+
+def test_predict_kalman_gapped():
+    """ Tests if the filter kept in the state skips the timesteps missing
+        from a series, such as the ones of a time series loaded from
+        cyclus output, and matches a filter run over the whole series """
+    rng = np.random.RandomState(3)
+    state = ForecastState()
+    ts = {}
+    for t in range(200):
+        if t % 7 == 3 or 50 <= t < 60:
+            continue
+        ts[t] = 100.0 + t + rng.normal(0, 5)
+        x = no.predict_kalman(ts, steps=2, std_dev=1, state=state)
+    assert state.model.time == max(ts)
+    assert x == pytest.approx(no.predict_kalman(ts, steps=2, std_dev=1))
+
+
+def test_predict_arma_batch():
+    """ Tests if the closed-form AR(1) forecasts of a batch of time series
+        match the forecasts of each time series, and recover a known
+        AR(1) process """
+    from d3ploy.calc_methods import forecast, forecast_batch
+    rng = np.random.RandomState(3)
+    series = {}
+    for i in range(5):
+        x = [50.0]
+        for t in range(3 + 10 * i):
+            x.append(20 + 0.6 * x[-1] + rng.normal(0, 1))
+        series[i] = dict(enumerate(x))
+    batch = forecast_batch('arma', series, steps=3, std_dev=1, back_steps=20)
+    for i, ts in series.items():
+        assert batch[i] == pytest.approx(forecast('arma', ts, steps=3,
+                                                  std_dev=1, back_steps=20))
+    c, phi, residuals = no.ar1_fit([1.0, 2.0, 2.5, 2.75, 2.875])
+    assert phi == pytest.approx(0.5)
+    assert c == pytest.approx(1.5)
+    assert np.allclose(residuals, 0)
+    # an explosive window is fit with phi bounded to 1 and the intercept
+    # of that phi, so the forecast follows the trend
+    c, phi, residuals = no.ar1_fit([1.0, 2.0, 4.0, 8.0, 16.0])
+    assert phi == pytest.approx(1.0)
+    assert c == pytest.approx(3.75)
+    assert forecast('arma', dict(enumerate([10.0, 10.0, 10.0, 11.0, 14.0])),
+                    steps=1, back_steps=5) > 14.0
+
+
+def test_fast_seasonal():
+    """ Tests if the fast seasonal method follows a trending seasonal
+        series, and if the components kept in the state give the same
+        forecast as components computed over the whole series """
+    import d3ploy.ML_solvers as ml
+    pattern = [0.0, 10.0, 0.0, -10.0]
+    state = ForecastState()
+    ts = {}
+    for t in range(200):
+        ts[t] = 100.0 + 0.5 * t + pattern[t % 4]
+        x = ml.fast_seasonal(ts, period=4, state=state)
+    assert x == pytest.approx(100.0 + 0.5 * 200 + pattern[0], abs=0.5)
+    assert x == pytest.approx(ml.fast_seasonal(ts, period=4))
+
+
+def test_forecast_path_refit():
+    """ Tests if a forecast path is only computed every refit timesteps,
+        and runs the fit AR(1) model on from the values of a noisy
+        series observed in between """
+    from d3ploy.calc_methods import forecast
+    rng = np.random.RandomState(2)
+    state = ForecastState()
+    ts = {}
+    fit_times = []
+    x = 50.0
+    for t in range(12):
+        x = 20.0 + 0.6 * x + rng.normal(0, 2)
+        ts[t] = x
+        value = forecast('arma', ts, steps=3, back_steps=10, state=state,
+                         refit=5)
+        if state.path is None:
+            fit_times.append(None)
+            continue
+        fit_times.append(state.path.fit)
+        window = [ts[k] for k in range(state.path.fit + 1)][-10:]
+        c, phi, residuals = no.ar1_fit(window)
+        expected = ts[t]
+        for h in range(3):
+            expected = c + phi * expected
+        assert value == pytest.approx(expected)
+    # the moving average path of the first two values is not kept
+    assert fit_times == [None] * 2 + [2] * 5 + [7] * 5
+    for method in ['ma', 'poly']:
+        state = ForecastState()
+        assert forecast(method, ts, back_steps=5, state=state,
+                        refit=5) == pytest.approx(forecast(method, ts,
+                                                           back_steps=5))
+        assert state.path is None
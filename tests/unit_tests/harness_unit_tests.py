@@ -0,0 +1,86 @@
+import pytest
+from tools.harness import Harness, constant, linear
+
+
+def test_harness_timeseries_inst(stub_cyclus):
+    """ Tests if the institution deploys the facilities that cover the
+        demand, replacing the retired ones, with the stand-in context """
+    h = Harness('TimeSeriesInst',
+                {'commodities': ['POWER_lwr_1000'],
+                 'demand_eq': '10000 + 50*t', 'calc_method': 'ma',
+                 'steps': 1, 'back_steps': 1},
+                supply={'POWER': constant(10000)}, lifetime=100)
+    assert h.inst.record is False
+    h.run(300)
+    assert all(proto == 'lwr' for time, proto in h.context.builds)
+    assert h.capacity['POWER'] + 10000 >= 10000 + 50 * 298
+    assert h.capacity['POWER'] <= 50 * 300 + 2000
+    assert len(h.inst.children) == h.capacity['POWER'] / 1000
+
+
+def test_harness_supply_driven(stub_cyclus):
+    """ Tests if the supply driven institution deploys the facilities that
+        consume a growing supply """
+    h = Harness('SupplyDrivenDeploymentInst',
+                {'commodities': ['fuel_sink_100'], 'calc_method': 'ma',
+                 'steps': 1, 'back_steps': 1},
+                supply={'fuel': linear(100, 10)})
+    h.run(100)
+    assert h.inst.commodity_supply['fuel'][99] == pytest.approx(1090)
+    assert h.capacity['fuel'] >= 1080
+
+
+def test_harness_residual_margin(stub_cyclus):
+    """ Tests if the facilities the institution deploys are not taken for
+        forecast errors by the residual margin """
+    h = Harness('TimeSeriesInst',
+                {'commodities': ['POWER_lwr_1000'],
+                 'demand_eq': '10000 + 1500*t', 'calc_method': 'ma',
+                 'steps': 1, 'back_steps': 1, 'residual_window': 20},
+                supply={'POWER': constant(10000)})
+    short = 0
+    for t in range(300):
+        h.step()
+        short += h.inst.commodity_supply['POWER'][t] < 10000 + 1500 * t
+    assert short == 0
+    margin = h.inst.residual_margins['POWER']
+    assert margin.deployed_residuals.quantile() == pytest.approx(0)
+
+
+def test_harness_mc_margin(stub_cyclus):
+    """ Tests if the Monte Carlo margin bootstraps the residuals of the
+        calc method in place of the std_dev adjustment """
+    h = Harness('TimeSeriesInst',
+                {'commodities': ['POWER_lwr_1000'],
+                 'demand_eq': '10000 + 1500*t', 'calc_method': 'ma',
+                 'steps': 1, 'back_steps': 1, 'supply_std_dev': 100.0,
+                 'mc_paths': 100, 'mc_window': 20},
+                supply={'POWER': constant(10000)})
+    assert h.inst.forecast_std_dev() == 0
+    short = 0
+    for t in range(100):
+        h.step()
+        short += h.inst.commodity_supply['POWER'][t] < 10000 + 1500 * t
+    assert short == 0
+    margin = h.inst.mc_margins['POWER']
+    assert len(margin.deployed_residuals.values()) == 20
+    assert margin.deployed_residuals.quantile() == pytest.approx(0)
+
+
+def test_harness_lumped_prototypes(stub_cyclus):
+    """ Tests if the capacity of the lumped prototypes the institution
+        deploys is added to the supply """
+    h = Harness('TimeSeriesInst',
+                {'commodities': ['POWER_lwr_1000'],
+                 'demand_eq': '10000 + 20000*t', 'calc_method': 'ma',
+                 'steps': 1, 'back_steps': 1, 'deploy_method': 'agent_count',
+                 'lumped_prototypes': ['lwr_lwr10_10'],
+                 'agent_weight': 1000.0},
+                supply={'POWER': constant(10000)})
+    h.run(30)
+    assert any(proto == 'lwr10' for time, proto in h.context.builds)
+    # the builds decided at the last timestep are not built yet
+    built = sum(10000.0 if proto == 'lwr10' else 1000.0
+                for time, proto in h.context.builds if time < 29)
+    assert h.capacity['POWER'] == built
+    assert h.capacity['POWER'] + 10000 >= 10000 + 20000 * 28
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+from d3ploy.pipeline import ForecastPipeline
+from d3ploy.calc_methods import forecast
+
+
+def test_pipeline_matches_direct_forecast():
+    """ Tests if the corrected background forecast of a linear series
+        matches the forecast made in the decision phase """
+    ts = {t: 10.0 + 3.0 * t for t in range(20)}
+    pipeline = ForecastPipeline()
+    pipeline.submit(('supply', 'fuel'), 'poly', ts, 19, back_steps=10)
+    x = pipeline.result(('supply', 'fuel'), ts, 19)
+    assert x == pytest.approx(forecast('poly', ts, back_steps=10))
+
+
+def test_pipeline_result_needs_submit():
+    """ Tests if a forecast that was not started for the current
+        timestep is not returned """
+    ts = {t: 1.0 for t in range(5)}
+    pipeline = ForecastPipeline()
+    assert pipeline.result(('supply', 'fuel'), ts, 4) is None
+    pipeline.submit(('supply', 'fuel'), 'ma', ts, 3)
+    assert pipeline.result(('supply', 'fuel'), ts, 4) is None
+
+
+def test_pipeline_matches_direct_forecast_noisy():
+    """ Tests if the corrected background forecast of a noisy series
+        matches the direct forecast of the methods that are linear in
+        the values, including ma whose steps is its window """
+    rng = np.random.RandomState(1)
+    ts = {t: 100.0 + rng.normal(0, 5) for t in range(30)}
+    for method, steps in [('ma', 3), ('ma', 1), ('poly', 1)]:
+        pipeline = ForecastPipeline()
+        pipeline.submit(('supply', 'fuel'), method, ts, 29, steps=steps,
+                        back_steps=10)
+        x = pipeline.result(('supply', 'fuel'), ts, 29)
+        assert x == pytest.approx(forecast(method, ts, steps=steps,
+                                           back_steps=10))
+
+
+def test_pipeline_linear_methods_only():
+    """ Tests if the corrected forecast of poly of degree 2 matches the
+        direct forecast, and if the methods that are not linear in the
+        values, whose correction would be biased, are not pipelined """
+    rng = np.random.RandomState(2)
+    ts = {t: 100.0 + 0.5 * t ** 2 + rng.normal(0, 5) for t in range(30)}
+    pipeline = ForecastPipeline()
+    pipeline.submit(('supply', 'fuel'), 'poly', ts, 29, back_steps=10,
+                    degree=2)
+    x = pipeline.result(('supply', 'fuel'), ts, 29)
+    assert x == pytest.approx(forecast('poly', ts, back_steps=10, degree=2))
+    for method in ['arma', 'kalman']:
+        pipeline.submit(('supply', 'fuel'), method, ts, 29)
+        assert pipeline.result(('supply', 'fuel'), ts, 29) is None
@@ -0,0 +1,51 @@
+from d3ploy.planner import plan_deployment
+from d3ploy.retirement import RetirementSchedule
+from tools.harness import Harness, constant
+
+
+def test_plan_deployment():
+    """ Tests if the planned builds meet a known demand over the horizon,
+        including the replacement of retiring capacity """
+    commodity_dict = {'POWER': {'lwr': {'cap': 1000,
+                                        'pref': '0',
+                                        'constraint_commod': '0',
+                                        'constraint': 0}}}
+    commodity_supply = {'POWER': {0: 2000.0}}
+    schedule = RetirementSchedule()
+    schedule.add(5, 1000)
+    demand = [2000.0, 2500.0, 2500.0, 3000.0, 3000.0, 3000.0]
+    plan = plan_deployment(commodity_supply, commodity_dict, 'POWER',
+                           demand, 0, schedule=schedule)
+    assert plan.builds == {1: {'lwr': 1}, 4: {'lwr': 1}}
+    assert plan.expected == [2000.0, 3000.0, 3000.0, 3000.0, 3000.0, 3000.0]
+    assert not plan.deviates(3, 3000.0, 0.01)
+    assert plan.deviates(3, 2000.0, 0.01)
+    assert plan.deviates(6, 3000.0, 0.01)
+    assert plan.pop(1) == {'lwr': 1}
+    assert plan.pop(1) == {}
+
+
+def test_plan_horizon_decision(stub_cyclus):
+    """ Tests if the decision of the institution builds the driving
+        commodity from its plan when plan_horizon is set, planning again
+        only when the plan runs out """
+    h = Harness('TimeSeriesInst',
+                {'commodities': ['POWER_lwr_1000'],
+                 'demand_eq': '10000 + 1000*t', 'calc_method': 'ma',
+                 'steps': 1, 'back_steps': 1, 'plan_horizon': 10},
+                supply={'POWER': constant(10000)})
+    h.step()
+    plan = h.inst.plans['POWER']
+    assert plan.start == 0
+    assert plan.builds == {t: {'lwr': 1} for t in range(1, 10)}
+    assert plan.expected == [10000.0 + 1000 * t for t in range(1, 11)]
+    assert h.context.builds == [(0, 'lwr')]
+    starts = [plan.start]
+    for t in range(1, 30):
+        h.step()
+        if h.inst.plans['POWER'].start != starts[-1]:
+            starts.append(h.inst.plans['POWER'].start)
+    assert starts == [0, 10, 20]
+    assert h.context.builds == [(t, 'lwr') for t in range(30)]
+    assert all(h.inst.commodity_supply['POWER'][t] == 10000 + 1000 * t
+               for t in range(30))
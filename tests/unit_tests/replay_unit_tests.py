@@ -0,0 +1,85 @@
+import sqlite3 as lite
+import uuid
+
+import pytest
+from tools.replay import Replay, main
+
+
+def write_output(file_name):
+    con = lite.connect(file_name)
+    con.execute('create table TimeSeriessupplyPOWER '
+                '(SimId, AgentId, Time, Value)')
+    con.execute('create table TimeSeriessupplyfuel '
+                '(SimId, AgentId, Time, Value)')
+    for t in range(50):
+        for agent in (1, 2):
+            con.execute('insert into TimeSeriessupplyPOWER values '
+                        '(0, ?, ?, 5000)', (agent, t))
+        con.execute('insert into TimeSeriessupplyfuel values (0, 1, ?, ?)',
+                    (t, 100.0 + 10 * t))
+    con.commit()
+    con.close()
+
+
+def test_replay(tmp_path, capsys, stub_cyclus):
+    """ Tests if the recorded supply is streamed to the institution every
+        timestep, and if the decisions on it are returned """
+    file_name = str(tmp_path / 'output.sqlite')
+    write_output(file_name)
+    replay = Replay(file_name, 'TimeSeriesInst',
+                    {'commodities': ['POWER_lwr_1000'],
+                     'demand_eq': '10000 + 100*t', 'calc_method': 'ma',
+                     'steps': 1, 'back_steps': 1})
+    replay.run()
+    replay.close()
+    assert replay.context.time == 50
+    assert replay.inst.commodity_supply['POWER'][49] == 10000
+    # the replayed supply does not include the deployed facilities
+    assert replay.decisions()[0] == (0, 'lwr', 1)
+    assert replay.decisions()[-1] == (49, 'lwr', 5)
+    main([file_name, '{"commodities": ["fuel_sink_100"], '
+          '"calc_method": "ma", "steps": 1, "back_steps": 1}',
+          '-a', 'SupplyDrivenDeploymentInst', '-n', '10'])
+    out = capsys.readouterr().out.split()
+    assert out[0] == 'time,prototype,number'
+    assert out[1].startswith('0,sink,')
+
+
+def test_replay_simid(tmp_path, stub_cyclus):
+    """ Tests if only the simulation of the given SimId is replayed from a
+        file holding two, and if a SimId is required to replay them """
+    file_name = str(tmp_path / 'output.sqlite')
+    con = lite.connect(file_name)
+    con.execute('create table TimeSeriessupplyPOWER '
+                '(SimId, AgentId, Time, Value)')
+    sims = [uuid.UUID(int=1), uuid.UUID(int=2)]
+    for t in range(20):
+        for i, sim in enumerate(sims):
+            con.execute('insert into TimeSeriessupplyPOWER values '
+                        '(?, 1, ?, ?)', (sim.bytes, t, 1000.0 * (i + 1)))
+    con.commit()
+    con.close()
+    config = {'commodities': ['POWER_lwr_1000'], 'demand_eq': '2000',
+              'calc_method': 'ma', 'steps': 1, 'back_steps': 1}
+    with pytest.raises(ValueError):
+        Replay(file_name, 'TimeSeriesInst', config)
+    with pytest.raises(ValueError):
+        Replay(file_name, 'TimeSeriesInst', config,
+               simid=str(uuid.UUID(int=3)))
+    for sim, supply in zip(sims, [1000.0, 2000.0]):
+        replay = Replay(file_name, 'TimeSeriesInst', config,
+                        simid=str(sim).upper())
+        replay.run()
+        replay.close()
+        assert replay.context.time == 20
+        assert replay.inst.commodity_supply['POWER'][19] == supply
+
+
+def test_replay_no_time_series(tmp_path, stub_cyclus):
+    """ Tests if a file holding none of the time series the institution
+        listens to is not replayed silently """
+    file_name = str(tmp_path / 'output.sqlite')
+    write_output(file_name)
+    with pytest.raises(ValueError, match='TimeSeriessupplyfule'):
+        Replay(file_name, 'SupplyDrivenDeploymentInst',
+               {'commodities': ['fule_sink_100'], 'calc_method': 'ma'})
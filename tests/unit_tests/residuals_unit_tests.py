@@ -0,0 +1,58 @@
+import pytest
+import numpy as np
+from d3ploy.residuals import RollingQuantile, ResidualMargin
+
+
+def test_rolling_quantile():
+    """ Tests if the quantiles of the sliding window match numpy's
+        quantiles of the same values """
+    rng = np.random.RandomState(0)
+    values = rng.standard_t(2, size=500)
+    values[::7] = 1.0
+    for q in [0, 0.05, 0.5, 0.95, 1]:
+        window = RollingQuantile(size=50, q=q)
+        for i, value in enumerate(values):
+            window.add(value)
+            last = values[max(0, i - 49):i + 1]
+            assert len(window) == len(last)
+            assert window.quantile() == pytest.approx(np.quantile(last, q))
+        assert len(window.lower) + len(window.upper) <= 2 * 50 + 16
+
+
+def test_residual_margin():
+    """ Tests if a residual is only recorded once the predicted
+        timestep is observed, for each side """
+    margin = ResidualMargin(size=10, q=0.95)
+    assert margin.margin(0, 5.0, 10.0, 0.0, 0.0, 2) == 0
+    assert margin.margin(1, 5.0, 10.0, 0.0, 0.0, 2) == 0
+    assert margin.margin(2, 5.0, 10.0, 4.0, 12.0, 2) == pytest.approx(-3)
+
+
+def test_residual_margin_deployed():
+    """ Tests if the capacity deployed after a forecast is not counted as
+        a residual of the deployed side """
+    margin = ResidualMargin(size=10, q=0.95)
+    for time in range(20):
+        # the deployed side is forecast as its last value, and the builds
+        # of each timestep fill the gap to the other side
+        observed = 100.0 + 30 * time
+        assert margin.margin(time, observed, observed + 30, observed,
+                             observed, 1) == pytest.approx(0)
+        margin.deploy(30.0)
+    assert len(margin.deployed_residuals.residuals) == 10
+
+
+def test_residual_margin_deviations():
+    """ Tests if the Monte Carlo deviations bootstrap the residuals of
+        both sides, once each side has three of them """
+    margin = ResidualMargin(size=10, q=0.95)
+    rng = np.random.RandomState(0)
+    margin.record(0, 0.0, 0.0, 0.0, 0.0, 1)
+    for time in range(1, 4):
+        assert margin.deviations(100, rng) is None
+        # the deployed side is 1 above its forecast, the other 2 below
+        margin.record(time, 0.0, 0.0, 1.0, -2.0, 1)
+    x = margin.deviations(100, rng)
+    assert x.shape == (100,)
+    assert np.all(x == 3)
+    assert np.all(margin.deviations(100, rng, other=False) == 1)
@@ -0,0 +1,60 @@
+import random
+import pytest
+from d3ploy.accumulator import TimeSeriesAccumulator
+from d3ploy.retirement import RetirementSchedule, predict_with_retirement
+
+
+def test_retired():
+    """ Tests if the cumulative retired capacity follows the schedule """
+    schedule = RetirementSchedule()
+    schedule.add(10, 100)
+    schedule.add(5, 50)
+    schedule.add(10, 25)
+    assert schedule.retired(4) == 0
+    assert schedule.retired(5) == 50
+    assert schedule.retired(9) == 50
+    assert schedule.retired(10) == 175
+    schedule.remove(10, 25)
+    assert schedule.retired(20) == 150
+    assert list(schedule.retired([0, 5, 10])) == [0, 50, 150]
+
+
+def test_predict_with_retirement():
+    """ Tests if a known retirement is predicted before it is observed,
+        and is not counted twice once it is observed """
+    schedule = RetirementSchedule()
+    schedule.add(6, 1000)
+    ts = {t: 3000.0 for t in range(5)}
+    assert predict_with_retirement('ma', ts, schedule, 4,
+                                   steps=2) == pytest.approx(2000)
+    ts.update({5: 3000.0, 6: 2000.0})
+    assert predict_with_retirement('ma', ts, schedule, 6,
+                                   steps=2) == pytest.approx(2000)
+
+
+def test_corrected_incremental():
+    """ Tests if the corrected series kept for an accumulator, corrected
+        again from its last timestep and from the losses changed since,
+        matches the series corrected from scratch """
+    rng = random.Random(0)
+    schedule = RetirementSchedule()
+    ts = TimeSeriesAccumulator(size=4)
+    for time in range(200):
+        ts.listener(None, time, rng.uniform(0, 100), 'POWER')
+        if rng.random() < 0.2:
+            schedule.add(time + rng.randint(-5, 20), rng.uniform(0, 50))
+        if rng.random() < 0.05 and schedule.losses:
+            loss = rng.choice(sorted(schedule.losses))
+            schedule.remove(loss, schedule.losses[loss])
+        if rng.random() < 0.1:
+            # records of the current timestep after a decision
+            schedule.corrected(ts)
+            ts.listener(None, time, rng.uniform(0, 100), 'POWER')
+        if time == 150:
+            # a timestep recorded before the first one
+            ts[-3] = 7.0
+        corrected = schedule.corrected(ts)
+        expected = schedule.corrected(dict(ts.items()))
+        assert list(corrected.keys()) == list(expected.keys())
+        assert list(corrected.values()) == \
+            pytest.approx(list(expected.values()))
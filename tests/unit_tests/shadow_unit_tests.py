@@ -0,0 +1,69 @@
+import pytest
+from d3ploy import shadow
+from d3ploy.shadow import ShadowEvaluator, AutoSelector, backtest
+
+
+def test_shadow_evaluator():
+    """ Tests if the shadow forecasts are scored once their timestep is
+        observed, and if a failing method is counted but not raised """
+    shadow = ShadowEvaluator(['ma', 'poly', 'not_a_method'])
+    ts = {}
+    for t in range(20):
+        ts[t] = 2.0 * t
+        shadow.evaluate('supply', 'fuel', ts, t, steps=1, back_steps=5)
+    report = shadow.diagnostics()
+    assert report[('ma', 'supply', 'fuel')]['count'] == 19
+    assert report[('ma', 'supply', 'fuel')]['mae'] == pytest.approx(2.0)
+    assert report[('poly', 'supply', 'fuel')]['mae'] < 1.0
+    assert report[('not_a_method', 'supply', 'fuel')]['failures'] == 20
+    assert 'shadow_ma_supply_mae 2' in shadow.summary('fuel')
+
+
+def test_auto_selector():
+    """ Tests if auto chooses the method of lower cost rank when both are
+        exact, whatever the list order, the accurate one otherwise, and
+        keeps its choice for interval steps """
+    ts = {t: 3.0 for t in range(40)}
+    auto = AutoSelector(['poly', 'ma'], tolerance=0.1, interval=10,
+                        window=10, back_steps=5)
+    assert auto.method('supply', {0: 1.0}, 0) == 'poly'
+    assert auto.method('supply', ts, 39) == 'ma'
+    assert auto.scores['supply']['ma'][0] == pytest.approx(0.0)
+    trend = {t: 2.0 * t for t in range(40)}
+    auto = AutoSelector(['ma', 'poly'], tolerance=0.1, interval=10,
+                        window=10, back_steps=5)
+    assert auto.method('supply', trend, 39) == 'poly'
+    assert auto.scores['supply']['ma'][0] == pytest.approx(2.0)
+    assert auto.method('supply', ts, 45) == 'poly'
+
+
+def test_auto_selector_cost(monkeypatch):
+    """ Tests if auto chooses the method of lowest cost rank among the
+        accurate ones, the first listed among methods of the same rank,
+        whatever CPU time the backtests measure """
+    results = {'arma_mle': ([1.0], 0.1), 'poly': ([1.05], 3.0),
+               'arma': ([1.0], 2.0), 'ma': ([2.0], 0.1),
+               'kalman': ([1.0], 5.0)}
+    monkeypatch.setattr(shadow, 'backtest',
+                        lambda method, ts, **kwargs: results[method])
+    ts = {t: 1.0 for t in range(40)}
+    auto = AutoSelector(['arma_mle', 'poly', 'ma'], tolerance=0.1, window=10)
+    assert auto.method('supply', ts, 39) == 'poly'
+    auto = AutoSelector(['arma_mle', 'arma', 'poly'], tolerance=0.1,
+                        window=10)
+    assert auto.method('supply', ts, 39) == 'arma'
+    auto = AutoSelector(['arma_mle', 'poly', 'kalman'], tolerance=0.1,
+                        window=10)
+    assert auto.method('supply', ts, 39) == 'kalman'
+    auto = AutoSelector(['arma_mle', 'poly', 'ma'], tolerance=0.01,
+                        window=10)
+    assert auto.method('supply', ts, 39) == 'arma_mle'
+    assert auto.scores['supply']['arma_mle'] == (1.0, 0.1)
+
+
+def test_backtest():
+    """ Tests if the backtest predicts each value from the values before it """
+    errors, cpu = backtest('ma', {t: 2.0 * t for t in range(30)}, window=5,
+                           back_steps=1)
+    assert errors == pytest.approx([2.0] * 5)
+    assert cpu >= 0
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+from d3ploy.shadow import backtest
+from d3ploy.tuning import (candidates, evaluate_job, init_worker, tune,
+                           windows)
+
+
+def test_candidates():
+    """ Tests the grid and the random sample of the candidates, and if
+        only the settings the calc method takes are searched """
+    assert len(candidates([5, 10], [1, 2], [1, 2, 3])) == 12
+    sample = candidates([5, 10], [1, 2], [1, 2, 3], n_random=4)
+    assert len(sample) == 4 and len(set(sample)) == 4
+    # the settings a method does not take are not searched
+    assert candidates([5, 10], [1, 2], [1, 2, 3], method='poly') == \
+        [(5, 1, 1), (5, 2, 1), (10, 1, 1), (10, 2, 1)]
+    assert len(candidates([5, 10], [1, 2], [1, 2, 3], method='arma')) == 6
+    assert candidates([5, 10], [4, 6], [1, 2, 3],
+                      method='fast_seasonal') == [(5, 4, 1), (5, 6, 1)]
+
+
+def test_tune():
+    """ Tests if the degree matching a quadratic series is found, and if
+        the worst candidates are stopped early """
+    series = {('supply', 'fuel'): {t: 0.5 * t ** 2 for t in range(60)},
+              ('demand', 'fuel'): {t: 3.0 * t + 1 for t in range(60)}}
+    results = tune(series, 'poly', back_steps=[5, 10], degrees=[1, 2],
+                   steps=[1], rounds=2, keep=0.5, processes=1)
+    assert (results[0]['degree'], results[0]['rounds']) == (2, 2)
+    assert results[0]['error'] == pytest.approx(0.0, abs=1e-6)
+    assert results[0]['count'] == 2 * 50
+    assert [x['rounds'] for x in results].count(1) == 2
+    parallel = tune(series, 'poly', back_steps=[5, 10], degrees=[1, 2],
+                    rounds=2, processes=2)
+    assert parallel[0]['degree'] == 2
+
+
+def test_tune_full_history():
+    """ Tests if each prediction sees every value before it, whatever the
+        back_steps of the candidate, as in shadow.backtest """
+    rng = np.random.RandomState(0)
+    ts = {t: 100.0 + t + rng.normal(0, 5) for t in range(40)}
+    init_worker({'fuel': ts})
+    past = windows('fuel')
+    assert list(past[30].items()) == list(ts.items())[:30]
+    assert list(reversed(past[30])) == list(reversed(list(ts)[:30]))
+    assert 29 in past[30] and 30 not in past[30]
+    # the histories share the lists of the time series
+    assert not isinstance(past[30].values(), list)
+    for method in ['kalman', 'poly']:
+        abs_error, count, cpu = evaluate_job((method, 'fuel', 5, 1, 1, 20,
+                                              40, 1))
+        errors, cpu = backtest(method, ts, window=20, back_steps=5)
+        assert count == 20
+        assert abs_error == pytest.approx(sum(abs(e) for e in errors))
+
+
+def test_tune_common_horizon():
+    """ Tests if the candidates of different steps are scored on the same
+        value ahead, so the steps matching the largest horizon win on a
+        trend instead of the shortest steps """
+    series = {('supply', 'fuel'): {t: 10.0 + 2.0 * t for t in range(60)}}
+    results = tune(series, 'kalman', back_steps=[5], steps=[1, 3],
+                   rounds=1, processes=1)
+    assert [x['steps'] for x in results] == [3, 1]
+    assert results[0]['count'] == results[1]['count'] == 48
+    assert results[1]['error'] > 10 * results[0]['error']
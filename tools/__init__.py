@@ -0,0 +1,5 @@
+"""
+Tools to run and inspect the d3ploy institutions outside of cyclus. They
+are kept out of the d3ploy package, which cyclus imports the archetypes
+from, and are run from the root of the repository.
+"""
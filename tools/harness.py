@@ -0,0 +1,272 @@
+"""
+This harness.py file contains a stand-in for the parts of cyclus used by
+`timeseries_inst.py' and `supply_driven_deployment_inst.py', so that the
+institutions run outside of a cyclus simulation.
+
+The stand-in provides `context.time', `context.schedule_build',
+`lib.record_time_series' and `lib.TIME_SERIES_LISTENERS', the state
+variables of `cyclus.typesystem' and the agent base classes. A Harness
+runs the real institution classes over synthetic timesteps: the supply
+(or the capacity, for supply_driven_deployment_inst) of each commodity is
+the capacity of the facilities the institution built plus a generator,
+and the other series are given by generators. Each forecaster and solver
+path can then be benchmarked and profiled without cyclus.
+
+Usage:
+    harness = Harness('TimeSeriesInst',
+                      {'commodities': ['POWER_lwr_1000'],
+                       'demand_eq': '10000 + 5*t', 'calc_method': 'ma'},
+                      supply={'POWER': constant(10000)}, lifetime=720)
+    harness.run(100000)
+"""
+
+import importlib
+import math
+import random
+import sys
+import types
+from collections import defaultdict
+
+ARCHETYPES = {
+    'TimeSeriesInst': 'd3ploy.timeseries_inst',
+    'SupplyDrivenDeploymentInst': 'd3ploy.supply_driven_deployment_inst',
+}
+
+_SAVED = {}
+
+
+class StateVar(object):
+    """ State variable of an agent, read as its [default] until it is
+        set on the agent. """
+
+    def __init__(self, *args, **kwargs):
+        self.default = kwargs.get('default')
+        self.name = None
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        return obj.__dict__.get(self.name, self.default)
+
+    def __set__(self, obj, value):
+        obj.__dict__[self.name] = value
+
+
+class Agent(object):
+
+    def __init__(self, *args, **kwargs):
+        self.context = None
+        self.children = []
+
+    def enter_notify(self):
+        pass
+
+
+class Facility(object):
+    """ Facility built by the institution of a Harness. """
+
+    def __init__(self, id, prototype, enter_time, lifetime, context):
+        self.id = id
+        self.prototype = prototype
+        self.enter_time = enter_time
+        self.lifetime = lifetime
+        self.context = context
+
+
+class Context(object):
+    """ Simulation context of a Harness. The facilities scheduled at a
+        timestep are built at the next one, as in cyclus. """
+
+    def __init__(self, time=0):
+        self.time = time
+        self.scheduled = defaultdict(list)
+        self.builds = []
+
+    def schedule_build(self, agent, prototype):
+        self.scheduled[self.time + 1].append(prototype)
+        self.builds.append((self.time, prototype))
+
+
+def record_time_series(name, agent, value):
+    """ Calls the listeners of time series [name] with [value], recorded
+        by [agent] at the current time of its context. """
+    for listener in TIME_SERIES_LISTENERS[name]:
+        listener(agent, agent.context.time, value, name)
+
+
+TIME_SERIES_LISTENERS = defaultdict(list)
+
+
+def stub_modules():
+    """ Returns the stand-in modules of cyclus, keyed by module name. """
+    cyclus = types.ModuleType('cyclus')
+    cyclus.__stub__ = True
+    agents = types.ModuleType('cyclus.agents')
+    agents.Agent = Agent
+    agents.Institution = type('Institution', (Agent,), {})
+    agents.Facility = type('Facility', (Agent,), {})
+    agents.Region = type('Region', (Agent,), {})
+    lib = types.ModuleType('cyclus.lib')
+    lib.TIME_SERIES_LISTENERS = TIME_SERIES_LISTENERS
+    lib.record_time_series = record_time_series
+    typesystem = types.ModuleType('cyclus.typesystem')
+    for name in ['Int', 'Double', 'Float', 'String', 'Bool', 'VectorString',
+                 'VectorInt', 'VectorDouble', 'MapStringDouble',
+                 'MapStringString']:
+        setattr(typesystem, name, type(name, (StateVar,), {}))
+    cyclus.agents = agents
+    cyclus.lib = lib
+    cyclus.typesystem = typesystem
+    return {'cyclus': cyclus, 'cyclus.agents': agents, 'cyclus.lib': lib,
+            'cyclus.typesystem': typesystem}
+
+
+def install():
+    """ Replaces cyclus by the stand-in modules in sys.modules. """
+    if getattr(sys.modules.get('cyclus'), '__stub__', False):
+        return
+    for name, module in stub_modules().items():
+        _SAVED[name] = sys.modules.get(name)
+        sys.modules[name] = module
+
+
+def uninstall():
+    """ Restores the cyclus modules replaced by install. """
+    for name, module in _SAVED.items():
+        if module is None:
+            sys.modules.pop(name, None)
+        else:
+            sys.modules[name] = module
+    _SAVED.clear()
+
+
+def load(archetype):
+    """ Returns the class of [archetype], imported with the stand-in
+        modules of cyclus. """
+    install()
+    name = ARCHETYPES[archetype]
+    module = sys.modules.get(name)
+    if module is None:
+        module = importlib.import_module(name)
+    elif module.lib is not sys.modules['cyclus.lib']:
+        module = importlib.reload(module)
+    return getattr(module, archetype)
+
+
+def constant(value):
+    """ Returns a generator of [value] at every timestep. """
+    return lambda t: value
+
+
+def linear(start, slope):
+    """ Returns a generator of [start] + [slope] * t. """
+    return lambda t: start + slope * t
+
+
+def seasonal(mean, amplitude, period):
+    """ Returns a generator oscillating around [mean] with [amplitude]
+        and [period] timesteps. """
+    return lambda t: mean + amplitude * math.sin(2 * math.pi * t / period)
+
+
+def noisy(generator, std_dev, seed=0):
+    """ Returns [generator] with normal noise of [std_dev] added. """
+    rng = random.Random(seed)
+    return lambda t: generator(t) + rng.gauss(0, std_dev)
+
+
+class Harness(object):
+    """
+    Runs an institution of class [archetype], with state variables
+    [config], outside of cyclus.
+    Parameters
+    ----------
+    supply, demand : dictionaries
+        key: commodity
+        value: generator, a function of the timestep returning the value
+        recorded in the supply or demand time series of the commodity,
+        to which the facilities built by the institution add their
+        capacity
+    lifetime : int
+        lifetime of the facilities built by the institution, or -1 if
+        they never retire
+    """
+
+    def __init__(self, archetype, config, supply=None, demand=None,
+                 lifetime=-1, start=0):
+        cls = load(archetype)
+        TIME_SERIES_LISTENERS.clear()
+        self.context = Context(start)
+        self.inst = cls()
+        self.inst.context = self.context
+        for key, value in config.items():
+            setattr(self.inst, key, value)
+        self.inst.enter_notify()
+        self.source = Facility(-1, 'source', start, -1, self.context)
+        self.generators = {'supply': dict(supply or {}),
+                           'demand': dict(demand or {})}
+        # the facilities built by timeseries_inst supply their commodity,
+        # the ones built by supply_driven_deployment_inst consume it
+        self.built_side = 'supply' if archetype == 'TimeSeriesInst' \
+            else 'demand'
+        self.lifetime = lifetime
+        self.capacity = defaultdict(float)
+        self.retiring = defaultdict(list)
+        self.next_id = 0
+
+    def step(self):
+        """ Runs one timestep: builds the scheduled facilities, records
+            the time series, and runs the tick and decision of the
+            institution. """
+        time = self.context.time
+        for proto in self.context.scheduled.pop(time, []):
+            self.build(proto, time)
+        self.record(time)
+        self.inst.tick()
+        self.inst.decision()
+        for child in self.retiring.pop(time, []):
+            self.decommission(child)
+        self.context.time += 1
+
+    def record(self, time):
+        """ Records the supply and demand time series of [time]. """
+        commods = set(self.capacity) | set(self.generators['supply']) | \
+            set(self.generators['demand'])
+        for side in ('supply', 'demand'):
+            for commod in commods:
+                value = 0.0
+                if side == self.built_side:
+                    value += self.capacity[commod]
+                if commod in self.generators[side]:
+                    value += self.generators[side][commod](time)
+                if value != 0.0 or side == self.built_side:
+                    record_time_series(side + commod, self.source, value)
+
+    def run(self, steps):
+        """ Runs [steps] timesteps and returns the builds, a list of
+            (timestep of the decision, prototype). """
+        for i in range(steps):
+            self.step()
+        return self.context.builds
+
+    def build(self, proto, time):
+        child = Facility(self.next_id, proto, time, self.lifetime,
+                         self.context)
+        self.next_id += 1
+        self.inst.children.append(child)
+        self.inst.build_notify(child)
+        for commod, proto_dict in self.inst.deploy_commodity_dict.items():
+            if proto in proto_dict:
+                self.capacity[commod] += proto_dict[proto]['cap']
+        if self.lifetime > 0:
+            self.retiring[time + self.lifetime - 1].append(child)
+
+    def decommission(self, child):
+        self.inst.children.remove(child)
+        self.inst.decom_notify(child)
+        for commod, proto_dict in self.inst.deploy_commodity_dict.items():
+            if child.prototype in proto_dict:
+                self.capacity[commod] -= proto_dict[child.prototype]['cap']
@@ -0,0 +1,168 @@
+"""
+This replay.py file contains the replay of the supply and demand recorded
+in the output of a cyclus simulation through a `timeseries_inst.py' or
+`supply_driven_deployment_inst.py' configuration, outside of cyclus.
+
+The recorded time series the institution listens to are streamed from
+the sqlite file timestep by timestep, one cursor per table, and the
+institution makes its deployment decisions on them through the stand-in
+context of `harness.py'. The replayed series are the ones of the
+recorded simulation: the facilities the replay deploys do not change
+them, so the decisions of several configurations are compared on the
+same history. A file holding several simulations is replayed one
+simulation at a time, given by its SimId.
+
+Usage:
+    python -m tools.replay output.sqlite config.json -o decisions.csv
+"""
+
+import argparse
+import csv
+import json
+import sqlite3 as lite
+import sys
+from collections import Counter
+
+from d3ploy.backtest import check_simid, format_simid
+from tools.harness import Harness, TIME_SERIES_LISTENERS, record_time_series
+
+
+class Replay(Harness):
+    """
+    Replays the time series recorded in cyclus output file [file_name]
+    through an institution of class [archetype] with state variables
+    [config]. The facilities it deploys retire after [lifetime]
+    timesteps, or never if -1. [simid] is the SimId of the simulation
+    replayed, needed if the file holds several simulations.
+    """
+
+    def __init__(self, file_name, archetype, config, lifetime=-1,
+                 simid=None):
+        super().__init__(archetype, config, lifetime=lifetime)
+        self.con = lite.connect(file_name)
+        try:
+            self.streams = self.open_streams(file_name, simid)
+        except Exception:
+            self.con.close()
+            raise
+
+    def open_streams(self, file_name, simid):
+        """ Returns a stream, [name, cursor, next row], of the recorded
+            time series of simulation [simid] for each time series the
+            institution listens to. """
+        tables = {}
+        for (table,) in self.con.execute(
+                "select name from sqlite_master where type = 'table'"):
+            tables[table.lower()] = table
+        selected = []
+        simids = {}
+        for name in sorted(TIME_SERIES_LISTENERS):
+            table = tables.get('timeseries' + name.lower())
+            if table is None:
+                continue
+            selected.append((name, table))
+            for (sim,) in self.con.execute(
+                    'select distinct SimId from "%s"' % table):
+                simids[format_simid(sim)] = sim
+        if len(selected) == 0:
+            raise ValueError(
+                '%s holds none of the time series the institution listens '
+                'to: %s.' % (file_name, ', '.join(
+                    'TimeSeries' + name
+                    for name in sorted(TIME_SERIES_LISTENERS))))
+        simid = check_simid(file_name, simids, simid)
+        streams = []
+        for name, table in selected:
+            cursor = self.con.cursor()
+            if simid is None:
+                cursor.execute('select time, sum(value) from "%s" '
+                               'group by time order by time' % table)
+            else:
+                cursor.execute('select time, sum(value) from "%s" '
+                               'where SimId = ? group by time order by time'
+                               % table, (simids[simid],))
+            streams.append([name, cursor, next(cursor, None)])
+        return streams
+
+    def record(self, time):
+        """ Records the values of [time] of the streamed time series. """
+        for stream in self.streams:
+            name, cursor, row = stream
+            while row is not None and row[0] <= time:
+                if row[0] == time:
+                    record_time_series(name, self.source, row[1])
+                row = next(cursor, None)
+            stream[2] = row
+
+    def done(self):
+        """ Returns whether every streamed time series has ended. """
+        return all(row is None for name, cursor, row in self.streams)
+
+    def run(self, steps=None):
+        """ Runs [steps] timesteps, or until every streamed time series
+            has ended, and returns the builds, a list of (timestep of
+            the decision, prototype). """
+        while not self.done() and (steps is None or steps > 0):
+            self.step()
+            if steps is not None:
+                steps -= 1
+        return self.context.builds
+
+    def decisions(self):
+        """ Returns the number of facilities of each prototype deployed
+            at each timestep, as a list of (time, prototype, number). """
+        counts = Counter(self.context.builds)
+        return [(time, proto, counts[(time, proto)])
+                for time, proto in sorted(counts)]
+
+    def close(self):
+        self.con.close()
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description='Replays the supply and demand recorded in a cyclus '
+                    'output file through an institution configuration and '
+                    'writes its deployment decisions.')
+    parser.add_argument('file', help='cyclus sqlite output file')
+    parser.add_argument('config',
+                        help='json file, or json string, of the state '
+                             'variables of the institution')
+    parser.add_argument('-a', '--archetype', default='TimeSeriesInst',
+                        choices=['TimeSeriesInst',
+                                 'SupplyDrivenDeploymentInst'])
+    parser.add_argument('-l', '--lifetime', type=int, default=-1,
+                        help='lifetime of the deployed facilities')
+    parser.add_argument('--simid', default=None,
+                        help='SimId of the simulation to replay, needed if '
+                             'the file holds several simulations')
+    parser.add_argument('-n', '--steps', type=int, default=None,
+                        help='number of timesteps to replay, all if not '
+                             'given')
+    parser.add_argument('-o', '--output', default=None,
+                        help='csv file of the decisions, stdout if not '
+                             'given')
+    args = parser.parse_args(args)
+    if args.config.lstrip().startswith('{'):
+        config = json.loads(args.config)
+    else:
+        with open(args.config) as f:
+            config = json.load(f)
+    replay = Replay(args.file, args.archetype, config,
+                    lifetime=args.lifetime, simid=args.simid)
+    try:
+        replay.run(args.steps)
+    finally:
+        replay.close()
+    f = sys.stdout if args.output is None else open(args.output, 'w')
+    try:
+        writer = csv.writer(f)
+        writer.writerow(['time', 'prototype', 'number'])
+        writer.writerows(replay.decisions())
+    finally:
+        if f is not sys.stdout:
+            f.close()
+
+
+if __name__ == '__main__':
+    main()